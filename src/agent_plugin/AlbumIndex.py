@@ -0,0 +1,275 @@
+import atexit
+import os
+import sqlite3
+import threading
+from datetime import datetime
+from pathlib import Path
+
+from agent_plugin.StatePaths import state_dir
+
+# Term kinds of the index and the result fields they are read from, by stage
+KINDS = ("object", "tag", "entity", "year", "month")
+STAGE_FIELDS = {
+    "object_detection": (("object", "objects"),),
+    "video_object_detection": (("object", "objects"),),
+    "vision_analysis": (("tag", "tags"), ("entity", "named_entities")),
+}
+DATE_STAGE = "date"
+
+MONTH_NAMES = [datetime(2000, month, 1).strftime("%B").lower() for month in range(1, 13)]
+
+# Indexes opened in this process, keyed by database path
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_album_index(sample_dir) -> "AlbumIndex":
+    """
+    Returns the process-wide album index for the given sample directory.
+
+    The database lives at ALBUM_INDEX_PATH when set, otherwise at album_index.db in the state folder (see
+    StatePaths.state_dir), which survives the reset of the sample folder.
+    """
+    db_path = os.getenv("ALBUM_INDEX_PATH") or os.path.join(state_dir(), "album_index.db")
+    db_path = os.path.abspath(db_path)
+    with _indexes_lock:
+        if db_path not in _indexes:
+            _indexes[db_path] = AlbumIndex(db_path)
+        return _indexes[db_path]
+
+
+def _close_all_indexes():
+    with _indexes_lock:
+        for index in _indexes.values():
+            index.close()
+        _indexes.clear()
+
+
+atexit.register(_close_all_indexes)
+
+
+def normalize_term(kind: str, value) -> str:
+    """Returns the indexed form of a term: lower-case text, 'YYYY' years and two-digit months."""
+    if isinstance(value, dict):
+        value = value.get("name") or value.get("text") or value.get("value") or ""
+    value = str(value).strip().lower()
+    if kind == "month":
+        if value in MONTH_NAMES:
+            return f"{MONTH_NAMES.index(value) + 1:02d}"
+        if value.isdigit():
+            return f"{int(value):02d}"
+    return value
+
+
+def date_terms(file_path):
+    """
+    Returns the (year, month) terms of an album file from its {year}/{month} folders, falling back to its
+    modification time, or an empty list when neither is available.
+    """
+    parts = Path(file_path).parts
+    if len(parts) >= 3 and parts[-3].isdigit() and parts[-2].lower() in MONTH_NAMES:
+        year, month = parts[-3], parts[-2]
+    else:
+        try:
+            modified = datetime.fromtimestamp(os.stat(file_path).st_mtime)
+        except OSError:
+            return []
+        year, month = str(modified.year), str(modified.month)
+    return [("year", normalize_term("year", year)), ("month", normalize_term("month", month))]
+
+
+def record_terms(stage: str, result: dict):
+    """Returns the (kind, value) terms of one results store record."""
+    terms = set()
+    for kind, field in STAGE_FIELDS.get(stage, ()):
+        for value in result.get(field) or []:
+            value = normalize_term(kind, value)
+            if value:
+                terms.add((kind, value))
+    return terms
+
+
+# class for the inverted album index
+class AlbumIndex:
+    """
+    An inverted index from object classes, tags, named entities, years and months to album files, kept in SQLite.
+
+    Postings are clustered by term (a WITHOUT ROWID table keyed by term, file and stage), so a lookup reads only
+    the files of the searched terms, whatever the size of the album. The index follows the results store
+    incrementally: update() only reads the records written since the previous update, by their sequence number
+    in the store, and replaces the postings of those files and stages; it never rebuilds. Files that leave the
+    album through the organizer are dropped by remove_file(); files deleted by other means are dropped the first
+    time a search finds them missing.
+    """
+
+    def __init__(self, db_path: str):
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self.db_path = db_path
+        self._lock = threading.RLock()
+        self._term_ids = {}
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS files (
+                id INTEGER PRIMARY KEY,
+                path TEXT NOT NULL UNIQUE
+            );
+            CREATE TABLE IF NOT EXISTS terms (
+                id INTEGER PRIMARY KEY,
+                kind TEXT NOT NULL,
+                value TEXT NOT NULL,
+                UNIQUE (kind, value)
+            );
+            CREATE TABLE IF NOT EXISTS postings (
+                term_id INTEGER NOT NULL,
+                file_id INTEGER NOT NULL,
+                stage TEXT NOT NULL,
+                PRIMARY KEY (term_id, file_id, stage)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS idx_postings_file ON postings(file_id, stage);
+            CREATE TABLE IF NOT EXISTS state (
+                key TEXT PRIMARY KEY,
+                value REAL NOT NULL
+            );
+            """
+        )
+        self._conn.commit()
+
+    def __file_id(self, file_path) -> int:
+        self._conn.execute("INSERT OR IGNORE INTO files (path) VALUES (?)", (file_path,))
+        return self._conn.execute("SELECT id FROM files WHERE path = ?", (file_path,)).fetchone()[0]
+
+    def __term_id(self, kind, value) -> int:
+        term_id = self._term_ids.get((kind, value))
+        if term_id is None:
+            self._conn.execute("INSERT OR IGNORE INTO terms (kind, value) VALUES (?, ?)", (kind, value))
+            term_id = self._conn.execute("SELECT id FROM terms WHERE kind = ? AND value = ?", (kind, value)).fetchone()[0]
+            self._term_ids[(kind, value)] = term_id
+        return term_id
+
+    def __replace(self, file_path, stage, terms):
+        file_id = self.__file_id(file_path)
+        self._conn.execute("DELETE FROM postings WHERE file_id = ? AND stage = ?", (file_id, stage))
+        self._conn.executemany(
+            "INSERT OR IGNORE INTO postings (term_id, file_id, stage) VALUES (?, ?, ?)",
+            [(self.__term_id(kind, value), file_id, stage) for kind, value in terms],
+        )
+
+    def __index(self, file_path, stage, result):
+        self.__replace(file_path, stage, record_terms(stage, result))
+        self.__replace(file_path, DATE_STAGE, date_terms(file_path))
+
+    def index_file(self, file_path, stage: str, result: dict) -> None:
+        """Replaces the postings of one file for {stage} with the terms of its {result}, plus its year and month."""
+        with self._lock:
+            try:
+                with self._conn:
+                    self.__index(os.path.abspath(str(file_path)), stage, result)
+            except BaseException:
+                self._term_ids.clear()  # ids of rolled back terms
+                raise
+
+    def remove_file(self, file_path) -> None:
+        """Drops a file that left the album from the index."""
+        file_path = os.path.abspath(str(file_path))
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT id FROM files WHERE path = ?", (file_path,)).fetchone()
+            if row is not None:
+                self._conn.execute("DELETE FROM postings WHERE file_id = ?", (row[0],))
+                self._conn.execute("DELETE FROM files WHERE id = ?", (row[0],))
+
+    def __update(self, store, after):
+        indexed = 0
+        latest = after
+        with self._conn:
+            for record in store.query(after=after):
+                latest = record["seq"]
+                if record["stage"] not in STAGE_FIELDS:
+                    continue
+                self.__index(record["path"], record["stage"], record["result"])
+                indexed += 1
+            if latest is not None:
+                self._conn.execute("INSERT OR REPLACE INTO state (key, value) VALUES ('indexed_seq', ?)", (latest,))
+        return indexed
+
+    def update(self, store) -> int:
+        """
+        Indexes the records written to the results {store} since the last update.
+
+        Returns:
+            int: the number of records indexed.
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM state WHERE key = 'indexed_seq'").fetchone()
+            try:
+                return self.__update(store, int(row[0]) if row else None)
+            except BaseException:
+                self._term_ids.clear()  # ids of rolled back terms
+                raise
+
+    def search(self, limit: int = None, **criteria) -> list:
+        """
+        Returns the album paths matching every criterion, sorted.
+
+        Criteria are keyword arguments named after the term kinds (object, tag, entity, year, month) or 'any'
+        (matches any kind); each takes one value or a list of values, all of which must match. Example:
+            search(object="dog", year=2021)
+        """
+        term_sets = []
+        for kind, values in criteria.items():
+            if values is None:
+                continue
+            if kind != "any" and kind not in KINDS:
+                raise ValueError(f"Unknown index term kind '{kind}'. Valid kinds: {', '.join(KINDS)}, any")
+            for value in values if isinstance(values, (list, tuple, set)) else [values]:
+                with self._lock:
+                    if kind == "any":
+                        rows = self._conn.execute("SELECT id FROM terms WHERE value = ?",
+                                                  (normalize_term("tag", value),)).fetchall()
+                    else:
+                        rows = self._conn.execute("SELECT id FROM terms WHERE kind = ? AND value = ?",
+                                                  (kind, normalize_term(kind, value))).fetchall()
+                if not rows:
+                    return []
+                term_sets.append([row[0] for row in rows])
+        if not term_sets:
+            return []
+
+        # One sub-select per criterion, intersected; each reads only the postings of its terms
+        subqueries = []
+        params = []
+        for term_ids in term_sets:
+            subqueries.append(f"SELECT file_id FROM postings WHERE term_id IN ({', '.join('?' * len(term_ids))})")
+            params += term_ids
+        sql = f"SELECT path FROM files WHERE id IN ({' INTERSECT '.join(subqueries)}) ORDER BY path"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        with self._lock:
+            paths = [row[0] for row in self._conn.execute(sql, params).fetchall()]
+        # Files deleted outside the organizer, e.g. by the reset of the sample folder, are dropped as they are found
+        missing = [path for path in paths if not os.path.exists(path)]
+        if missing:
+            for path in missing:
+                self.remove_file(path)
+            return self.search(limit, **criteria)
+        return paths
+
+    def terms(self, kind: str, limit: int = 50) -> list:
+        """Returns the most frequent (value, file count) pairs of a term kind."""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT terms.value, COUNT(DISTINCT postings.file_id) AS files FROM terms "
+                "JOIN postings ON postings.term_id = terms.id WHERE terms.kind = ? "
+                "GROUP BY terms.id ORDER BY files DESC, terms.value LIMIT ?",
+                (kind, limit),
+            ).fetchall()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.commit()
+                self._conn.close()
+                self._conn = None
@@ -0,0 +1,356 @@
+import errno
+import filecmp
+import json
+import os
+import shutil
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+from agent_plugin.WorkerPool import map_unordered
+
+# Journal records are fsync'ed in groups of this size while moves are applied
+JOURNAL_SYNC_EVERY = 200
+
+# Move errors that fail the same way on every retry: the file is journaled as failed and left where it is
+PERMANENT_MOVE_ERRORS = (FileNotFoundError, PermissionError, IsADirectoryError, NotADirectoryError, shutil.Error)
+PERMANENT_MOVE_ERRNOS = (errno.ENAMETOOLONG, errno.EROFS, errno.EINVAL)
+
+
+def is_permanent_error(error) -> bool:
+    """Returns True when retrying the failed move cannot help, e.g. its source vanished or is not readable."""
+    return isinstance(error, PERMANENT_MOVE_ERRORS) or getattr(error, "errno", None) in PERMANENT_MOVE_ERRNOS
+
+
+def album_folder(timestamp: float):
+    """Returns the (year, month name) album folder for a file modification time."""
+    last_modified = datetime.fromtimestamp(timestamp)
+    return str(last_modified.year), last_modified.strftime("%B")  # Full month name
+
+
+# class for crash-safe album organization
+class AlbumOrganizer:
+    """
+    Organizes media files into {album}/{year}/{month} in two phases.
+
+    plan() scans the source tree once with os.scandir and computes every move, resolving name collisions
+    up front. apply() creates each target directory once, moves files concurrently and records progress
+    in a JSON-lines journal, written before the first move. An interrupted run can be resumed or rolled
+    back from the journal alone, without rescanning the library.
+
+    Streaming callers that receive files one at a time use a session instead: begin(), organize_one() per
+    file, then end(). Each move is journaled right before it is applied, so resume() and rollback() work the same.
+
+    A move that can never succeed (see is_permanent_error) is journaled as failed and does not hold the journal
+    back; only moves worth retrying (e.g. a busy or full disk) leave it pending for resume().
+    """
+
+    def __init__(self, journal_path, max_workers=None):
+        self.journal_path = Path(journal_path)
+        self.max_workers = max_workers
+        self._journal = None
+        self._journal_lock = threading.Lock()
+        self._unsynced = 0
+        self._moved = 0
+        self._retry_pending = False
+        self._session_targets = None
+        self._session_lock = threading.Lock()
+        self._next_id = 0
+
+    def __scan(self, source_dir):
+        stack = [source_dir]
+        while stack:
+            with os.scandir(stack.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        yield entry
+
+    def __resolve_collision(self, source, target, planned_targets):
+        """
+        Returns the target to use for {source}: the planned one, a renamed one when a different file already
+        holds the name, or None when an identical file is already there.
+        """
+        candidate = target
+        index = 1
+        while candidate in planned_targets or os.path.exists(candidate):
+            if candidate not in planned_targets and filecmp.cmp(source, candidate, shallow=False):
+                return None
+            stem, suffix = os.path.splitext(target)
+            candidate = f"{stem} ({index}){suffix}"
+            index += 1
+        return candidate
+
+    def plan(self, source_dir, target_dir, skip_names=(), files=None):
+        """
+        Builds the move plan for every file under {source_dir}.
+
+        {files} may provide the already scanned MediaFile records of {source_dir}; otherwise the folder is
+        scanned here.
+
+        Returns:
+            tuple: (moves, skipped) where moves is a list of {'src', 'dst'} dicts and skipped lists
+            (path, reason) for files that will not be moved.
+        """
+        skip_names = set(skip_names)
+        moves = []
+        skipped = []
+        planned_targets = set()
+        if files is not None:
+            candidates = ((media_file.path, media_file.name, media_file.mtime) for media_file in files)
+        else:
+            candidates = ((entry.path, entry.name, entry.stat().st_mtime) for entry in self.__scan(str(source_dir)))
+        for file_path, name, mtime in candidates:
+            if name in skip_names:
+                skipped.append((file_path, "unprocessed"))
+                continue
+            year, month = album_folder(mtime)
+            target = os.path.join(str(target_dir), year, month, name)
+            resolved = self.__resolve_collision(file_path, target, planned_targets)
+            if resolved is None:
+                skipped.append((file_path, f"identical file already at {target}"))
+                continue
+            planned_targets.add(resolved)
+            moves.append({"src": file_path, "dst": resolved})
+        return moves, skipped
+
+    def __open_journal(self, mode, moved=0):
+        self._journal = open(self.journal_path, mode, encoding="utf-8")
+        self._unsynced = 0
+        self._moved = moved
+        self._retry_pending = False
+
+    def __write(self, record, sync=False):
+        with self._journal_lock:
+            self._journal.write(json.dumps(record) + "\n")
+            self._unsynced += 1
+            if record["op"] == "done":
+                self._moved += 1
+            if sync or self._unsynced >= JOURNAL_SYNC_EVERY:
+                self._journal.flush()
+                os.fsync(self._journal.fileno())
+                self._unsynced = 0
+
+    def __close_journal(self, committed):
+        """Closes the journal; it is committed unless {committed} is False or a failed move is worth retrying."""
+        committed = committed and not self._retry_pending
+        self.__write({"op": "commit" if committed else "pause", "time": time.time()}, sync=True)
+        self._journal.close()
+        self._journal = None
+        if committed and self._moved > 0:
+            # Keep the finished journal for auditing, out of the way of the next run
+            archive = self.journal_path.with_name(f"{self.journal_path.stem}.{int(time.time())}.done")
+            os.replace(self.journal_path, archive)
+        elif committed:
+            os.remove(self.journal_path)
+        return committed
+
+    def __record_failure(self, move, error):
+        if is_permanent_error(error):
+            self.__write({"op": "failed", "id": move["id"], "error": str(error)})
+        else:
+            self._retry_pending = True
+
+    def __move(self, move):
+        if not os.path.exists(move["src"]) and os.path.exists(move["dst"]):
+            return move  # already moved before an interruption
+        shutil.move(move["src"], move["dst"])
+        return move
+
+    def __run(self, moves, on_moved=None):
+        # Create every target directory once, before the concurrent moves
+        for directory in {os.path.dirname(move["dst"]) for move in moves}:
+            os.makedirs(directory, exist_ok=True)
+
+        moved = 0
+        failed = []
+        for move, _, error in map_unordered(self.__move, moves, self.max_workers):
+            if error is not None:
+                failed.append((move["src"], str(error)))
+                self.__record_failure(move, error)
+                continue
+            self.__write({"op": "done", "id": move["id"]})
+            moved += 1
+            if on_moved is not None:
+                on_moved(move["src"], move["dst"])
+        return moved, failed
+
+    def apply(self, moves, on_moved=None):
+        """
+        Journals the full plan, then applies the moves concurrently.
+
+        Returns:
+            tuple: (moved count, failed list of (path, error)). The journal stays pending only when a failed move is
+            worth retrying (see has_pending).
+        """
+        if self.has_pending():
+            raise RuntimeError(f"An interrupted organization is pending in {self.journal_path}; "
+                               f"run 'python organize_journal.py resume', 'skip' or 'rollback' first.")
+        self.journal_path.parent.mkdir(parents=True, exist_ok=True)
+        self.__open_journal("w")
+        for move_id, move in enumerate(moves):
+            move["id"] = move_id
+            self.__write({"op": "move", **move})
+        self.__write({"op": "planned", "count": len(moves)}, sync=True)
+        try:
+            moved, failed = self.__run(moves, on_moved)
+        except BaseException:
+            self.__close_journal(committed=False)
+            raise
+        self.__close_journal(committed=True)
+        return moved, failed
+
+    def begin(self):
+        """Opens a streaming session; files are then planned and moved one at a time by organize_one()."""
+        if self.has_pending():
+            raise RuntimeError(f"An interrupted organization is pending in {self.journal_path}; "
+                               f"run 'python organize_journal.py resume', 'skip' or 'rollback' first.")
+        self.journal_path.parent.mkdir(parents=True, exist_ok=True)
+        self.__open_journal("w")
+        # The plan grows while the session runs: every journaled move is eligible for resume/rollback
+        self.__write({"op": "planned", "count": None}, sync=True)
+        self._session_targets = set()
+        self._next_id = 0
+
+    def organize_one(self, file_path, name, mtime, target_dir, on_moved=None):
+        """
+        Moves one file into {target_dir}/{year}/{month} within a session.
+
+        Returns:
+            str: the new path of the file, or None when an identical file is already there.
+        """
+        target = os.path.join(str(target_dir), *album_folder(mtime), name)
+        # Collisions are resolved under the lock, so concurrent callers never pick the same target
+        with self._session_lock:
+            resolved = self.__resolve_collision(file_path, target, self._session_targets)
+            if resolved is None:
+                return None
+            self._session_targets.add(resolved)
+            move = {"id": self._next_id, "src": file_path, "dst": resolved}
+            self._next_id += 1
+        self.__write({"op": "move", **move})
+        try:
+            os.makedirs(os.path.dirname(resolved), exist_ok=True)
+            self.__move(move)
+        except Exception as e:
+            self.__record_failure(move, e)
+            raise
+        self.__write({"op": "done", "id": move["id"]})
+        if on_moved is not None:
+            on_moved(file_path, resolved)
+        return resolved
+
+    def end(self, committed=True):
+        """
+        Closes the session; the journal is kept for resume/rollback when not {committed} or when a failed move is
+        worth retrying. Returns True when the journal was committed.
+        """
+        self._session_targets = None
+        return self.__close_journal(committed)
+
+    def __load(self):
+        moves, done, failed, planned = {}, set(), set(), False
+        with open(self.journal_path, "r", encoding="utf-8") as journal:
+            for line in journal:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    break  # torn last line from a crash
+                if record["op"] == "move":
+                    moves[record["id"]] = record
+                elif record["op"] == "planned":
+                    planned = True
+                elif record["op"] == "done":
+                    done.add(record["id"])
+                elif record["op"] == "failed":
+                    failed.add(record["id"])
+        return moves, done, failed, planned
+
+    def has_pending(self) -> bool:
+        return self.journal_path.exists()
+
+    def resume(self, on_moved=None):
+        """
+        Applies the moves of an interrupted run that are not journaled as done, nor as failed for good.
+
+        Returns:
+            tuple: (moved count, failed list), or None when there is nothing to resume. The journal stays pending
+            when a failed move is worth retrying; skip() or rollback() then closes it.
+        """
+        if not self.has_pending():
+            return None
+        moves, done, failed, planned = self.__load()
+        if not planned:
+            # Crashed while writing the plan: no file was moved yet
+            os.remove(self.journal_path)
+            return 0, []
+        remaining = [move for move_id, move in sorted(moves.items()) if move_id not in done and move_id not in failed]
+        self.__open_journal("a", moved=len(done))
+        try:
+            moved, failed = self.__run(remaining, on_moved)
+        except BaseException:
+            self.__close_journal(committed=False)
+            raise
+        self.__close_journal(committed=True)
+        return moved, failed
+
+    def finish_pending(self, on_moved=None) -> None:
+        """
+        Resumes an interrupted run, if any, before new moves are planned.
+
+        Raises:
+            RuntimeError: moves worth retrying failed again; the message names the ways out.
+        """
+        if not self.has_pending():
+            return
+        print(f"Resuming interrupted photo organization from {self.journal_path}")
+        moved, failed = self.resume(on_moved)
+        print(f"Resumed organization moved {moved} files, {len(failed)} failed.")
+        for file_path, error in failed:
+            print(f"ERROR: Unable to move {file_path}: {error}")
+        if self.has_pending():
+            cause = f" ({failed[0][0]}: {failed[0][1]})" if failed else ""
+            raise RuntimeError(f"The interrupted organization in {self.journal_path} still has moves to retry{cause}. "
+                               f"Fix the cause and run again, or run 'python organize_journal.py skip' to leave "
+                               f"those files where they are, or 'python organize_journal.py rollback' to undo it.")
+
+    def skip(self):
+        """
+        Gives up the moves of an interrupted run that are not journaled as done, leaving those files where they
+        are, and commits the journal. The moves already done are kept.
+
+        Returns:
+            int: the number of moves given up, or None when there is nothing pending.
+        """
+        if not self.has_pending():
+            return None
+        moves, done, failed, _ = self.__load()
+        remaining = [move for move_id, move in sorted(moves.items()) if move_id not in done and move_id not in failed]
+        self.__open_journal("a", moved=len(done))
+        for move in remaining:
+            self.__write({"op": "failed", "id": move["id"], "error": "skipped"})
+        self.__close_journal(committed=True)
+        return len(remaining)
+
+    def rollback(self, on_moved=None):
+        """
+        Moves every file of an interrupted run back to its source location and discards the journal.
+
+        Returns:
+            int: the number of files moved back, or None when there is nothing to roll back.
+        """
+        if not self.has_pending():
+            return None
+        moves, done, _, _ = self.__load()
+        restored = 0
+        for move_id, move in sorted(moves.items(), reverse=True):
+            if move_id in done or (os.path.exists(move["dst"]) and not os.path.exists(move["src"])):
+                os.makedirs(os.path.dirname(move["src"]), exist_ok=True)
+                shutil.move(move["dst"], move["src"])
+                restored += 1
+                if on_moved is not None:
+                    on_moved(move["dst"], move["src"])
+        os.remove(self.journal_path)
+        return restored
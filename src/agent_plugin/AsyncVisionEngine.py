@@ -0,0 +1,267 @@
+import asyncio
+import base64
+import json
+import mimetypes
+import random
+import time
+
+import openai
+
+from agent_plugin.Metrics import get_metrics
+from agent_plugin.ResponseCache import ResponseCache, content_hash
+
+
+def encode_image_to_base64(image_path):
+    """Returns (base64 string, MIME type) of the original image file."""
+    mime_type = mimetypes.guess_type(image_path)[0] or "image/jpeg"
+    with open(image_path, "rb") as image_file:
+        return base64.b64encode(image_file.read()).decode('utf-8'), mime_type
+
+
+def parse_structured_analysis(content):
+    """
+    Parses and validates a {'summary', 'tags', 'named_entities'} JSON response.
+
+    Returns:
+        dict: the validated fields as lists of strings, or None if the response does not match the schema.
+    """
+    try:
+        data = json.loads(content)
+    except (TypeError, json.JSONDecodeError):
+        return None
+    if not isinstance(data, dict):
+        return None
+    analysis = {}
+    for field in ("summary", "tags", "named_entities"):
+        value = data.get(field, [] if field == "named_entities" else None)
+        if isinstance(value, str):
+            value = [value]
+        if not isinstance(value, list) or not all(isinstance(item, str) for item in value):
+            return None
+        analysis[field] = value
+    if not analysis["summary"] or not analysis["tags"]:
+        return None
+    return analysis
+
+
+def retry_after_seconds(error):
+    """
+    Returns the delay requested by the service through the retry-after-ms / retry-after headers, or None.
+    """
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError:
+        # retry-after may also be an HTTP date; fall back to exponential backoff
+        return None
+    return None
+
+
+# class for concurrent Azure OpenAI vision analysis
+class AsyncVisionEngine:
+    """
+    Runs the image content detection and summary extraction calls concurrently with an async Azure OpenAI client.
+
+    At most {max_concurrency} images are in flight at any time. Throttled (429), timed out and 5xx requests are
+    retried with exponential backoff, honoring the Retry-After header sent by the service.
+    Results are delivered in completion order. When a {preprocessor} is given, images are uploaded as its
+    downscaled JPEG derivatives instead of the original files. When a {cache} is given, responses are looked up
+    there first, keyed by input hash, prompt hash, deployment and detail level. {detail_level} is the default of
+    each image; analyze() and analyze_all() can override it per image (e.g. for images escalated by the router).
+
+    In single-pass mode ({prompt_structured} given), one vision call returns the final summary/tags/named_entities
+    schema directly; the two-step detect-then-summarize path is used only when that response fails validation.
+    """
+
+    RETRYABLE_ERRORS = (openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError,
+                        openai.InternalServerError)
+
+    def __init__(self, client, deployment, prompt_img, prompt_summary, detail_level="low",
+                 max_concurrency=8, max_retries=6, base_delay=1.0, max_delay=60.0, preprocessor=None,
+                 cache=None, prompt_structured=None):
+        self.client = client
+        self.deployment = deployment
+        self.prompt_img = prompt_img
+        self.prompt_summary = prompt_summary
+        self.detail_level = detail_level
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.preprocessor = preprocessor
+        self.cache = cache
+        self.prompt_img_hash = content_hash(prompt_img)
+        self.prompt_summary_hash = content_hash(prompt_summary)
+        self.prompt_structured = prompt_structured
+        self.prompt_structured_hash = content_hash(prompt_structured) if prompt_structured else None
+        self.single_pass_fallbacks = 0
+        self.retries = 0
+
+    async def __create_with_retry(self, **request):
+        metrics = get_metrics()
+        attempt = 0
+        while True:
+            try:
+                response = await self.client.chat.completions.create(model=self.deployment, **request)
+            except self.RETRYABLE_ERRORS as e:
+                metrics.inc("api_requests_total", outcome=type(e).__name__)
+                if attempt >= self.max_retries:
+                    raise
+                delay = retry_after_seconds(e)
+                if delay is None:
+                    delay = min(self.max_delay, self.base_delay * (2 ** attempt))
+                    delay = delay / 2 + random.uniform(0, delay / 2)  # jitter spreads out synchronized retries
+                attempt += 1
+                self.retries += 1
+                metrics.inc("api_retries_total")
+                await asyncio.sleep(delay)
+                continue
+            metrics.inc("api_requests_total", outcome="ok")
+            if response.usage is not None:
+                metrics.inc("api_tokens_total", response.usage.prompt_tokens, kind="prompt")
+                metrics.inc("api_tokens_total", response.usage.completion_tokens, kind="completion")
+            return response
+
+    async def __cached(self, key, request):
+        """Returns the message content for {key} from the cache, calling the model on a miss."""
+        if self.cache is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+        response = await request()
+        content = response.choices[0].message.content
+        if self.cache is not None and content:
+            self.cache.put(key, content)
+        return content
+
+    def detect_request(self, image, mime_type, prompt, detail_level) -> dict:
+        """
+        Returns the chat completions request (without the model) describing a base64 {image} with {prompt}, shared
+        by the synchronous calls and the batch jobs (see VisionBatchJobs).
+        """
+        return dict(
+            temperature=0,
+            top_p=0,
+            response_format={ "type": "json_object" },
+            messages=[
+                {
+                    "role": "system",
+                    "content": [
+                        {"type": "text", "text": prompt},
+                    ],
+                },
+                {
+                    "role": "user",
+                    "content": [
+                        {"type": "text", "text": "Image:"},
+                        {
+                            "type": "image_url",
+                            "image_url": {
+                                "url": f"data:{mime_type};base64,{image}",
+                                "detail": detail_level
+                            }
+                        },
+                    ],
+                }
+            ],
+        )
+
+    def summary_request(self, response: str) -> dict:
+        """
+        Returns the chat completions request (without the model) that extracts the 'summary', 'tags' and
+        'named_entities' fields from an image description {response}.
+        """
+        response_json = json.loads(response)
+        return dict(
+            temperature=0,
+            top_p=0,
+            messages=[
+                {
+                    "role": "system",
+                    "content": self.prompt_summary
+                },
+                {
+                    "role": "user",
+                    "content": f"JSON:\n{json.dumps(response_json, ensure_ascii=False)}"
+                }
+            ]
+        )
+
+    async def __image_object_detect(self, image, mime_type, prompt, prompt_hash, detail_level):
+        key = ResponseCache.make_key("detect", content_hash(image), prompt_hash, self.deployment, detail_level)
+        return await self.__cached(key, lambda: self.__create_with_retry(
+            **self.detect_request(image, mime_type, prompt, detail_level)))
+
+    async def __extract_summary(self, response: str):
+        """
+        Uses Azure OpenAI chat completion to extract the 'summary', 'tags' and 'named_entities' fields from the image description.
+        """
+        request = self.summary_request(response)
+        key = ResponseCache.make_key("summary", content_hash(response), self.prompt_summary_hash, self.deployment)
+        content = await self.__cached(key, lambda: self.__create_with_retry(**request))
+        return json.loads(content)
+
+    async def analyze(self, image_path, detail_level: str = None) -> dict:
+        """
+        Analyzes one image at {detail_level} (default: the engine's) and returns a dict with 'image', 'summary',
+        'tags', 'named_entities', 'request_time', 'detail_level' and 'error' (None on success).
+        """
+        detail_level = detail_level or self.detail_level
+        result = {"image": image_path, "summary": [], "tags": [], "named_entities": [], "request_time": 0.0,
+                  "detail_level": detail_level, "error": None}
+        try:
+            if self.preprocessor is not None:
+                encoded_image, mime_type = await asyncio.to_thread(self.preprocessor.encode, image_path, detail_level)
+            else:
+                encoded_image, mime_type = await asyncio.to_thread(encode_image_to_base64, image_path)
+            start_time = time.time()
+            summary = None
+            if self.prompt_structured:
+                response = await self.__image_object_detect(encoded_image, mime_type, self.prompt_structured,
+                                                            self.prompt_structured_hash, detail_level)
+                summary = parse_structured_analysis(response)
+                if summary is None:
+                    self.single_pass_fallbacks += 1
+            if summary is None:
+                response = await self.__image_object_detect(encoded_image, mime_type, self.prompt_img,
+                                                            self.prompt_img_hash, detail_level)
+                summary = await self.__extract_summary(response)
+            result["request_time"] = time.time() - start_time
+            result["summary"] = summary.get("summary", [])
+            result["tags"] = summary.get("tags", [])
+            result["named_entities"] = summary.get("named_entities", [])
+            # Bytes of the uploaded image, read from the original file or its cached derivative
+            get_metrics().record_file("expert", result["request_time"], size=len(encoded_image) * 3 // 4)
+        except Exception as e:
+            result["error"] = e
+        return result
+
+    async def analyze_all(self, image_paths, detail_levels: dict = None):
+        """
+        Yields the analysis result of every image as soon as it completes, keeping at most {max_concurrency} images in flight.
+        {detail_levels} optionally maps image paths to their own detail level.
+        """
+        detail_levels = detail_levels or {}
+        image_paths = iter(image_paths)
+        pending = set()
+        for image_path in image_paths:
+            pending.add(asyncio.create_task(self.analyze(image_path, detail_levels.get(image_path))))
+            if len(pending) >= self.max_concurrency:
+                break
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    next_path = next(image_paths, None)
+                    if next_path is not None:
+                        pending.add(asyncio.create_task(self.analyze(next_path, detail_levels.get(next_path))))
+                    yield task.result()
+        finally:
+            for task in pending:
+                task.cancel()
@@ -0,0 +1,68 @@
+import os
+import threading
+
+# HTTP connection pools and Azure OpenAI clients of this process, shared by every agent and plugin
+_http_clients = {}
+_openai_clients = {}
+_clients_lock = threading.Lock()
+_environment_loaded = False
+
+
+def load_environment() -> None:
+    """Loads the .env file of the project into the environment, once per process."""
+    global _environment_loaded
+    if _environment_loaded:
+        return
+    from dotenv import load_dotenv
+    load_dotenv() # Load environment variables from .env file
+    _environment_loaded = True
+
+
+def _new_http_client():
+    import httpx
+    max_connections = int(os.getenv("AZURE_OPENAI_MAX_CONNECTIONS", "32"))
+    return httpx.AsyncClient(
+        limits=httpx.Limits(max_connections=max_connections,
+                            max_keepalive_connections=max_connections,
+                            keepalive_expiry=float(os.getenv("AZURE_OPENAI_KEEPALIVE_SECONDS", "60"))),
+        timeout=httpx.Timeout(float(os.getenv("AZURE_OPENAI_TIMEOUT", "120")),
+                              connect=float(os.getenv("AZURE_OPENAI_CONNECT_TIMEOUT", "10"))),
+    )
+
+
+def get_openai_client(endpoint: str = None, api_key: str = None, api_version: str = None, max_retries: int = 2):
+    """
+    Returns the shared AsyncAzureOpenAI client for the given endpoint, key and API version.
+
+    All clients of one endpoint reuse a single keep-alive HTTP connection pool, so TLS handshakes and connection
+    setup are paid once per process. Arguments default to the AZURE_OPENAI_* environment variables.
+    Set {max_retries} to 0 when the caller retries by itself (e.g. the vision engine, which honors Retry-After).
+    """
+    load_environment()
+    endpoint = endpoint or os.getenv("AZURE_OPENAI_ENDPOINT")
+    api_key = api_key or os.getenv("AZURE_OPENAI_API_KEY")
+    api_version = api_version or os.getenv("AZURE_OPENAI_API_VERSION")
+    key = (endpoint, api_key, api_version, max_retries)
+    with _clients_lock:
+        if key not in _openai_clients:
+            from openai import AsyncAzureOpenAI
+            if endpoint not in _http_clients:
+                _http_clients[endpoint] = _new_http_client()
+            _openai_clients[key] = AsyncAzureOpenAI(
+                azure_endpoint=endpoint,
+                api_key=api_key,
+                api_version=api_version,
+                max_retries=max_retries,
+                http_client=_http_clients[endpoint],
+            )
+        return _openai_clients[key]
+
+
+async def close_clients() -> None:
+    """Closes every shared connection pool; the next get_openai_client() call opens new ones."""
+    with _clients_lock:
+        http_clients = list(_http_clients.values())
+        _http_clients.clear()
+        _openai_clients.clear()
+    for http_client in http_clients:
+        await http_client.aclose()
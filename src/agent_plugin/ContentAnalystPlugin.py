@@ -1,95 +1,255 @@
-from datetime import datetime
-from pathlib import Path
 import os
 from pathlib import Path
-from ultralytics import YOLO
-from semantic_kernel.functions.kernel_function_decorator import kernel_function
 
-model = YOLO("yolov8n.pt")  # Nano version
+from agent_plugin.AlbumIndex import get_album_index
+from agent_plugin.KernelFunction import kernel_function
+from agent_plugin.MediaCatalog import get_catalog
+from agent_plugin.MediaManifest import get_manifest
+from agent_plugin.Metrics import get_metrics, instrumented_stage
+from agent_plugin.ModelRegistry import get_yolo_backend, yolo_backend_settings
+from agent_plugin.ResultsStore import get_results_store
+from agent_plugin.StageResults import DetectionResult
+
+YOLO_WEIGHTS = "yolov8n.pt"  # Nano version
 
 # class for YoloContentAnalyst functions
 class ContentAnalystPlugin:
     """A plugin that reads and analyzes media files."""
+    STAGE = "object_detection"
+    # 2: the manifest keeps the detections, not only the class names
+    STAGE_VERSION = "yolov8n-2"
+    VIDEO_STAGE = "video_object_detection"
+
+    def create_engine(self):
+        """Returns a batched YOLO inference engine configured from the environment, loading the model on first use."""
+        # Heavy imports (OpenCV, numpy) and the model itself are loaded on first use only
+        from agent_plugin.YoloInferenceEngine import YoloInferenceEngine
+
+        # Rendering and saving annotated copies is for debugging only (YOLO_RENDER=1)
+        render = os.getenv("YOLO_RENDER", "0") == "1"
+        imgsz = int(os.getenv("YOLO_IMAGE_SIZE", "640"))
+        return YoloInferenceEngine(get_yolo_backend(YOLO_WEIGHTS, imgsz, render),
+                                   batch_size=int(os.getenv("YOLO_BATCH_SIZE", "8")),
+                                   imgsz=imgsz)
+
+    def stage_version(self) -> str:
+        """FP32 backends detect the same objects; INT8 detections may differ slightly, so they are cached apart."""
+        return f"{self.STAGE_VERSION}-int8" if yolo_backend_settings()["int8"] else self.STAGE_VERSION
 
-    def __write_row_to_text_file(self,file_path: str, row: str) -> None:
+    def cached_objects(self, media_file, manifest=None, store=None):
         """
-        Appends a single row of text to the specified text file.
+        Returns the objects already detected in this image content (also set on the record), or None. When the
+        results {store} has no detections at this path (the file was moved, or the store was reset), they are
+        stored again from the manifest, for VisionRouterPlugin.
+        """
+        cached = manifest.get_result(media_file, self.STAGE, self.stage_version()) if manifest is not None else None
+        if cached is None:
+            return None
+        media_file.results[self.STAGE] = cached["objects"]
+        if store is not None and store.get(media_file.path, self.STAGE) is None:
+            log = self.format_log_row(media_file.path, cached["objects"]) if cached["objects"] else None
+            store.add(media_file.path, self.STAGE, cached, log)
+        return cached["objects"]
 
-        Args:
-            file_path (str): The path to the text file.
-            row (str): The row of text to write (a newline will be added automatically).
+    def record_objects(self, media_file, detections, manifest=None, store=None):
+        """
+        Stores the detections of one image on its record, in the manifest and in the results {store};
+        returns the detected class names.
         """
-        with open(file_path, "a", encoding="utf-8") as file:
-            file.write(row + "\n")
+        obj_detected = [detection["name"] for detection in detections]
+        media_file.results[self.STAGE] = obj_detected
+        get_metrics().inc("bytes_read_total", media_file.size, stage="content")
+        if manifest is not None:
+            manifest.record(media_file, self.STAGE, self.stage_version(),
+                            {"objects": obj_detected, "detections": detections})
+        if store is not None:
+            log = self.format_log_row(media_file.path, obj_detected) if obj_detected else None
+            store.add(media_file.path, self.STAGE, {"objects": obj_detected, "detections": detections}, log)
+        return obj_detected
 
-    def __process_folder(self,album_dir, logfile_dir):
-        total_pics = 0
+    def reuse_representative(self, media_file, manifest=None, store=None) -> bool:
+        """
+        Copies the objects detected in the representative of a near-duplicate image (see DuplicateAnalystPlugin)
+        instead of running the model again; returns False when there is no analyzed representative.
+        """
+        representative = media_file.duplicate_of
+        if representative is None or self.STAGE not in representative.results:
+            return False
+        obj_detected = list(representative.results[self.STAGE])
+        media_file.results[self.STAGE] = obj_detected
+        if manifest is not None:
+            # The manifest keeps the representative's detections, as the representative may not be there next run
+            record = store.get(representative.path, self.STAGE) if store is not None else None
+            result = {"objects": obj_detected}
+            if record is not None and "detections" in record:
+                result["detections"] = record["detections"]
+            manifest.record(media_file, self.STAGE, self.stage_version(), result)
+        if store is not None:
+            log = self.format_log_row(media_file.path, obj_detected) if obj_detected else None
+            store.add(media_file.path, self.STAGE, {"objects": obj_detected, "duplicate_of": representative.path}, log)
+        return True
+
+    def __detect_images(self, engine, images, manifest=None, store=None):
         total_detected = 0
+        # Each result is appended to the store as soon as its batch is done; the store flushes in batches
+        for image_path, detections, error in engine.detect(list(images)):
+            if error is not None:
+                print(f"ERROR: Unable to decode {image_path}: {str(error)}")
+                continue
+            obj_detected = self.record_objects(images[image_path], detections, manifest, store)
+            if len(obj_detected) > 0:
+                total_detected += 1
+        return total_detected
+
+    def __video_stage_version(self, settings):
+        # Changing the sampling settings re-analyzes the videos
+        return f"{self.stage_version()}-{settings['mode']}-{settings['interval']}-{settings['scene_threshold']}-{settings['max_frames']}"
 
+    def cached_video(self, media_file, manifest=None):
         """
-        Creates a text file with today's date in DDMMYYYY.txt format in the specified directory.
-        Returns the full path to the created file.
+        Returns the summary already stored for this video content and the current sampling settings (also set on
+        the record), or None.
         """
-        today_str = datetime.now().strftime("%d%m%Y")
-        # Ensure logfile_dir exists
-        if not os.path.exists(logfile_dir):
-            os.makedirs(logfile_dir, exist_ok=True)
-        logfile_path = os.path.join(logfile_dir, f"{today_str}.txt")
-        # Create the file if it doesn't exist
-        if not os.path.exists(logfile_path):
-            with open(logfile_path, "w", encoding="utf-8") as f:
-                pass
-
-        # Process each file in the media directory
-        file_paths = []
-        for root, _, files in os.walk(album_dir):
-            for file in files:
-                file_paths.append(os.path.join(root, file))
+        from agent_plugin.VideoFrameSampler import sampling_settings
+
+        stage_version = self.__video_stage_version(sampling_settings())
+        cached = manifest.get_result(media_file, self.VIDEO_STAGE, stage_version) if manifest is not None else None
+        if cached is None:
+            return None
+        media_file.results[self.STAGE] = cached["objects"]
+        media_file.results[self.VIDEO_STAGE] = cached
+        return cached
+
+    def detect_video(self, engine, media_file, manifest=None, store=None):
+        """
+        Detects the objects in sampled frames of a video and stores the per-video summary (see aggregate_detections)
+        on its record, in the manifest and in the results {store}. Callers check cached_video() first, so the
+        {engine} is only created once a video needs it.
+
+        Returns:
+            dict: the summary, with 'objects' listing the detected class names.
+        """
+        from agent_plugin.VideoFrameSampler import aggregate_detections, iter_frames, sampling_settings
+
+        settings = sampling_settings()
+        with get_metrics().file_timer("content_video", media_file.size):
+            frames = iter_frames(media_file.path, max_side=engine.imgsz, **settings)
+            # Frames stream from ffmpeg through the batched model; only the running summary is kept
+            summary = aggregate_detections(engine.detect_arrays(frames))
+        if manifest is not None:
+            manifest.record(media_file, self.VIDEO_STAGE, self.__video_stage_version(settings), summary)
+        if store is not None:
+            log = self.format_video_log_row(media_file.path, summary) if summary["objects"] else None
+            store.add(media_file.path, self.VIDEO_STAGE, summary, log)
+        media_file.results[self.STAGE] = summary["objects"]
+        media_file.results[self.VIDEO_STAGE] = summary
+        return summary
+
+    def format_video_log_row(self, video_path, summary):
+        objects = [f"{name} ({entry['first']:.1f}s-{entry['last']:.1f}s)" for name, entry in summary["detections"].items()]
+        return f"{'/'.join(os.path.normpath(video_path).split(os.sep)[-3:])} includes: {', '.join(objects)}\n"
+
+    def format_log_row(self, image_path, obj_detected):
+        # log_object = f"{os.path.basename(filename)} includes: {', '.join(obj_detected)}\n"
+        return f"{'/'.join(os.path.normpath(image_path).split(os.sep)[-3:])} includes: {', '.join(obj_detected)}\n"
+
+    def __process_folder(self,album_dir, store, manifest=None, catalog=None):
+        total_pics = 0
+        total_detected = 0
+
+        # Process each file in the media directory, as listed once per run by the shared catalog
+        catalog = catalog if catalog is not None else get_catalog(Path(album_dir).parent)
         
-        aggregated_log = '******** Object Detection Results ********\n'
-        for filename in file_paths:
-            if filename.lower().endswith(('.mov', '.mp4')):
-                print(f"Skipping video file: {filename}")
-            elif filename.lower().endswith(('.jpg', '.jpeg', '.png', '.tiff', '.bmp', '.gif')):
+        from agent_plugin import VideoProbe
+        videos_supported = VideoProbe.ffmpeg_tool("ffmpeg") is not None and VideoProbe.is_available()
+
+        images = {}
+        duplicates = []
+        videos = []
+        for media_file in catalog.files(album_dir):
+            if media_file.is_video:
+                if videos_supported:
+                    videos.append(media_file)
+                else:
+                    print(f"Skipping video file: {media_file.path} (ffmpeg not found, see FFMPEG_FOLDER)")
+            elif media_file.is_image:
                 total_pics += 1
-                image_path = filename
-                
-                obj_detected = []
-                results = model(image_path, show=True, save=True, save_txt=True)
-                for box in results[0].boxes:
-                    class_idx = int(box.cls[0].item())
-                    class_name = results[0].names[class_idx]  # Get value from dict based on index
-                    obj_detected.append(class_name)
-                if len(obj_detected) > 0:
+                if self.cached_objects(media_file, manifest, store) is not None:
+                    continue
+                # Near-duplicates wait for their representative's detections
+                if media_file.duplicate_of is not None:
+                    duplicates.append(media_file)
+                    continue
+                images[media_file.path] = media_file
+
+        engine = None
+        if images:
+            engine = self.create_engine()
+            total_detected += self.__detect_images(engine, images, manifest, store)
+
+        leftovers = {}
+        for media_file in duplicates:
+            if self.reuse_representative(media_file, manifest, store):
+                if media_file.results[self.STAGE]:
                     total_detected += 1
-                    # log_object = f"{os.path.basename(filename)} includes: {', '.join(obj_detected)}\n"
-                    log_object = f"{'/'.join(os.path.normpath(image_path).split(os.sep)[-3:])} includes: {', '.join(obj_detected)}\n"
-                    aggregated_log += log_object
-        with open(logfile_path, "a", encoding="utf-8") as log_file:
-            log_file.write(aggregated_log) 
+            else:
+                leftovers[media_file.path] = media_file
+
+        # torch/ultralytics are only loaded once an image or video is not analyzed yet
+        if leftovers:
+            engine = engine if engine is not None else self.create_engine()
+            total_detected += self.__detect_images(engine, leftovers, manifest, store)
+
+        # Videos are decoded one at a time, so memory stays bounded by one batch of frames
+        videos_detected = 0
+        for media_file in videos:
+            try:
+                summary = self.cached_video(media_file, manifest)
+                if summary is None:
+                    # The model is loaded by the first video not analyzed yet
+                    engine = engine if engine is not None else self.create_engine()
+                    summary = self.detect_video(engine, media_file, manifest, store)
+            except Exception as e:
+                print(f"ERROR: Unable to analyze video {media_file.path}: {str(e)}")
+                continue
+            if summary["objects"]:
+                videos_detected += 1
         
-        return total_pics, total_detected
+        return total_pics, total_detected, len(videos), videos_detected
+
+    @instrumented_stage("content")
+    def detect_folder(self, album_dir) -> DetectionResult:
+        """
+        Detects the objects in the images and videos of {album_dir} and records them in the results store.
+        """
+        # sample_dir = Path(os.getenv("MEDIA_SOURCE_PATH")).parent
+        sample_dir = Path(album_dir).parent
+        if not sample_dir:
+            raise FileNotFoundError("Parent directory does not exist.")
+
+        if not album_dir:
+            raise FileNotFoundError("Album directory does not exist.")
+
+        manifest = get_manifest(sample_dir)
+        store = get_results_store(sample_dir)
+        try:
+            total_pics, total_detected, total_videos, videos_detected = self.__process_folder(album_dir,store,manifest,get_catalog(sample_dir))
+        finally:
+            store.flush()
+            manifest.commit()
+            # Make the new results searchable; only records written since the last update are read
+            get_album_index(sample_dir).update(store)
+        print(f"Media files content analysis completed successfully: from {total_pics} images processed, {total_detected} contain detected objects.")
+        if total_videos > 0:
+            print(f"Video content analysis completed: from {total_videos} videos processed, {videos_detected} contain detected objects.")
+        return DetectionResult(str(album_dir), total_pics, total_detected, total_videos, videos_detected)
 
-    @kernel_function(description="Run objects identification and then create a log file with the results applicable to the files stored in {album_dir}.")
+    @kernel_function(description="Run objects identification and then record the results applicable to the files stored in {album_dir}.")
     def media_content_analysis(self, album_dir:str) -> str:
         try:
             # Source directory with photos
-            # sample_dir = Path(os.getenv("MEDIA_SOURCE_PATH")).parent
-            sample_dir = Path(album_dir).parent
-            if not sample_dir:
-                raise FileNotFoundError("Parent directory does not exist.")
-
-            if not album_dir:
-                raise FileNotFoundError("Album directory does not exist.")
-
-            # Directory for media file content logs - create it if it does not exist
-            logfiles_dir  = Path(sample_dir, "logs")           
-            if not os.path.exists(logfiles_dir):
-                os.makedirs(logfiles_dir, exist_ok=True)
-
-            total_pics, total_detected = self.__process_folder(album_dir,logfiles_dir)
-            print(f"Media files content analysis completed successfully: from {total_pics} images processed, {total_detected} contain detected objects.")
-            result = f"Run OpenAI content and tags extraction and create a log file with the results applicable to the files stored in {{album_dir}} = '{target_dir}' "
+            self.detect_folder(album_dir)
+            result = f"Run OpenAI content and tags extraction and record the results applicable to the files stored in {{album_dir}} = '{album_dir}' "
             return result
         except FileNotFoundError as e:  
             print(f"ERROR: The specified directory does not exist: {str(e)}")
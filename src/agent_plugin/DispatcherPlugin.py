@@ -1,8 +1,8 @@
-from semantic_kernel.functions.kernel_function_decorator import kernel_function
 from pathlib import Path
 import os
 import shutil
-import magic
+
+from agent_plugin.KernelFunction import kernel_function
 
 # class for MediaAnalys functions
 class DispatcherPlugin:
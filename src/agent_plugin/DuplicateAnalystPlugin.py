@@ -0,0 +1,214 @@
+from pathlib import Path
+import os
+
+from agent_plugin.KernelFunction import kernel_function
+from agent_plugin.MediaCatalog import get_catalog
+from agent_plugin.MediaManifest import get_manifest
+from agent_plugin.Metrics import get_metrics, instrumented_stage
+from agent_plugin.StageResults import DuplicateResult
+from agent_plugin.WorkerPool import map_unordered
+
+# Thumbnails hashed together in one vectorized DCT
+HASH_BATCH_SIZE = 256
+
+# class for DuplicateAnalyst functions
+class DuplicateAnalystPlugin:
+    """A plugin that finds near-duplicate photos, so the expensive stages analyze each group only once."""
+    STAGE = "perceptual_hash"
+    STAGE_VERSION = "phash-1"
+
+    def max_distance(self) -> int:
+        """Largest Hamming distance between the 64-bit hashes of two near-duplicates (DUPLICATE_MAX_DISTANCE)."""
+        return int(os.getenv("DUPLICATE_MAX_DISTANCE", "8"))
+
+    def __cached_hash(self,media_file, manifest=None):
+        cached = manifest.get_result(media_file, self.STAGE, self.STAGE_VERSION) if manifest is not None else None
+        return int(cached["phash"], 16) if cached is not None else None
+
+    def __record_hash(self,media_file, hash_value, manifest=None):
+        if manifest is not None:
+            manifest.record(media_file, self.STAGE, self.STAGE_VERSION, {"phash": f"{hash_value:016x}"})
+
+    def hash_file(self,media_file, manifest=None) -> int:
+        """Returns the perceptual hash of one image, computing it only when the manifest does not have it yet."""
+        from agent_plugin.PerceptualHash import phash
+
+        hash_value = self.__cached_hash(media_file, manifest)
+        if hash_value is None:
+            with get_metrics().file_timer("dedupe", media_file.size):
+                hash_value = phash(media_file.path)
+            self.__record_hash(media_file, hash_value, manifest)
+        return hash_value
+
+    def __hash_files(self,media_files, manifest=None):
+        """Returns {MediaFile: hash} for the images; thumbnails are decoded on a thread pool and hashed in batches."""
+        from agent_plugin.PerceptualHash import load_thumbnail, phash_batch
+
+        def load(media_file):
+            hash_value = self.__cached_hash(media_file, manifest)
+            if hash_value is not None:
+                return hash_value, None
+            # Decoding dominates; the batched DCT costs microseconds per image
+            with get_metrics().file_timer("dedupe", media_file.size):
+                return None, load_thumbnail(media_file.path)
+
+        hashes = {}
+        pending = []
+
+        def hash_pending():
+            for (media_file, _), hash_value in zip(pending, phash_batch([thumbnail for _, thumbnail in pending])):
+                hashes[media_file] = hash_value
+                self.__record_hash(media_file, hash_value, manifest)
+            pending.clear()
+
+        for media_file, loaded, error in map_unordered(load, media_files):
+            if error is not None:
+                print(f"ERROR: Unable to hash {media_file.name}: {str(error)}")
+                continue
+            hash_value, thumbnail = loaded
+            if hash_value is not None:
+                hashes[media_file] = hash_value
+                continue
+            pending.append((media_file, thumbnail))
+            if len(pending) >= HASH_BATCH_SIZE:
+                hash_pending()
+        hash_pending()
+        return hashes
+
+    def __record_match(self,media_file, hash_value, manifest=None):
+        """Keeps the outcome of matching the image next to its hash, so later runs do not match it again."""
+        if manifest is None:
+            return
+        representative = manifest.fingerprint(media_file.duplicate_of) if media_file.duplicate_of is not None else None
+        # An identical copy shares the representative's record, which must keep saying it is a representative
+        if representative is not None and representative == manifest.fingerprint(media_file):
+            return
+        manifest.record(media_file, self.STAGE, self.STAGE_VERSION,
+                        {"phash": f"{hash_value:016x}", "duplicate_of": representative})
+
+    def match_hash(self,media_file, hash_value, tree, manifest=None):
+        """
+        Looks the {hash_value} of an image up in the BK-{tree} of representatives: a near-duplicate gets its
+        representative in {duplicate_of}, any other image becomes a representative itself. The outcome is kept in
+        the {manifest}.
+
+        Returns:
+            MediaFile: the representative, or None when the image is a representative.
+        """
+        matches = tree.search(hash_value, self.max_distance())
+        if matches:
+            media_file.duplicate_of = matches[0][1]
+        else:
+            media_file.duplicate_of = None
+            tree.add(hash_value, media_file)
+        self.__record_match(media_file, hash_value, manifest)
+        return media_file.duplicate_of
+
+    def __restore_album(self,album_images, album_dir, manifest=None):
+        """
+        Restores the album images matched in earlier runs from the manifest, read in one query; the duplicates get
+        their {duplicate_of} back.
+
+        Returns:
+            tuple: ({representative MediaFile: hash}, number of duplicates restored, images still to match)
+        """
+        stored = {}
+        if manifest is not None:
+            stored = manifest.cached_results(album_images, self.STAGE, self.STAGE_VERSION, album_dir)
+        representatives = {}
+        by_content = {}
+        duplicates = []
+        unmatched = []
+        for media_file in album_images:
+            result = stored.get(media_file)
+            # Hashes recorded before the outcome was kept are matched once more
+            if result is None or "duplicate_of" not in result:
+                unmatched.append(media_file)
+            elif result["duplicate_of"] is None:
+                media_file.duplicate_of = None
+                representatives[media_file] = int(result["phash"], 16)
+                by_content[media_file.content_hash] = media_file
+            else:
+                duplicates.append((media_file, result["duplicate_of"]))
+        restored = 0
+        for media_file, representative in duplicates:
+            media_file.duplicate_of = by_content.get(representative)
+            if media_file.duplicate_of is None:
+                # Its representative left the album
+                unmatched.append(media_file)
+            else:
+                restored += 1
+        return representatives, restored, unmatched
+
+    def __match_all(self,media_files, hashes, tree, manifest=None):
+        """Matches the hashed images against the {tree} in the given order; returns the number of near-duplicates."""
+        duplicates = 0
+        for media_file in media_files:
+            if self.match_hash(media_file, hashes[media_file], tree, manifest) is not None:
+                duplicates += 1
+                print(f"{media_file.name} is a near-duplicate of {media_file.duplicate_of.name}")
+        return duplicates
+
+    def __album_tree(self,album_images, album_dir, manifest=None):
+        """Returns (BK-tree of the album representatives, images in it, near-duplicates among them)."""
+        from agent_plugin.PerceptualHash import BKTree
+
+        representatives, restored, unmatched = self.__restore_album(album_images, album_dir, manifest)
+        tree = BKTree()
+        for media_file in sorted(representatives, key=lambda media_file: (-media_file.size, media_file.path)):
+            tree.add(representatives[media_file], media_file)
+        # Only the images added to the album since the last run are hashed and matched
+        hashes = self.__hash_files(unmatched, manifest)
+        ordered = sorted(hashes, key=lambda media_file: (-media_file.size, media_file.path))
+        duplicates = restored + self.__match_all(ordered, hashes, tree, manifest)
+        return tree, len(representatives) + restored + len(hashes), duplicates
+
+    def album_tree(self,album_dir, manifest=None, catalog=None):
+        """Returns a BK-tree of the representatives among the images of {album_dir}, to match new images against."""
+        catalog = catalog if catalog is not None else get_catalog(Path(album_dir).parent)
+        tree, _, _ = self.__album_tree(catalog.files(album_dir, kind="image"), album_dir, manifest)
+        if manifest is not None:
+            manifest.commit()
+        return tree
+
+    @instrumented_stage("dedupe")
+    def find_duplicates(self, source_dir) -> DuplicateResult:
+        """
+        Groups the near-duplicate images of {source_dir}, also matching them against the photos already in the album.
+
+        Within each group, a photo already in the album, or else the largest file, is the representative; the other
+        photos get it in {duplicate_of}, so the content stages reuse its analysis instead of paying for their own.
+        The hashes and the outcome of each match are kept in the manifest, so the album photos matched in earlier
+        runs are restored in one query instead of being read and matched again.
+        """
+        sample_dir = Path(source_dir).parent
+        if not sample_dir:
+            raise FileNotFoundError("Parent directory does not exist.")
+        album_dir = Path(sample_dir, "album")
+
+        manifest = get_manifest(sample_dir)
+        catalog = get_catalog(sample_dir)
+        new_images = catalog.files(source_dir, recursive=False, kind="image")
+        # Scanning the album also registers it in the catalog, so organized files keep their {duplicate_of}
+        album_images = catalog.files(album_dir, kind="image")
+        # Album photos were analyzed in earlier runs, so they are preferred representatives; then the largest file
+        tree, images, duplicates = self.__album_tree(album_images, album_dir, manifest)
+        hashes = self.__hash_files(new_images, manifest)
+        ordered = sorted(hashes, key=lambda media_file: (-media_file.size, media_file.path))
+        duplicates += self.__match_all(ordered, hashes, tree, manifest)
+        images += len(hashes)
+        manifest.commit()
+        print(f"Near-duplicate detection completed successfully: {duplicates} near-duplicates among {images} photos.")
+        return DuplicateResult(str(source_dir), images, duplicates, tree.size)
+
+    @kernel_function(description="Find the near-duplicate photos in the given directory, so they reuse the analysis of a single representative photo.")
+    def analyze_duplicates(self, source_dir:str) -> str:
+        try:
+            self.find_duplicates(source_dir)
+            return f"Extract the metadata and organize the valid photos stored in the source directory at {source_dir}."
+        except FileNotFoundError as e:
+            print(f"ERROR: The specified directory does not exist: {e}")
+            return f"ERROR: The specified directory does not exist: {e}"
+        except Exception as e:
+            print(f"ERROR:An error occurred: {str(e)}")
+            return f"ERROR:An error occurred: {str(e)}"
@@ -0,0 +1,131 @@
+import struct
+
+TAG_DATETIME_ORIGINAL = 0x9003
+TAG_EXIF_IFD_POINTER = 0x8769
+TYPE_ASCII = 2
+
+# Upper bound of bytes read from any single header structure, so a corrupt file can never trigger a large read
+MAX_SEGMENT_READ = 64 * 1024
+MAX_IFD_ENTRIES = 1024
+
+
+class ExifFormatError(Exception):
+    """Raised when a file header cannot be parsed by the fast reader."""
+
+
+def _read_at(file, offset, size):
+    file.seek(offset)
+    data = file.read(min(size, MAX_SEGMENT_READ))
+    if len(data) < size:
+        raise ExifFormatError(f"Truncated header at offset {offset}")
+    return data
+
+
+def _find_ifd_tag(file, tiff_start, endian, ifd_offset, tag):
+    """Returns (type, count, value_or_offset bytes) of {tag} in the IFD at {ifd_offset}, or None."""
+    count = struct.unpack(endian + "H", _read_at(file, tiff_start + ifd_offset, 2))[0]
+    if count > MAX_IFD_ENTRIES:
+        raise ExifFormatError("Implausible IFD entry count")
+    entries = _read_at(file, tiff_start + ifd_offset + 2, count * 12)
+    for i in range(count):
+        entry_tag, entry_type, entry_count = struct.unpack(endian + "HHI", entries[i * 12:i * 12 + 8])
+        if entry_tag == tag:
+            return entry_type, entry_count, entries[i * 12 + 8:i * 12 + 12]
+    return None
+
+
+def _read_tiff_date(file, tiff_start):
+    """Reads DateTimeOriginal from the TIFF structure starting at {tiff_start}, or returns None."""
+    header = _read_at(file, tiff_start, 8)
+    if header[:2] == b"II":
+        endian = "<"
+    elif header[:2] == b"MM":
+        endian = ">"
+    else:
+        raise ExifFormatError("Invalid TIFF byte order")
+    if struct.unpack(endian + "H", header[2:4])[0] != 42:
+        raise ExifFormatError("Invalid TIFF magic number")
+    ifd0_offset = struct.unpack(endian + "I", header[4:8])[0]
+
+    pointer = _find_ifd_tag(file, tiff_start, endian, ifd0_offset, TAG_EXIF_IFD_POINTER)
+    if pointer is None:
+        return None
+    exif_offset = struct.unpack(endian + "I", pointer[2])[0]
+    entry = _find_ifd_tag(file, tiff_start, endian, exif_offset, TAG_DATETIME_ORIGINAL)
+    if entry is None or entry[0] != TYPE_ASCII:
+        return None
+    _, count, value = entry
+    raw = value[:count] if count <= 4 else _read_at(file, tiff_start + struct.unpack(endian + "I", value)[0], count)
+    date = raw.split(b"\x00", 1)[0].decode("ascii", errors="ignore").strip()
+    return date or None
+
+
+def _read_jpeg_exif_offset(file):
+    """Walks the JPEG marker segments up to the image data and returns the TIFF offset of the Exif APP1 segment."""
+    if _read_at(file, 0, 2) != b"\xff\xd8":
+        raise ExifFormatError("Missing JPEG SOI marker")
+    offset = 2
+    while True:
+        marker = _read_at(file, offset, 4)
+        if marker[0] != 0xFF:
+            raise ExifFormatError("Invalid JPEG marker")
+        if marker[1] in (0xDA, 0xD9):  # start of scan / end of image: no more metadata segments
+            return None
+        length = struct.unpack(">H", marker[2:4])[0]
+        if marker[1] == 0xE1 and _read_at(file, offset + 4, 6) == b"Exif\x00\x00":
+            return offset + 10
+        offset += 2 + length
+
+
+def _read_png_exif_offset(file):
+    """Walks the PNG chunks up to the image data and returns the TIFF offset of the eXIf chunk."""
+    if _read_at(file, 0, 8) != b"\x89PNG\r\n\x1a\n":
+        raise ExifFormatError("Missing PNG signature")
+    offset = 8
+    while True:
+        length, chunk_type = struct.unpack(">I4s", _read_at(file, offset, 8))
+        if chunk_type == b"eXIf":
+            return offset + 8
+        if chunk_type in (b"IDAT", b"IEND"):
+            return None
+        offset += 12 + length
+
+
+def _read_with_pil(file_path):
+    from PIL import Image  # loaded only for files the fast reader cannot parse
+
+    with Image.open(file_path) as image:
+        exif = image.getexif()
+        if not exif:
+            return False, None
+        date = exif.get_ifd(TAG_EXIF_IFD_POINTER).get(TAG_DATETIME_ORIGINAL)
+        return True, date
+
+
+def read_original_date(file_path):
+    """
+    Reads the EXIF DateTimeOriginal of an image from its header bytes only.
+
+    JPEG APP1 segments, PNG eXIf chunks and TIFF files are parsed directly with small bounded reads;
+    anything the fast path cannot parse falls back to PIL.
+
+    Returns:
+        tuple: (has_exif, original_date) where original_date is a 'YYYY:MM:DD HH:MM:SS' string or None.
+    """
+    try:
+        with open(file_path, "rb") as file:
+            signature = file.read(8)
+            if signature[:2] == b"\xff\xd8":
+                tiff_start = _read_jpeg_exif_offset(file)
+            elif signature == b"\x89PNG\r\n\x1a\n":
+                tiff_start = _read_png_exif_offset(file)
+            elif signature[:4] in (b"II*\x00", b"MM\x00*"):
+                tiff_start = 0
+            else:
+                raise ExifFormatError("Unsupported image format")
+            if tiff_start is None:
+                return False, None
+            return True, _read_tiff_date(file, tiff_start)
+    except (ExifFormatError, struct.error):
+        return _read_with_pil(file_path)
+
@@ -1,25 +1,22 @@
-from datetime import datetime
 from pathlib import Path
 import os, json
-import base64
 import sys, time
-from openai import AzureOpenAI
-from dotenv import load_dotenv
-from semantic_kernel.functions.kernel_function_decorator import kernel_function
+
+from agent_plugin.AlbumIndex import get_album_index
+from agent_plugin.KernelFunction import kernel_function
+from agent_plugin.MediaCatalog import get_catalog
+from agent_plugin.MediaManifest import get_manifest
+from agent_plugin.Metrics import instrumented_stage
+from agent_plugin.ResultsStore import get_results_store
+from agent_plugin.StageResults import VisionResult
+from agent_plugin.StatePaths import state_dir
+from agent_plugin.VisionRouter import ROUTE_STAGE
 
 # class for AIContentAnalyst functions
 class ExpertContentAnalystPlugin:
     """A plugin that reads and analyzes media files."""
-
-    def __sort_files_numerically(self,folder_path):
-        files = os.listdir(folder_path)
-
-        # Define a key function that removes '#' from the filename
-        def key_func(filename):
-            return filename.replace('#', '')
-        
-        # Sort the files using the key function
-        return sorted(files, key=key_func)
+    STAGE = "vision_analysis"
+    STAGE_VERSION = "1"
 
     def __update_progress_bar(self,progress, total):
         percent = 100 * (progress / float(total))
@@ -27,157 +24,320 @@ class ExpertContentAnalystPlugin:
         sys.stdout.write(f"\r|{bar}| {percent:.2f}%")
         sys.stdout.flush()
 
-    def __encode_image_to_base64(self,image_path):
-        with open(image_path, "rb") as image_file:
-            return base64.b64encode(image_file.read()).decode('utf-8')
-
-    def __image_object_detect(self,client_ai,prompt, detail_level, image):
-        response = client_ai.chat.completions.create(
-            model=os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME"),
-            # max_tokens=100,
-            temperature=0,
-            top_p=0,
-            response_format={ "type": "json_object" },
-            messages=[
-                {
-                    "role": "system",
-                    "content": [
-                        {"type": "text", "text": prompt},
-                    ],
-                },
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": "Image:"},
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/png;base64,{image}",
-                                "detail": detail_level
-                            }
-                        },
-                    ],
-                }
-            ],
-        )
-        return response.choices[0].message.content # Extract the processed result from the API response
-
-    def __extract_summary(self,client_ai,response: str,prompt_summary: str):
-        """
-        Uses Azure OpenAI chat completion to extract the 'summary' field from a JSON string or dict.
-        """
-        if isinstance(response, str):
-            try:
-                response_json = json.loads(response)
-            except json.JSONDecodeError:
-                return "Invalid JSON response"
-        else:
-            response_json = response
-        
-        chat_response = client_ai.chat.completions.create(
-            model=os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME"),
-            temperature=0,
-            top_p=0,
-            messages=[
-                {
-                    "role": "system",
-                    "content": prompt_summary
-                },
-                {
-                    "role": "user",
-                    "content": f"JSON:\n{json.dumps(response_json, ensure_ascii=False)}"
-                }
-            ]
-        )
-
-        chat_response_json = json.loads(chat_response.choices[0].message.content)
-        return '\n'.join(chat_response_json["summary"]),', '.join(chat_response_json["tags"])
-
-    def __process_images(self,client_ai, prompt_img, detail_level, images, logfile_path,prompt_summary):
-        times = []
-        
-        total_images = len(images)
+    def create_engine(self,sample_dir, manifest=None, detail_level="low"):
+        """
+        Returns an async vision engine for Azure OpenAI, with its image preprocessor and response cache kept under
+        vision_cache in the state folder (see StatePaths.state_dir), so both are reused across runs. The engine's
+        cache is released by close_engine(); its client is shared.
+        """
+        # The OpenAI SDK is only imported when this stage actually runs
+        from agent_plugin.AsyncVisionEngine import AsyncVisionEngine
+        from agent_plugin.ClientRegistry import get_openai_client
+        from agent_plugin.ImagePreprocessor import ImagePreprocessor
+        from agent_plugin.ResponseCache import ResponseCache
 
-        for i, image in enumerate(images):
-            encoded_image = self.__encode_image_to_base64(image)
-        
-            start_time = time.time()
-            response = self.__image_object_detect(client_ai,prompt_img, detail_level, encoded_image)
-            end_time = time.time()
-            request_time = end_time - start_time
-            times.append(end_time - start_time)
+        # Shared, pooled Azure OpenAI client - retries are handled by the engine, honoring Retry-After
+        client = get_openai_client(max_retries=0)
 
-            # print(f"Image: {image}, Request Time: {round(request_time, 4)} seconds, Response: {json.loads(response)}")
-            
-            summary, tags = self.__extract_summary(client_ai,response, prompt_summary)
-            
-            log_entry = f"\n===== Image: {os.path.normpath(image).split(os.sep)[-3:]} =============================================="
-            log_entry += f"\nTags:"
-            log_entry += f"\n{tags}"
-            log_entry += f"\n"
-            log_entry += f"\nContent Description:"
-            log_entry += f"\n{summary}"
-            log_entry += f"\n"
-            log_entry += f"\nAnalysis Time: {round(request_time, 4)} seconds"
+        current_directory = os.path.dirname(os.path.abspath(__file__))
+        with open(f"{current_directory}/prompts/prompt_img_content.txt", "r") as file:
+            prompt_img_content = file.read()
+        with open(f"{current_directory}/prompts/prompt_text_summary.txt", "r") as file:
+            prompt_text_summary = file.read()
+
+        # Single-pass mode asks the vision call for summary/tags/named_entities directly (one round trip per image)
+        prompt_img_structured = None
+        if os.getenv("AZURE_OPENAI_SINGLE_PASS", "0") == "1":
+            with open(f"{current_directory}/prompts/prompt_img_structured.txt", "r") as file:
+                prompt_img_structured = file.read()
+
+        # Upload bounded-size JPEG derivatives matched to the detail level, cached with the responses
+        cache_dir = Path(state_dir(), "vision_cache")
+        preprocessor = ImagePreprocessor(cache_dir, detail_level, manifest=manifest,
+                                         max_bytes=int(os.getenv("AZURE_OPENAI_IMAGE_CACHE_MAX_MB", "512")) * 1024 * 1024)
+        # Deterministic (temperature=0) responses are reused across runs and duplicated images
+        cache = ResponseCache(Path(cache_dir, "responses.db"),
+                              max_bytes=int(os.getenv("AZURE_OPENAI_CACHE_MAX_MB", "256")) * 1024 * 1024)
+        return AsyncVisionEngine(client, os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME"),
+                                 prompt_img_content, prompt_text_summary, detail_level,
+                                 max_concurrency=int(os.getenv("AZURE_OPENAI_MAX_CONCURRENCY", "8")),
+                                 max_retries=int(os.getenv("AZURE_OPENAI_MAX_RETRIES", "6")),
+                                 preprocessor=preprocessor,
+                                 cache=cache,
+                                 prompt_structured=prompt_img_structured)
+
+    async def close_engine(self,engine):
+        if engine.single_pass_fallbacks > 0:
+            print(f"Single-pass analysis fell back to the two-step path for {engine.single_pass_fallbacks} images.")
+        if engine.retries > 0:
+            print(f"Azure OpenAI requests retried {engine.retries} times after throttling or transient errors.")
+        print(f"Azure OpenAI response cache: {engine.cache.stats()}")
+        engine.cache.close()
+
+    def cached_analysis(self,media_file, detail_level, manifest=None):
+        """Returns the analysis already stored for this image content at {detail_level} (also set on the record), or None."""
+        if manifest is None:
+            return None
+        cached = manifest.get_result(media_file, self.STAGE, f"{self.STAGE_VERSION}-{detail_level}")
+        if cached is not None:
+            media_file.results[self.STAGE] = cached
+        return cached
+
+    def record_analysis(self,media_file, result, detail_level, manifest=None, store=None) -> str:
+        """
+        Stores a successful engine result on the record, in the manifest and in the results {store}.
+
+        Returns:
+            str: the log entry of the image.
+        """
+        request_time = result["request_time"]
+        summary = '\n'.join(result["summary"])
+        tags = ', '.join(result["tags"])
+
+        log_entry = f"\n===== Image: {os.path.normpath(result['image']).split(os.sep)[-3:]} =============================================="
+        log_entry += f"\nTags:"
+        log_entry += f"\n{tags}"
+        log_entry += f"\n"
+        log_entry += f"\nContent Description:"
+        log_entry += f"\n{summary}"
+        log_entry += f"\n"
+        log_entry += f"\nAnalysis Time: {round(request_time, 4)} seconds"
+        log_entry += f"\n"
+
+        media_file.results[self.STAGE] = {"summary": summary, "tags": tags}
+        if manifest is not None:
+            manifest.record(media_file, self.STAGE, f"{self.STAGE_VERSION}-{detail_level}", media_file.results[self.STAGE])
+        if store is not None:
+            store.add(media_file.path, self.STAGE,
+                      {"summary": result["summary"], "tags": result["tags"], "named_entities": result["named_entities"],
+                       "request_time": request_time, "detail_level": detail_level},
+                      log_entry)
+        return log_entry
+
+    def detail_level_of(self,media_file, detail_level, store=None):
+        """
+        Returns the detail level the cascade router chose for the image (see VisionRouterPlugin), None when it
+        routed the image past the vision model, or {detail_level} when the image was not routed. A decision of an
+        earlier run is read from the results {store} when this run did not route the image.
+        """
+        decision = media_file.results.get(ROUTE_STAGE)
+        if decision is None and store is not None:
+            decision = store.get(media_file.path, ROUTE_STAGE)
+            if decision is not None:
+                media_file.results[ROUTE_STAGE] = decision
+        if decision is None:
+            return detail_level
+        return None if decision["route"] == "skip" else decision["route"]
+
+    def reuse_representative(self,media_file, detail_level, manifest=None, store=None) -> bool:
+        """
+        Copies the analysis of the representative of a near-duplicate image (see DuplicateAnalystPlugin) instead of
+        sending the image to Azure OpenAI; returns False when there is no analyzed representative.
+        """
+        representative = media_file.duplicate_of
+        if representative is None or self.STAGE not in representative.results:
+            return False
+        media_file.results[self.STAGE] = representative.results[self.STAGE]
+        if manifest is not None:
+            manifest.record(media_file, self.STAGE, f"{self.STAGE_VERSION}-{detail_level}", media_file.results[self.STAGE])
+        stored = store.get(representative.path, self.STAGE) if store is not None else None
+        if stored is not None:
+            log_entry = f"\n===== Image: {os.path.normpath(media_file.path).split(os.sep)[-3:]} =============================================="
+            log_entry += f"\nNear-duplicate of {representative.name}, analysis reused."
             log_entry += f"\n"
-                    
-            print(f"{log_entry}")
+            store.add(media_file.path, self.STAGE, dict(stored, duplicate_of=representative.path), log_entry)
+        return True
+
+    async def __process_images(self,engine, images, store, manifest=None):
+        """
+        Returns:
+            tuple: (analyzed, failed) counts of the images that were sent to Azure OpenAI, and the count of the
+            images the cascade router skipped.
+        """
+        # Skip images already analyzed with the same stage version and detail level
+        pending = {}
+        detail_levels = {}
+        duplicates = []
+        skipped = 0
+        for media_file in images:
+            detail_level = self.detail_level_of(media_file, engine.detail_level, store)
+            if detail_level is None:
+                skipped += 1
+                continue
+            if self.cached_analysis(media_file, detail_level, manifest) is not None:
+                continue
+            detail_levels[media_file.path] = detail_level
+            # Near-duplicates wait for their representative's analysis
+            if media_file.duplicate_of is not None:
+                duplicates.append(media_file)
+                continue
+            pending[media_file.path] = media_file
+
+        analyzed, failed = await self.__analyze_pending(engine, pending, detail_levels, store, manifest)
+        leftovers = {media_file.path: media_file for media_file in duplicates
+                     if not self.reuse_representative(media_file, detail_levels[media_file.path], manifest, store)}
+        leftovers_analyzed, leftovers_failed = await self.__analyze_pending(engine, leftovers, detail_levels, store,
+                                                                            manifest)
+        return analyzed + leftovers_analyzed, failed + leftovers_failed, skipped
+
+    async def __analyze_pending(self,engine, pending, detail_levels, store, manifest=None):
+        total_images = len(pending)
+        if total_images == 0:
+            return 0, 0
 
-            with open(logfile_path, "a", encoding="utf-8") as log_file:
-                log_file.write(log_entry) 
+        # Results arrive in completion order while up to engine.max_concurrency images are in flight
+        completed = 0
+        failed = 0
+        async for result in engine.analyze_all(list(pending), detail_levels):
+            completed += 1
+            image = result["image"]
+            if result["error"] is not None:
+                print(f"\nERROR: Analysis failed for {image}: {str(result['error'])}")
+                failed += 1
+                self.__update_progress_bar(completed, total_images)
+                continue
+
+            log_entry = self.record_analysis(pending[image], result, result["detail_level"], manifest, store)
+            print(f"{log_entry}")
             
             # Calculate and Print progress percentage
-            self.__update_progress_bar(i+1, total_images)
+            self.__update_progress_bar(completed, total_images)
             print("\n")
 
-        #update_progress_bar(len(images), total_images)
-        # sys.stdout.write("\n")  # Move to the next line after completion
+        return completed - failed, failed
 
-        return
+    @instrumented_stage("expert")
+    async def analyze_folder(self, album_dir, detail_level="low") -> VisionResult:
+        """
+        Analyzes the images of {album_dir} with Azure OpenAI and records the results in the results store.
 
-    @kernel_function(description="Use Azure OpenAI to detect image content and extract tags from the media files stored in {album_dir}.")
-    def media_content_analysis(self, album_dir:str) -> str:
+        Images routed by the cascade router, in this run or an earlier one, are analyzed at the detail level it
+        chose, or skipped; the others at {detail_level}.
+        """
+        sample_dir = Path(album_dir).parent
+        if not sample_dir:
+            raise FileNotFoundError("Parent directory does not exist.")
+        
+        # Check if the album directory exists
+        if not album_dir:
+            raise FileNotFoundError("Album directory does not exist.")
+
+        # Process each file in the media directory
+        images = get_catalog(sample_dir).files(album_dir, kind="image")
+        manifest = get_manifest(sample_dir)
+        store = get_results_store(sample_dir)
+        engine = self.create_engine(sample_dir, manifest, detail_level)
         try:
-            load_dotenv() # Load environment variables from .env file
-
-            # Azure OpenAI client
-            client = AzureOpenAI(
-                azure_deployment=os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME"),
-                azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
-                api_key=os.getenv("AZURE_OPENAI_API_KEY"),
-                api_version=os.getenv("AZURE_OPENAI_API_VERSION")
-            )
-            
-            sample_dir = Path(album_dir).parent
-            if not sample_dir:
-                raise FileNotFoundError("Parent directory does not exist.")
-            
-            # Check if the album directory exists
-            if not album_dir:
-                raise FileNotFoundError("Album directory does not exist.")
+            analyzed, failed, skipped = await self.__process_images(engine,images,store,manifest)
+        finally:
+            store.flush()
+            manifest.commit()
+            # Make the new results searchable; only records written since the last update are read
+            get_album_index(sample_dir).update(store)
+            await self.close_engine(engine)
+        
+        print(f"Advanced AI media files content analysis completed successfully.")
+        if skipped > 0:
+            print(f"{skipped} images routed past Azure OpenAI by the cascade router.")
+        return VisionResult(str(album_dir), len(images), analyzed, failed, skipped)
 
-            # Directory for media file content logs - create it if it does not exist
-            logfiles_dir  = Path(sample_dir, "ai_logs")           
-            if not os.path.exists(logfiles_dir):
-                os.makedirs(logfiles_dir, exist_ok=True)
+    def create_batch_jobs(self,sample_dir, engine):
+        """
+        Returns the Batch API runner of the bulk mode for {engine}, with its job files and tracker kept in
+        vision_batches in the state folder, which survives the reset of {sample_dir}. Jobs go to
+        AZURE_OPENAI_BATCH_DEPLOYMENT_NAME (a Global Batch deployment).
+        """
+        from agent_plugin.VisionBatchJobs import VisionBatchJobs, batch_work_dir
 
-            current_directory = os.path.dirname(os.path.abspath(__file__))
-            with open(f"{current_directory}/prompts/prompt_img_content.txt", "r") as file:
-                prompt_img_content = file.read()
-            with open(f"{current_directory}/prompts/prompt_text_summary.txt", "r") as file:
-                prompt_text_summary = file.read()
+        return VisionBatchJobs(engine.client,
+                               os.getenv("AZURE_OPENAI_BATCH_DEPLOYMENT_NAME", engine.deployment),
+                               engine,
+                               batch_work_dir(),
+                               poll_seconds=float(os.getenv("AZURE_OPENAI_BATCH_POLL_SECONDS", "60")),
+                               max_file_requests=int(os.getenv("AZURE_OPENAI_BATCH_MAX_REQUESTS", "50000")),
+                               max_file_bytes=int(os.getenv("AZURE_OPENAI_BATCH_MAX_MB", "190")) * 1024 * 1024)
 
+    @instrumented_stage("expert_bulk")
+    async def bulk_analyze_folder(self, album_dir, detail_level="low", wait=True) -> VisionResult:
+        """
+        Analyzes the images of {album_dir} like analyze_folder, but through Azure OpenAI batch jobs: half the cost
+        and a separate quota, for results that may take up to 24 hours. Without {wait}, it submits the jobs,
+        records what already finished and returns; running it again collects the rest.
+
+        Routing decisions of an earlier run are read from the results store.
+        """
+        sample_dir = Path(album_dir).parent
+        if not sample_dir:
+            raise FileNotFoundError("Parent directory does not exist.")
+
+        images = get_catalog(sample_dir).files(album_dir, kind="image")
+        manifest = get_manifest(sample_dir)
+        store = get_results_store(sample_dir)
+        engine = self.create_engine(sample_dir, manifest, detail_level)
+        jobs = self.create_batch_jobs(sample_dir, engine)
+        pending = {}
+        duplicates = []
+        skipped = 0
+        analyzed = 0
+        failed = 0
+        handled = []
+        try:
+            for media_file in images:
+                image_detail_level = self.detail_level_of(media_file, detail_level, store)
+                if image_detail_level is None:
+                    skipped += 1
+                    continue
+                if self.cached_analysis(media_file, image_detail_level, manifest) is not None:
+                    continue
+                # Near-duplicates reuse their representative's analysis once it is merged
+                if media_file.duplicate_of is not None:
+                    duplicates.append((media_file, image_detail_level))
+                    continue
+                pending[media_file.path] = (media_file, image_detail_level)
+            # Near-duplicates of a representative that is neither analyzed nor pending are sent themselves
+            for media_file, image_detail_level in list(duplicates):
+                representative = media_file.duplicate_of
+                if representative.path not in pending and self.STAGE not in representative.results:
+                    duplicates.remove((media_file, image_detail_level))
+                    pending[media_file.path] = (media_file, image_detail_level)
+
+            async for result in jobs.run({path: level for path, (_, level) in pending.items()}, wait):
+                if result["error"] is not None:
+                    print(f"ERROR: Analysis failed for {result['image']}: {str(result['error'])}")
+                    failed += 1
+                    handled.append(result["request_id"])
+                    continue
+                log_entry = self.record_analysis(pending[result["image"]][0], result, result["detail_level"],
+                                                 manifest, store)
+                handled.append(result["request_id"])
+                print(f"{log_entry}")
+                analyzed += 1
+
+            for media_file, image_detail_level in duplicates:
+                self.reuse_representative(media_file, image_detail_level, manifest, store)
+            in_flight = jobs.in_flight()
+        finally:
+            store.flush()
+            manifest.commit()
+            # Only results written to the results store are merged; the others are handed over again by the next run
+            jobs.mark_merged(handled)
+            get_album_index(sample_dir).update(store)
+            jobs.close()
+            await self.close_engine(engine)
+
+        print(f"Bulk AI media files content analysis: {analyzed} images analyzed, {failed} failed.")
+        if in_flight > 0:
+            print(f"{in_flight} requests are still in batch jobs; run the bulk mode again to collect them.")
+        if skipped > 0:
+            print(f"{skipped} images routed past Azure OpenAI by the cascade router.")
+        return VisionResult(str(album_dir), len(images), analyzed, failed, skipped)
+
+    @kernel_function(description="Use Azure OpenAI to detect image content and extract tags from the media files stored in {album_dir}.")
+    async def media_content_analysis(self, album_dir:str) -> str:
+        try:
             detail_level = "low"
             # detail_level = "high"
-
-            # Process each file in the media directory
-            images = []
-            for root, _, files in os.walk(album_dir):
-                for file in files:
-                    images.append(os.path.join(root, file))
-            self.__process_images(prompt_img_content,detail_level,images,logfiles_dir,client,prompt_text_summary)
-            
-            print(f"Advanced AI media files content analysis completed successfully.")
+            await self.analyze_folder(album_dir, detail_level)
             return f"Advanced AI media files content analysis completed successfully."
         except FileNotFoundError as e:  
             print(f"ERROR: The specified directory does not exist: {str(e)}")
@@ -185,31 +345,3 @@ class ExpertContentAnalystPlugin:
         except Exception as e:
             print(f"ERROR:An error occurred: {str(e)}") 
             return f"ERROR: An error occurred: {str(e)}"
-        
-    
-    
-    
-    # # Directory for media file content logs - create it if it does not exist
-    # logfiles_dir  = Path(current_directory, "object_detection_logs")           
-    # if not os.path.exists(logfiles_dir):
-    #     os.makedirs(logfiles_dir, exist_ok=True)
-    # today_str = datetime.now().strftime("%d%m%Y")
-    
-    # logfile_path = os.path.join(logfiles_dir, f"{today_str}.txt")
-
-    # if os.path.exists(logfile_path):
-    #     os.remove(logfile_path)
-
-    # detail_level = "low"
-    # # detail_level = "high"
-        
-    # folder_path = os.getenv("MEDIA_SOURCE_PATH")
-    # sorted_folder_path = sort_files_numerically(folder_path)
-    
-    # images = []
-    # for filename in sorted_folder_path:
-    #     if filename.upper().endswith(".JPG") or filename.upper().endswith(".JPEG") or filename.upper().endswith(".PNG"):
-    #         image_path = os.path.join(folder_path, filename)
-    #         images.append(image_path)
-
-    
@@ -0,0 +1,130 @@
+import asyncio
+import os
+import threading
+import time
+
+# Names of files still being written by browsers and copy tools; they are picked up once renamed
+PARTIAL_SUFFIXES = (".part", ".partial", ".tmp", ".crdownload", ".download", ".filepart", "~")
+
+
+# class for watching the media source folder
+class FolderWatcher:
+    """
+    Watches the files directly in {folder} for new arrivals, with inotify on Linux (through watchdog; set {polling}
+    for network shares, where file system events do not arrive).
+
+    A new or changed file is reported once it has settled: no event for {debounce} seconds, then the same size and
+    mtime on two checks in a row, so a partially written upload is never picked up. Hidden files and partial
+    downloads are ignored until renamed to their final name. A file is reported again only when it changes.
+    """
+
+    def __init__(self, folder, debounce: float = 1.0, polling: bool = False, tick: float = 0.25):
+        self.folder = os.path.abspath(folder)
+        self.debounce = debounce
+        self.polling = polling
+        self.tick = tick
+        self._lock = threading.Lock()
+        self._pending = {}  # path -> [time of the last event, stat at the last check]
+        self._reported = {}  # path -> (size, mtime_ns) when last reported
+        self._observer = None
+
+    def __ignored(self, path) -> bool:
+        name = os.path.basename(path)
+        return os.path.dirname(path) != self.folder or name.startswith(".") or name.lower().endswith(PARTIAL_SUFFIXES)
+
+    def _touch(self, path):
+        path = os.path.abspath(path)
+        if not self.__ignored(path):
+            with self._lock:
+                self._pending[path] = [time.monotonic(), None]
+
+    def _forget(self, path):
+        path = os.path.abspath(path)
+        with self._lock:
+            self._pending.pop(path, None)
+            self._reported.pop(path, None)
+
+    def __handler(self):
+        from watchdog.events import FileSystemEventHandler
+
+        watcher = self
+
+        class Handler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                if event.is_directory:
+                    return
+                if event.event_type in ("created", "modified", "closed"):
+                    watcher._touch(event.src_path)
+                elif event.event_type == "moved":
+                    # Moved out (e.g. into the album by the pipeline itself) or renamed from a partial download
+                    watcher._forget(event.src_path)
+                    watcher._touch(event.dest_path)
+                elif event.event_type == "deleted":
+                    watcher._forget(event.src_path)
+
+        return Handler()
+
+    def start(self) -> "FolderWatcher":
+        if self.polling:
+            from watchdog.observers.polling import PollingObserver as Observer
+        else:
+            from watchdog.observers import Observer
+
+        self._observer = Observer()
+        self._observer.schedule(self.__handler(), self.folder, recursive=False)
+        self._observer.start()
+        return self
+
+    def stop(self) -> None:
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join()
+            self._observer = None
+
+    def mark_reported(self, media_files) -> None:
+        """Records files already handed to the pipeline (e.g. by the initial listing), so they are not reported twice."""
+        with self._lock:
+            for media_file in media_files:
+                self._reported[media_file.path] = (media_file.size, media_file.mtime_ns)
+
+    @property
+    def idle(self) -> bool:
+        """True when no file is waiting to settle."""
+        with self._lock:
+            return not self._pending
+
+    def settled(self) -> list:
+        """Returns the paths of the files that settled since the last call."""
+        now = time.monotonic()
+        with self._lock:
+            due = [(path, entry[1]) for path, entry in self._pending.items() if now - entry[0] >= self.debounce]
+        ready = []
+        for path, last_stat in due:
+            try:
+                stat = os.stat(path)
+                current = (stat.st_size, stat.st_mtime_ns)
+            except FileNotFoundError:
+                current = None
+            with self._lock:
+                entry = self._pending.get(path)
+                if entry is None or now - entry[0] < self.debounce:
+                    continue  # forgotten or written again meanwhile
+                if current is None:
+                    del self._pending[path]
+                elif current != last_stat:
+                    entry[1] = current  # still growing, or checked for the first time
+                else:
+                    del self._pending[path]
+                    if self._reported.get(path) != current:
+                        self._reported[path] = current
+                        ready.append(path)
+        return ready
+
+    async def arrivals(self, stop_event: asyncio.Event):
+        """Yields the list of file paths settled every {tick} seconds (often empty), until {stop_event} is set."""
+        while not stop_event.is_set():
+            try:
+                await asyncio.wait_for(stop_event.wait(), self.tick)
+            except asyncio.TimeoutError:
+                pass
+            yield await asyncio.to_thread(self.settled)
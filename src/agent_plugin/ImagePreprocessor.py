@@ -0,0 +1,139 @@
+import base64
+import hashlib
+import os
+import threading
+from io import BytesIO
+from pathlib import Path
+
+# Bump when the derivative format changes so stale cached files are not reused
+PREPROCESSOR_VERSION = "1"
+
+# Largest image the service uses for each detail level: "low" is downsampled to 512x512, "high" is fit
+# within 2048x2048 and then scaled so its shortest side is 768 pixels
+DETAIL_LIMITS = {
+    "low": {"max_side": 512, "short_side": None},
+    "high": {"max_side": 2048, "short_side": 768},
+}
+
+
+def target_size(width: int, height: int, detail_level: str):
+    """Returns the largest (width, height) the service keeps for an image at the given detail level."""
+    limits = DETAIL_LIMITS.get(detail_level, DETAIL_LIMITS["high"])
+    scale = min(1.0, limits["max_side"] / max(width, height))
+    if limits["short_side"] is not None:
+        scale = min(scale, limits["short_side"] / min(width, height))
+    return max(1, int(width * scale)), max(1, int(height * scale))
+
+
+# class for vision upload preprocessing
+class ImagePreprocessor:
+    """
+    Produces bounded-size JPEG derivatives of images before they are sent to the vision model.
+
+    JPEGs are decoded at reduced scale with PIL draft mode, other formats are shrunk with reduce(), and the
+    result never exceeds what the service would keep for the chosen detail level. Derivatives are cached on
+    disk under {cache_dir}, so repeated analyses of the same image do not decode the original again; once they
+    exceed {max_bytes}, the least recently used ones are deleted.
+    Each call may ask for another detail level than the default {detail_level} (e.g. escalated images).
+    """
+
+    def __init__(self, cache_dir, detail_level: str = "low", quality: int = 85, manifest=None,
+                 max_bytes: int = 512 * 1024 * 1024):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.detail_level = detail_level
+        self.quality = quality
+        self.manifest = manifest
+        self.max_bytes = max_bytes
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._total_bytes = sum(size for _, size, _ in self.__cached_files())
+        # A lower bound than the cached files already take applies at once
+        if self._total_bytes > self.max_bytes:
+            self.__evict()
+
+    def __cached_files(self):
+        # The folder also holds the response cache: only the derivatives are counted and evicted
+        files = []
+        with os.scandir(self.cache_dir) as entries:
+            for entry in entries:
+                if entry.name.endswith(".jpg"):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    files.append((entry.path, stat.st_size, stat.st_mtime))
+        return files
+
+    def __evict(self):
+        # The mtime is the last use (see prepare); evicting down to 90% of the bound spares a folder scan per write
+        files = sorted(self.__cached_files(), key=lambda file: file[2])
+        self._total_bytes = sum(size for _, size, _ in files)
+        for path, size, _ in files:
+            if self._total_bytes <= self.max_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self._total_bytes -= size
+            self.evictions += 1
+
+    def __cache_key(self, image_path, detail_level) -> str:
+        # Prefer the manifest content hash: it survives moves into the album without re-hashing
+        if self.manifest is not None:
+            identity = self.manifest.fingerprint(image_path)
+        else:
+            stat = os.stat(image_path)
+            identity = f"{os.path.abspath(image_path)}|{stat.st_size}|{stat.st_mtime_ns}"
+        key = f"{identity}|{detail_level}|{self.quality}|{PREPROCESSOR_VERSION}"
+        return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+    def __render(self, image_path, detail_level) -> bytes:
+        from PIL import Image, ImageOps
+
+        with Image.open(image_path) as image:
+            # Rotation may swap width and height, so draft against the larger of the two targets
+            width, height = target_size(image.width, image.height, detail_level)
+            side = max(width, height)
+            if image.format == "JPEG":
+                image.draft("RGB", (side, side))
+            image = ImageOps.exif_transpose(image)
+            width, height = target_size(image.width, image.height, detail_level)
+            if image.mode not in ("RGB", "L"):
+                image = image.convert("RGB")
+            image.thumbnail((width, height), Image.Resampling.LANCZOS, reducing_gap=2.0)
+            buffer = BytesIO()
+            image.save(buffer, format="JPEG", quality=self.quality, optimize=True)
+            return buffer.getvalue()
+
+    def prepare(self, image_path, detail_level: str = None) -> bytes:
+        """
+        Returns the JPEG bytes of the derivative for the image, creating and caching it when needed.
+        """
+        detail_level = detail_level or self.detail_level
+        cached_path = self.cache_dir / f"{self.__cache_key(image_path, detail_level)}.jpg"
+        try:
+            data = cached_path.read_bytes()
+            # Marks the derivative as recently used for the eviction
+            os.utime(cached_path)
+            return data
+        except FileNotFoundError:
+            pass
+
+        data = self.__render(image_path, detail_level)
+        # Write to a temporary file first so concurrent workers never read a partial derivative
+        tmp_path = cached_path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, cached_path)
+        with self._lock:
+            self._total_bytes += len(data)
+            if self._total_bytes > self.max_bytes:
+                self.__evict()
+        return data
+
+    def encode(self, image_path, detail_level: str = None):
+        """
+        Returns (base64 string, MIME type) of the derivative, ready for a data URL.
+        """
+        return base64.b64encode(self.prepare(image_path, detail_level)).decode("utf-8"), "image/jpeg"
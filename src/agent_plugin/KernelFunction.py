@@ -0,0 +1,24 @@
+def kernel_function(description: str = None, name: str = None):
+    """
+    Marks a plugin method as a Semantic Kernel function without importing Semantic Kernel.
+
+    Direct, stream and watch runs import the plugins but never hand them to an agent, so the real decorator of
+    semantic_kernel is only applied by bind_kernel_functions(), when the agents are created.
+    """
+    def decorator(function):
+        function.__deferred_kernel_function__ = {"description": description, "name": name}
+        return function
+    return decorator
+
+
+def bind_kernel_functions(plugin):
+    """Applies semantic_kernel's kernel_function decorator to the marked methods of {plugin}'s class; returns {plugin}."""
+    from semantic_kernel.functions.kernel_function_decorator import kernel_function as sk_kernel_function
+
+    plugin_class = type(plugin)
+    for attribute, member in list(vars(plugin_class).items()):
+        options = getattr(member, "__deferred_kernel_function__", None)
+        # Bound once per class: the decorated method carries __kernel_function__
+        if options is not None and not getattr(member, "__kernel_function__", False):
+            setattr(plugin_class, attribute, sk_kernel_function(member, **options))
+    return plugin
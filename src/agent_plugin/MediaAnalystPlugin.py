@@ -1,30 +1,79 @@
-from semantic_kernel.functions.kernel_function_decorator import kernel_function
 from pathlib import Path
 import os
 import shutil
-import magic
+
+from agent_plugin.KernelFunction import kernel_function
+from agent_plugin.MediaCatalog import get_catalog
+from agent_plugin.MediaManifest import get_manifest
+from agent_plugin.Metrics import get_metrics, instrumented_stage
+from agent_plugin.MediaTypeClassifier import classify, classify_all, is_media_mime
+from agent_plugin.StageResults import ValidationResult
 
 # class for MediaAnalys functions
 class MediaAnalystPlugin:
     """A plugin that reads and analyzes media files."""
-    def __is_media_file(self,file_path):
-        mime_type = magic.from_file(file_path, mime=True)
-        return mime_type.startswith(('image/', 'audio/', 'video/'))
+    STAGE = "media_type"
+    STAGE_VERSION = "1"
+
+    def __classify(self,media_file, manifest=None):
+        """
+        Sets and returns the MIME type of the file, reusing the manifest result when the file was already classified.
+        """
+        with get_metrics().file_timer("validate"):
+            cached = manifest.get_result(media_file, self.STAGE, self.STAGE_VERSION) if manifest is not None else None
+            if cached is not None:
+                media_file.mime_type = cached["mime_type"]
+            else:
+                media_file.mime_type = classify(media_file.path)
+                if manifest is not None:
+                    manifest.record(media_file, self.STAGE, self.STAGE_VERSION,
+                                    {"mime_type": media_file.mime_type, "is_media": is_media_mime(media_file.mime_type)})
+        return media_file.mime_type
+
+    def __move_defective(self,media_file, defective_folder, catalog=None):
+        print(f"Moving the non-media file: {media_file.name}")
+        # Move the non-media file to a separate folder
+        defective_path = Path(defective_folder) / media_file.name
+        defective_path.parent.mkdir(parents=True, exist_ok=True)
+        shutil.move(media_file.path, defective_path)
+        if catalog is not None:
+            catalog.discard(media_file.path)
 
-    def __process_folder(self,source_folder, defective_folder):
+    def validate_file(self,media_file, defective_folder, manifest=None, catalog=None) -> bool:
+        """
+        Classifies one file and moves it to {defective_folder} when it is not a media file.
+
+        Returns:
+            bool: True if the file is a valid media file and stays in place.
+        """
+        try:
+            mime_type = self.__classify(media_file, manifest)
+        except Exception as e:
+            print(f"ERROR: Unable to read {media_file.path}: {str(e)}")
+            mime_type = None
+        if mime_type is not None and is_media_mime(mime_type):
+            return True
+        self.__move_defective(media_file, defective_folder, catalog)
+        return False
+
+    def __process_folder(self,source_folder, defective_folder, manifest=None, catalog=None):
         defective_count = 0
         processed_count = 0
         try:
-            for filename in os.listdir(source_folder):
+            # The run's shared catalog lists the folder once for all stages
+            catalog = catalog if catalog is not None else get_catalog(Path(source_folder).parent)
+            media_files = catalog.files(source_folder, recursive=False)
+
+            # Header sniffing fans out over a thread pool; each worker keeps its own libmagic handle
+            max_workers = int(os.getenv("MEDIA_TYPE_WORKERS", "0")) or None
+            classified = classify_all(media_files, max_workers,
+                                      classifier=lambda media_file: self.__classify(media_file, manifest))
+            for media_file, mime_type, error in classified:
                 processed_count += 1
-                if not self.__is_media_file(os.path.join(source_folder, filename)):
+                if error is not None or not is_media_mime(mime_type):
                     # Add non-media file to the list
                     defective_count += 1
-                    print(f"Moving the non-media file: {filename}")
-                    # Move the non-media file to a separate folder
-                    defective_path = defective_folder / filename   
-                    defective_path.parent.mkdir(parents=True, exist_ok=True)
-                    shutil.move(os.path.join(source_folder, filename), defective_path)
+                    self.__move_defective(media_file, defective_folder, catalog)
         except FileNotFoundError as e:  
             defective_count += 1
             print(f"ERROR: The specified directory does not exist: {e}")
@@ -36,25 +85,35 @@ class MediaAnalystPlugin:
             return processed_count, defective_count
             
         
+    @instrumented_stage("validate")
+    def validate_folder(self, source_dir) -> ValidationResult:
+        """
+        Moves the files of {source_dir} that are not valid media files to the 'defective' folder next to it.
+        """
+        # Directory for defective files - create it if it does not exist
+        parent_dir = Path(source_dir).parent
+        if not parent_dir:
+            raise FileNotFoundError("Parent directory does not exist.")
+        defective_dir  = Path(parent_dir, "defective")           
+        if not os.path.exists(defective_dir):
+            os.makedirs(defective_dir, exist_ok=True)
+
+        manifest = get_manifest(parent_dir)
+        processed_count, defective_count = self.__process_folder(source_dir, defective_dir, manifest,
+                                                                 get_catalog(parent_dir))
+        manifest.commit()
+        print(f"Photo organization completed successfully: identified {defective_count} defective out of {processed_count} files.")
+        return ValidationResult(str(source_dir), str(defective_dir), processed_count, defective_count)
+
     @kernel_function(description="Access and analyze the given directory for valid media types and move the files that raise exceptions in another folder")
     def analyze_media_types(self, source_dir:str) -> str:
         try:
             # Source directory with photos
             # source_dir = Path(os.getenv("MEDIA_SOURCE_PATH"))
 
-            # Directory for defective files - create it if it does not exist
-            parent_dir = Path(source_dir).parent
-            if not parent_dir:
-                raise FileNotFoundError("Parent directory does not exist.")
-            defective_dir  = Path(parent_dir, "defective")           
-            if not os.path.exists(defective_dir):
-                os.makedirs(defective_dir, exist_ok=True)
-
             # defective_dir = Path(os.getenv("MEDIA_DEFECTIVE_PATH"))
 
-            processed_count, defective_count = self.__process_folder(source_dir, defective_dir)
-                        
-            print(f"Photo organization completed successfully: identified {defective_count} defective out of {processed_count} files.")
+            self.validate_folder(source_dir)
             result = f"Extract the metadata and organize the valid photos stored in the source directory at {source_dir}."
             # Convert the result string into a chat message for the Metadata Analyst agent
             chat_message = {
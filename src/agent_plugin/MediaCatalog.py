@@ -0,0 +1,126 @@
+import os
+import threading
+
+from agent_plugin.MediaFile import MediaFile
+
+# Catalogs of the current run, keyed by sample directory, so every stage shares one scan
+_catalogs = {}
+_catalogs_lock = threading.Lock()
+
+
+def get_catalog(sample_dir) -> "MediaCatalog":
+    """Returns the catalog of the current run for the given sample directory."""
+    key = os.path.abspath(sample_dir)
+    with _catalogs_lock:
+        if key not in _catalogs:
+            _catalogs[key] = MediaCatalog()
+        return _catalogs[key]
+
+
+def reset_catalogs() -> None:
+    """Forgets every catalog, so the next run scans the folders again."""
+    with _catalogs_lock:
+        _catalogs.clear()
+
+
+# class for the shared per-run file catalog
+class MediaCatalog:
+    """
+    The in-memory list of MediaFile records shared by all pipeline stages of one run.
+
+    Each root folder is walked with os.scandir at most once per run; later stages read (and enrich) the
+    same records instead of listing and stat'ing the folder again. Moves and removals done by a stage are
+    reflected here so the catalog stays in sync with the disk.
+    """
+
+    def __init__(self):
+        self._roots = {}  # root path -> {file path: MediaFile}
+        self._lock = threading.RLock()
+
+    def __root_of(self, file_path):
+        for root in self._roots:
+            if file_path == root or file_path.startswith(root + os.sep):
+                return root
+        return None
+
+    def __scan(self, root):
+        files = {}
+        stack = [root]
+        while stack:
+            try:
+                with os.scandir(stack.pop()) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        elif entry.is_file(follow_symlinks=False):
+                            files[entry.path] = MediaFile.from_dir_entry(entry)
+            except FileNotFoundError:
+                continue
+        return files
+
+    def files(self, root, recursive: bool = True, kind: str = None) -> list:
+        """
+        Returns the MediaFile records under {root}, scanning it on first request only.
+
+        Args:
+            root: The folder to list.
+            recursive (bool): Include files in subfolders; otherwise only the files directly in {root}.
+            kind (str): Only return files of this kind ('image', 'video' or 'other').
+        """
+        root = os.path.abspath(root)
+        with self._lock:
+            parent = self.__root_of(root)
+            if parent is None:
+                self._roots[root] = self.__scan(root)
+                parent = root
+            records = [media_file for path, media_file in self._roots[parent].items()
+                       if parent == root or path.startswith(root + os.sep)]
+        if not recursive:
+            records = [media_file for media_file in records if os.path.dirname(media_file.path) == root]
+        if kind is not None:
+            records = [media_file for media_file in records if media_file.kind == kind]
+        return records
+
+    def get(self, file_path):
+        file_path = os.path.abspath(file_path)
+        with self._lock:
+            root = self.__root_of(file_path)
+            return self._roots[root].get(file_path) if root is not None else None
+
+    def add(self, file_path):
+        """
+        Records a file that appeared after its folder was scanned (e.g. a new upload seen in watch mode), replacing
+        any older record of the same path; returns the new record.
+        """
+        file_path = os.path.abspath(file_path)
+        stat = os.stat(file_path)
+        media_file = MediaFile(file_path, stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            root = self.__root_of(file_path)
+            if root is not None:
+                self._roots[root][file_path] = media_file
+        return media_file
+
+    def discard(self, file_path) -> None:
+        """Removes a file that left the scanned folders (e.g. moved to the defective folder)."""
+        file_path = os.path.abspath(file_path)
+        with self._lock:
+            root = self.__root_of(file_path)
+            if root is not None:
+                self._roots[root].pop(file_path, None)
+
+    def relocate(self, old_path, new_path) -> None:
+        """Moves the record of a file that was moved on disk, keeping everything the stages learned about it."""
+        old_path = os.path.abspath(old_path)
+        new_path = os.path.abspath(new_path)
+        with self._lock:
+            old_root = self.__root_of(old_path)
+            media_file = self._roots[old_root].pop(old_path, None) if old_root is not None else None
+            new_root = self.__root_of(new_path)
+            if new_root is None:
+                return  # the target folder is scanned from disk when first requested
+            if media_file is None:
+                stat = os.stat(new_path)
+                media_file = MediaFile(new_path, stat.st_size, stat.st_mtime_ns)
+            media_file.path = new_path
+            self._roots[new_root][new_path] = media_file
@@ -1,4 +1,72 @@
+import os
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.tiff', '.bmp', '.gif')
+VIDEO_EXTENSIONS = ('.mov', '.mp4')
+
+
 class MediaFile:
-    def __init__(self, file_path: str, media_type: str):
-        self.file_path = file_path  # Public attribute
-        self.media_type = media_type  # Public attribute
\ No newline at end of file
+    """
+    A compact record of one file seen by the pipeline.
+
+    Built once per run by the directory scan and enriched in place by every stage:
+    the media analyst sets {mime_type}, the metadata analyst sets {capture_date}, the manifest
+    caches {content_hash}, the duplicate analyst sets {duplicate_of} to the representative MediaFile of a
+    near-duplicate, and the content analysts add their output to {results} by stage name.
+    """
+    __slots__ = ("path", "size", "mtime_ns", "kind", "mime_type", "capture_date", "content_hash", "duplicate_of",
+                 "results")
+
+    def __init__(self, file_path: str, size: int = 0, mtime_ns: int = 0, mime_type: str = None):
+        self.path = file_path
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.kind = self.kind_of(file_path)
+        self.mime_type = mime_type
+        self.capture_date = None
+        self.content_hash = None
+        self.duplicate_of = None
+        self.results = {}
+
+    @classmethod
+    def from_dir_entry(cls, entry: os.DirEntry) -> "MediaFile":
+        stat = entry.stat(follow_symlinks=False)
+        return cls(entry.path, stat.st_size, stat.st_mtime_ns)
+
+    @staticmethod
+    def kind_of(file_path: str) -> str:
+        """Returns 'image', 'video' or 'other' from the file extension."""
+        extension = os.path.splitext(file_path)[1].lower()
+        if extension in IMAGE_EXTENSIONS:
+            return "image"
+        if extension in VIDEO_EXTENSIONS:
+            return "video"
+        return "other"
+
+    @property
+    def name(self) -> str:
+        return os.path.basename(self.path)
+
+    @property
+    def mtime(self) -> float:
+        return self.mtime_ns / 1e9
+
+    @property
+    def media_type(self) -> str:
+        return self.mime_type
+
+    @property
+    def is_image(self) -> bool:
+        return self.kind == "image"
+
+    @property
+    def is_video(self) -> bool:
+        return self.kind == "video"
+
+    def refresh_stat(self) -> None:
+        """Re-reads size and mtime after the file was changed on disk (e.g. by os.utime)."""
+        stat = os.stat(self.path)
+        self.size = stat.st_size
+        self.mtime_ns = stat.st_mtime_ns
+
+    def __repr__(self) -> str:
+        return f"MediaFile({self.path!r}, size={self.size}, kind={self.kind!r}, mime_type={self.mime_type!r})"
@@ -0,0 +1,226 @@
+import atexit
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from agent_plugin.Metrics import get_metrics
+from agent_plugin.StatePaths import state_dir
+
+HASH_CHUNK_SIZE = 1024 * 1024
+COMMIT_EVERY = 500
+
+# Manifests opened in this process, keyed by database path, so all plugins share one connection
+_manifests = {}
+_manifests_lock = threading.Lock()
+
+
+def get_manifest(sample_dir) -> "MediaManifest":
+    """
+    Returns the process-wide manifest for the given sample directory.
+
+    The database lives at MEDIA_MANIFEST_PATH when set, otherwise at manifest.db in the state folder (see
+    StatePaths.state_dir), which survives the reset of the sample folder.
+    """
+    db_path = os.getenv("MEDIA_MANIFEST_PATH") or os.path.join(state_dir(), "manifest.db")
+    db_path = os.path.abspath(db_path)
+    with _manifests_lock:
+        if db_path not in _manifests:
+            _manifests[db_path] = MediaManifest(db_path)
+        return _manifests[db_path]
+
+
+def _close_all_manifests():
+    with _manifests_lock:
+        for manifest in _manifests.values():
+            manifest.close()
+        _manifests.clear()
+
+
+atexit.register(_close_all_manifests)
+
+
+# class for the persistent media manifest
+class MediaManifest:
+    """
+    A local SQLite manifest of media files and the pipeline stages that already handled them.
+
+    Files are identified by content hash; the (path, size, mtime) of the last sighting is kept
+    so unchanged files are never re-hashed. Each stage stores its result under its own name and
+    version, so bumping a stage version re-processes only that stage.
+
+    Every method accepts either a file path or a MediaFile record; records reuse the size/mtime from
+    the run's directory scan and cache their content hash, so no extra stat() is needed.
+    """
+
+    def __init__(self, db_path: str):
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self.db_path = db_path
+        self._lock = threading.RLock()
+        self._pending_writes = 0
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                content_hash TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_files_hash ON files(content_hash);
+            CREATE TABLE IF NOT EXISTS stage_results (
+                content_hash TEXT NOT NULL,
+                stage TEXT NOT NULL,
+                version TEXT NOT NULL,
+                result TEXT,
+                processed_at REAL NOT NULL,
+                PRIMARY KEY (content_hash, stage)
+            );
+            """
+        )
+        self._conn.commit()
+
+    def __hash_file(self, file_path) -> str:
+        digest = hashlib.blake2b(digest_size=20)
+        with open(file_path, "rb") as file:
+            for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def __mark_dirty(self):
+        self._pending_writes += 1
+        if self._pending_writes >= COMMIT_EVERY:
+            self.commit()
+
+    def __identify(self, file):
+        """Returns (absolute path, size, mtime_ns, MediaFile or None) of a path or MediaFile."""
+        if hasattr(file, "content_hash"):
+            return os.path.abspath(file.path), file.size, file.mtime_ns, file
+        path = os.path.abspath(file)
+        stat = os.stat(path)
+        return path, stat.st_size, stat.st_mtime_ns, None
+
+    def fingerprint(self, file_path) -> str:
+        """
+        Returns the content hash of the file, hashing it only if its size or mtime changed since last seen.
+        """
+        path, size, mtime_ns, media_file = self.__identify(file_path)
+        if media_file is not None and media_file.content_hash is not None:
+            return media_file.content_hash
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT size, mtime_ns, content_hash FROM files WHERE path = ?", (path,)
+            ).fetchone()
+        if row and row[0] == size and row[1] == mtime_ns:
+            content_hash = row[2]
+        else:
+            content_hash = self.__hash_file(path)
+            with self._lock:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO files (path, size, mtime_ns, content_hash) VALUES (?, ?, ?, ?)",
+                    (path, size, mtime_ns, content_hash),
+                )
+                self.__mark_dirty()
+        if media_file is not None:
+            media_file.content_hash = content_hash
+        return content_hash
+
+    def get_result(self, file_path, stage: str, version: str):
+        """
+        Returns the stored result of {stage} at {version} for the file, or None if it still has to be processed.
+        """
+        content_hash = self.fingerprint(file_path)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT version, result FROM stage_results WHERE content_hash = ? AND stage = ?",
+                (content_hash, stage),
+            ).fetchone()
+        if row is None or row[0] != version:
+            get_metrics().inc("cache_misses_total", cache="manifest", stage=stage)
+            return None
+        get_metrics().inc("cache_hits_total", cache="manifest", stage=stage)
+        return json.loads(row[1]) if row[1] is not None else {}
+
+    def cached_results(self, media_files, stage: str, version: str, folder=None) -> dict:
+        """
+        Returns {MediaFile: result} of {stage} at {version} for the records whose size and mtime still match the
+        manifest, read in one query instead of one lookup per file; the others are left out. Only files under
+        {folder}, when given, are read.
+        """
+        sql = ("SELECT files.path, files.size, files.mtime_ns, files.content_hash, stage_results.result FROM files "
+               "JOIN stage_results ON stage_results.content_hash = files.content_hash "
+               "WHERE stage_results.stage = ? AND stage_results.version = ?")
+        params = [stage, version]
+        if folder is not None:
+            prefix = os.path.abspath(str(folder)).rstrip(os.sep) + os.sep
+            sql += " AND substr(files.path, 1, ?) = ?"
+            params += [len(prefix), prefix]
+        with self._lock:
+            rows = {row[0]: row[1:] for row in self._conn.execute(sql, params)}
+        found = {}
+        for media_file in media_files:
+            row = rows.get(os.path.abspath(media_file.path))
+            if row is not None and row[0] == media_file.size and row[1] == media_file.mtime_ns:
+                media_file.content_hash = row[2]
+                found[media_file] = json.loads(row[3]) if row[3] is not None else {}
+        if found:
+            get_metrics().inc("cache_hits_total", len(found), cache="manifest", stage=stage)
+        return found
+
+    def is_processed(self, file_path, stage: str, version: str) -> bool:
+        return self.get_result(file_path, stage, version) is not None
+
+    def record(self, file_path, stage: str, version: str, result=None) -> None:
+        """
+        Stores the result of {stage} at {version} for the file.
+        """
+        content_hash = self.fingerprint(file_path)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO stage_results (content_hash, stage, version, result, processed_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (content_hash, stage, version, json.dumps(result if result is not None else {}), time.time()),
+            )
+            self.__mark_dirty()
+
+    def refresh(self, file_path) -> None:
+        """
+        Updates the size/mtime of a known file whose content did not change (e.g. after os.utime).
+        """
+        if hasattr(file_path, "content_hash"):
+            file_path.refresh_stat()
+        path, size, mtime_ns, _ = self.__identify(file_path)
+        with self._lock:
+            self._conn.execute(
+                "UPDATE files SET size = ?, mtime_ns = ? WHERE path = ?",
+                (size, mtime_ns, path),
+            )
+            self.__mark_dirty()
+
+    def relocate(self, old_path, new_path) -> None:
+        """
+        Moves the manifest entry of a file that was moved on disk, so it is not re-hashed at its new location.
+        """
+        old_path = os.path.abspath(old_path)
+        new_path = os.path.abspath(new_path)
+        with self._lock:
+            self._conn.execute("DELETE FROM files WHERE path = ?", (new_path,))
+            self._conn.execute("UPDATE files SET path = ? WHERE path = ?", (new_path, old_path))
+            self.__mark_dirty()
+
+    def commit(self) -> None:
+        with self._lock:
+            self._conn.commit()
+            self._pending_writes = 0
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.commit()
+                self._conn.close()
+                self._conn = None
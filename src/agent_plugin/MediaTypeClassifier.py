@@ -0,0 +1,83 @@
+import os
+import threading
+
+from agent_plugin.WorkerPool import map_unordered
+
+# Bytes sniffed from the start of each file; enough for libmagic to identify all common media containers
+HEADER_SIZE = 4096
+
+HEIF_BRANDS = (b"heic", b"heix", b"hevc", b"hevx", b"heim", b"heis", b"mif1", b"msf1")
+QUICKTIME_ATOMS = (b"moov", b"mdat", b"wide", b"free", b"skip", b"pnot")
+
+_local = threading.local()
+
+
+def _is_jpeg(header):
+    return header[:3] == b"\xff\xd8\xff"
+
+
+def _is_png(header):
+    return header[:8] == b"\x89PNG\r\n\x1a\n"
+
+
+def _is_heif(header):
+    return header[4:8] == b"ftyp" and header[8:12] in HEIF_BRANDS
+
+
+def _is_mp4(header):
+    return header[4:8] == b"ftyp" and header[8:12] not in HEIF_BRANDS and header[8:12] != b"qt  "
+
+
+def _is_quicktime(header):
+    return (header[4:8] == b"ftyp" and header[8:12] == b"qt  ") or header[4:8] in QUICKTIME_ATOMS
+
+
+# Extensions trusted without libmagic once their signature bytes match: extension -> (signature check, MIME type)
+SIGNATURES = {
+    ".jpg": (_is_jpeg, "image/jpeg"),
+    ".jpeg": (_is_jpeg, "image/jpeg"),
+    ".png": (_is_png, "image/png"),
+    ".heic": (_is_heif, "image/heic"),
+    ".heif": (_is_heif, "image/heif"),
+    ".mp4": (_is_mp4, "video/mp4"),
+    ".mov": (_is_quicktime, "video/quicktime"),
+}
+
+
+def _magic_handle():
+    """Returns this thread's libmagic handle, created once per worker thread."""
+    handle = getattr(_local, "magic", None)
+    if handle is None:
+        import magic  # loaded on first use only
+        handle = _local.magic = magic.Magic(mime=True)
+    return handle
+
+
+def is_media_mime(mime_type) -> bool:
+    return mime_type.startswith(('image/', 'audio/', 'video/'))
+
+
+def classify(file_path) -> str:
+    """
+    Returns the MIME type of a file from a single fixed-size header read.
+
+    Common camera formats (JPEG/PNG/HEIC/MP4/MOV) whose signature bytes match their extension are classified
+    without libmagic; everything else is sniffed from the same header buffer with a reused magic handle.
+    """
+    with open(file_path, "rb") as file:
+        header = file.read(HEADER_SIZE)
+    signature = SIGNATURES.get(os.path.splitext(file_path)[1].lower())
+    if signature is not None and signature[0](header):
+        return signature[1]
+    if not header:
+        return "application/x-empty"
+    return _magic_handle().from_buffer(header)
+
+
+def classify_all(file_paths, max_workers=None, classifier=classify):
+    """
+    Classifies many files on a thread pool, yielding (file_path, mime_type, error) as each file completes.
+
+    {classifier} maps a file path to its MIME type; callers may wrap classify with a cache lookup.
+    """
+    yield from map_unordered(classifier, file_paths, max_workers)
@@ -1,120 +1,194 @@
-from semantic_kernel.functions.kernel_function_decorator import kernel_function
-from PIL import Image
-from PIL.ExifTags import TAGS
 from datetime import datetime
-import shutil
 import time
 import os
 
 from pathlib import Path
 import os
 
+from agent_plugin.AlbumIndex import get_album_index
+from agent_plugin.AlbumOrganizer import AlbumOrganizer
+from agent_plugin import VideoProbe
+from agent_plugin.ExifDateReader import read_original_date
+from agent_plugin.KernelFunction import kernel_function
+from agent_plugin.MediaCatalog import get_catalog
+from agent_plugin.MediaManifest import get_manifest
+from agent_plugin.Metrics import get_metrics, instrumented_stage
+from agent_plugin.StageResults import OrganizeResult
+from agent_plugin.WorkerPool import map_unordered
+
 # class for MetadataAnalyst functions
 class MetadataAnalystPlugin:
     """A plugin that reads a media file and parses the metadata."""
-    def __get_exif_data(self,image_path):
-        image = Image.open(image_path)
-        exif_data = image._getexif()
-        if exif_data:
-            exif = {TAGS.get(tag): value for tag, value in exif_data.items()}
-            return exif
-        return None
-
-    def __get_original_date(self,exif_data):
-        if 'DateTimeOriginal' in exif_data:
-            return exif_data['DateTimeOriginal']
-        return None
+    STAGE = "original_date"
+    STAGE_VERSION = "1"
+    VIDEO_STAGE = "video_date"
+    VIDEO_STAGE_VERSION = "1"
+    # date_file() results that keep a file out of the album
+    UNPROCESSED = ("no_date", "video")
 
     def __update_file_timestamp(self,file_path, date_str):
         date_time_obj = datetime.strptime(date_str, '%Y:%m:%d %H:%M:%S')
         timestamp = time.mktime(date_time_obj.timetuple())
         os.utime(file_path, (timestamp, timestamp))
 
-    def __process_folder(self,folder_path):
+    def __read_original_date(self,media_file, manifest=None):
+        """
+        Returns (has_exif, original_date) for the image, reusing the manifest result when the file was already dated.
+        """
+        if manifest is not None:
+            cached = manifest.get_result(media_file, self.STAGE, self.STAGE_VERSION)
+            if cached is not None:
+                return cached["has_exif"], cached["original_date"]
+        has_exif, original_date = read_original_date(media_file.path)
+        if manifest is not None:
+            manifest.record(media_file, self.STAGE, self.STAGE_VERSION,
+                            {"has_exif": has_exif, "original_date": original_date})
+        return has_exif, original_date
+
+    def __read_video_date(self,media_file, manifest=None):
+        """
+        Returns (has_metadata, original_date) for the video, probing it with ffprobe only when it was not dated before.
+        """
+        if manifest is not None:
+            cached = manifest.get_result(media_file, self.VIDEO_STAGE, self.VIDEO_STAGE_VERSION)
+            if cached is not None:
+                return cached["has_metadata"], cached["original_date"]
+        has_metadata, original_date = VideoProbe.read_video_date(media_file.path)
+        if manifest is not None:
+            manifest.record(media_file, self.VIDEO_STAGE, self.VIDEO_STAGE_VERSION,
+                            {"has_metadata": has_metadata, "original_date": original_date})
+        return has_metadata, original_date
+
+    def date_file(self,media_file, manifest=None) -> str:
+        """
+        Reads the original date of one file and stamps it as the file's modification time, which the
+        organizer files photos by.
+
+        Videos are dated from their container metadata with ffprobe; those without a creation date are filed
+        by their current mtime.
+
+        Returns:
+            str: 'dated', 'no_exif' (filed by its current mtime), 'no_date' or 'video' (both left unprocessed),
+            or 'other' for files that are neither images nor videos.
+        """
+        with get_metrics().file_timer("metadata"):
+            return self.__date_file(media_file, manifest)
+
+    def __date_file(self,media_file, manifest=None):
+        if media_file.is_video:
+            if not VideoProbe.is_available():
+                print(f"Skipping video file: {media_file.name} (ffprobe not found, see FFMPEG_FOLDER)")
+                return "video"
+            has_metadata, original_date = self.__read_video_date(media_file, manifest)
+            media_file.capture_date = original_date
+            if not original_date:
+                print(f"No creation date found for video {media_file.name}")
+                return "no_exif"
+        elif media_file.is_image:
+            has_exif, original_date = self.__read_original_date(media_file, manifest)
+            media_file.capture_date = original_date
+            if not has_exif:
+                print(f"No EXIF data found for {media_file.name}")
+                return "no_exif"
+            if not original_date:
+                print(f"No DateTimeOriginal found for {media_file.name}")
+                return "no_date"
+        else:
+            return "other"
+        self.__update_file_timestamp(media_file.path, original_date)
+        # Keep the record's mtime current: the organizer files photos by it
+        if manifest is not None:
+            manifest.refresh(media_file)
+        else:
+            media_file.refresh_stat()
+        # print(f"Updated timestamps for {media_file.name} to {original_date}")
+        return "dated"
+
+    def __process_folder(self,folder_path, manifest=None, catalog=None):
         exceptions = 0
         unprocessed_files = []
-        for filename in os.listdir(folder_path):
-            if filename.lower().endswith(('.mov', '.mp4')):
-                print(f"Skipping video file: {filename}")
-                unprocessed_files.append(filename)
+        # The run's shared catalog already knows every file and its kind
+        catalog = catalog if catalog is not None else get_catalog(Path(folder_path).parent)
+        media_files = catalog.files(folder_path, recursive=False)
+
+        # Header-only date extraction fans out over a thread pool; results stream back as files complete.
+        # Videos share the pool, with at most VIDEO_PROBE_WORKERS ffprobe processes running at once
+        max_workers = int(os.getenv("METADATA_WORKERS", "0")) or None
+        dated = map_unordered(lambda media_file: self.date_file(media_file, manifest), media_files, max_workers)
+        for media_file, status, error in dated:
+            if error is not None:
+                print(f"ERROR: Unable to read metadata of {media_file.name}: {str(error)}")
+                exceptions += 1
                 continue
-            if filename.lower().endswith(('.jpg', '.jpeg', '.png', '.tiff', '.bmp', '.gif')):
-                file_path = os.path.join(folder_path, filename)
-                exif_data = self.__get_exif_data(file_path)
-                if exif_data:
-                    original_date = self.__get_original_date(exif_data)
-                    if original_date:
-                        self.__update_file_timestamp(file_path, original_date)
-                        # print(f"Updated timestamps for {filename} to {original_date}")
-                    else:
-                        print(f"No DateTimeOriginal found for {filename}")
-                        unprocessed_files.append(filename)
-                        exceptions += 1
-                else:
-                    print(f"No EXIF data found for {filename}")
-                    exceptions += 1
+            if status in self.UNPROCESSED:
+                unprocessed_files.append(media_file.name)
+            if status in ("no_exif", "no_date"):
+                exceptions += 1
         if exceptions > 0:
             print(f"Process completed with {exceptions} files with exceptions.")
         return unprocessed_files
 
-    def __organize_photos(self,source_path,target_path, unprocessed_files):
-        total_files = 0
+    def __organize_photos(self,source_path,target_path, unprocessed_files, journal_path, manifest=None, catalog=None,
+                          index=None):
+        def on_moved(old_path, new_path):
+            if manifest is not None:
+                manifest.relocate(old_path, new_path)
+            if catalog is not None:
+                catalog.relocate(old_path, new_path)
+            if index is not None:
+                # The new path is indexed once its analysis is recorded
+                index.remove_file(old_path)
 
-        # Convert source_path to Path object if it's a string
-        if isinstance(source_path, str):
-            source_path = Path(source_path)
-        
-        # Get all files recursively, excluding directories
-        files = [f for f in source_path.rglob('*') if f.is_file()]
-        
-        for file in files:
-            if file.name in unprocessed_files:
-                print(f"Skipping unprocessed file: {file.name}")
-                continue
+        organizer = AlbumOrganizer(journal_path, max_workers=int(os.getenv("ORGANIZE_WORKERS", "0")) or None)
+
+        # Finish a previously interrupted run before planning new moves
+        organizer.finish_pending(on_moved)
 
-            # Get last modified time
-            last_modified = datetime.fromtimestamp(file.stat().st_mtime)
-            year = str(last_modified.year)
-            month = last_modified.strftime("%B")  # Full month name
-            
-            # Print file info
-            print(f"File: {file.name}")
-            print(f"Year: {year}")
-            print(f"Month: {month}")
-            
-            # Create target directory path
-            target_dir = target_path / year / month
-            
-            # Create directory if it doesn't exist
-            target_dir.mkdir(parents=True, exist_ok=True)
-            
-            # Move file to new location; only move if destination doesn't exist
-            if not os.path.exists(target_dir / file.name):
-                shutil.move(str(file), str(target_dir / file.name))
-            
-            total_files += 1
+        # Phase 1: plan every move from the catalog's single scan of the source tree
+        files = catalog.files(source_path) if catalog is not None else None
+        moves, skipped = organizer.plan(source_path, target_path, unprocessed_files, files=files)
+        for file_path, reason in skipped:
+            print(f"Skipping {os.path.basename(file_path)}: {reason}")
+
+        # Phase 2: apply the plan concurrently, journaling each completed move
+        total_files, failed = organizer.apply(moves, on_moved)
+        for file_path, error in failed:
+            print(f"ERROR: Unable to move {file_path}: {error}")
         return total_files
 
+    @instrumented_stage("metadata")
+    def organize_folder(self, source_dir) -> OrganizeResult:
+        """
+        Dates the files of {source_dir} and organizes them by year and month into the 'album' folder next to it.
+        """
+        # Target directory for organized photos - create it if it does not exist
+        sample_dir = Path(source_dir).parent
+        if not sample_dir:
+            raise FileNotFoundError("Parent directory does not exist.")
+        target_dir  = Path(sample_dir, "album")           
+        if not os.path.exists(target_dir):
+            os.makedirs(target_dir, exist_ok=True)
+        
+        manifest = get_manifest(sample_dir)
+        catalog = get_catalog(sample_dir)
+        defective_files = self.__process_folder(source_dir, manifest, catalog)
+        print("Photo attributes completed successfully!")
+        
+        journal_path = Path(sample_dir, "organize_journal.jsonl")
+        files_processed = self.__organize_photos(source_dir, target_dir, defective_files, journal_path, manifest, catalog,
+                                                 get_album_index(sample_dir))
+        manifest.commit()
+        print(f"Photo organization completed successfully: {files_processed} files processed.")
+        return OrganizeResult(str(source_dir), str(target_dir), files_processed, tuple(defective_files))
+
     @kernel_function(description="Access and analyze the given directory by extracting files metadata and organizing photos based on their original date.")
     def analyze_media(self, source_dir:str) -> str:
         try:
             # Source directory with photos
             # source_dir = Path(os.getenv("MEDIA_SOURCE_PATH"))
 
-            # Target directory for organized photos - create it if it does not exist
-            sample_dir = Path(source_dir).parent
-            if not sample_dir:
-                raise FileNotFoundError("Parent directory does not exist.")
-            target_dir  = Path(sample_dir, "album")           
-            if not os.path.exists(target_dir):
-                os.makedirs(target_dir, exist_ok=True)
-            
-            defective_files = self.__process_folder(source_dir)
-            print("Photo attributes completed successfully!")
-            
-            files_processed = self.__organize_photos(source_dir, target_dir, defective_files)
-            print(f"Photo organization completed successfully: {files_processed} files processed.")
-            result = f"Run objects identification and create a log file with the results applicable to the files stored in {{album_dir}} = '{target_dir}' "
+            organized = self.organize_folder(source_dir)
+            result = f"Run objects identification and create a log file with the results applicable to the files stored in {{album_dir}} = '{organized.album_dir}' "
             return result
         except FileNotFoundError as e:  
             print(f"ERROR: The specified directory does not exist: {e}")
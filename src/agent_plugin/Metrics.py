@@ -0,0 +1,349 @@
+import asyncio
+import atexit
+import bisect
+import functools
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from agent_plugin.StatePaths import state_dir
+
+# Upper bounds, in seconds, of the latency histogram buckets: from a header read to a throttled vision call
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+METRIC_PREFIX = "photo_manager_"
+
+# Metric names and their help text; every metric is a counter unless listed in HISTOGRAMS
+METRICS_HELP = {
+    "file_seconds": "Time spent on one file by a stage, in seconds (batched stages: the file's share of its batch)",
+    "files_total": "Files processed by a stage",
+    "bytes_read_total": "Bytes of media read by a stage",
+    "stage_seconds": "Wall time of one stage run over a folder, in seconds",
+    "api_requests_total": "Azure OpenAI requests, by outcome",
+    "api_tokens_total": "Azure OpenAI tokens, by kind (prompt or completion)",
+    "api_retries_total": "Azure OpenAI requests retried after throttling or transient errors",
+    "cache_hits_total": "Lookups answered from a cache (manifest: stage results; response: Azure OpenAI answers)",
+    "cache_misses_total": "Lookups that missed a cache",
+    "routes_total": "Images routed by the cascade router, by route (skip, low or high detail)",
+    "agent_messages_total": "Messages produced by an agent of the orchestration",
+    "agent_hop_seconds": "Time from the previous agent message to this agent's message, in seconds",
+}
+HISTOGRAMS = {"file_seconds", "stage_seconds", "agent_hop_seconds"}
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_metrics() -> "MetricsRegistry":
+    """
+    Returns the process-wide metrics registry.
+
+    Metrics are always counted in memory. METRICS_EXPORTER selects where they go: 'prometheus' writes a textfile
+    for the node_exporter textfile collector at METRICS_TEXTFILE_PATH (default: metrics.prom in the state folder,
+    see StatePaths.state_dir), 'otel' forwards them to OpenTelemetry (an OTLP exporter when OTEL_EXPORTER_OTLP_ENDPOINT is set,
+    otherwise the console exporter).
+    """
+    global _registry
+    if _registry is not None:
+        return _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = MetricsRegistry(os.getenv("METRICS_EXPORTER", "none").lower(),
+                                        os.getenv("METRICS_TEXTFILE_PATH") or str(Path(state_dir(), "metrics.prom")))
+        return _registry
+
+
+def _export_at_exit():
+    if _registry is not None:
+        _registry.export()
+        _registry.close()
+
+
+atexit.register(_export_at_exit)
+
+
+def _escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _label_key(labels: dict):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+# class for the pipeline metrics
+class MetricsRegistry:
+    """
+    Thread-safe counters and fixed-bucket histograms, labelled like Prometheus metrics.
+
+    Observations only update a few numbers under a lock, so instrumenting every file costs microseconds.
+    The histograms keep bucket counts, sum and count; percentiles are estimated from the buckets.
+    """
+
+    def __init__(self, exporter: str = "none", textfile_path: str = "metrics.prom"):
+        self.exporter = exporter
+        self.textfile_path = textfile_path
+        self._lock = threading.Lock()
+        self._counters = {}    # (name, labels) -> value
+        self._histograms = {}  # (name, labels) -> [bucket counts..., +Inf count, sum]
+        self._otel = None
+        self._otel_instruments = {}
+        if exporter == "otel":
+            self.__start_otel()
+
+    def __start_otel(self):
+        # OpenTelemetry is optional: it is only imported when selected
+        from opentelemetry.sdk.metrics import MeterProvider
+        from opentelemetry.sdk.metrics.export import ConsoleMetricExporter, PeriodicExportingMetricReader
+
+        if os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT"):
+            from opentelemetry.exporter.otlp.proto.http.metric_exporter import OTLPMetricExporter
+            exporter = OTLPMetricExporter()
+        else:
+            exporter = ConsoleMetricExporter()
+        reader = PeriodicExportingMetricReader(exporter,
+                                               export_interval_millis=int(os.getenv("METRICS_EXPORT_INTERVAL_MS", "60000")))
+        self._otel = MeterProvider(metric_readers=[reader])
+
+    def __otel_instrument(self, name):
+        instrument = self._otel_instruments.get(name)
+        if instrument is None:
+            meter = self._otel.get_meter("photo_manager")
+            if name in HISTOGRAMS:
+                instrument = meter.create_histogram(METRIC_PREFIX + name, unit="s", description=METRICS_HELP[name])
+            else:
+                instrument = meter.create_counter(METRIC_PREFIX + name, description=METRICS_HELP[name])
+            self._otel_instruments[name] = instrument
+        return instrument
+
+    def inc(self, name: str, amount: float = 1, **labels) -> None:
+        """Adds {amount} to the counter {name} with the given labels."""
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+            if self._otel is not None:
+                self.__otel_instrument(name).add(amount, labels)
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        """Records one {value} in the histogram {name} with the given labels."""
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [0] * (len(LATENCY_BUCKETS) + 1) + [0.0]
+            histogram[bisect.bisect_left(LATENCY_BUCKETS, value)] += 1
+            histogram[-1] += value
+            if self._otel is not None:
+                self.__otel_instrument(name).record(value, labels)
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        """Observes the time spent in the with-block in the histogram {name}, also when the block raises."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    @contextmanager
+    def file_timer(self, stage: str, size: int = 0):
+        """Records the with-block as one file processed by {stage}, with the {size} bytes it read."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_file(stage, time.perf_counter() - started, size)
+
+    def record_file(self, stage: str, seconds: float, size: int = 0, files: int = 1) -> None:
+        """Counts {files} files processed by {stage} in {seconds} overall, and the {size} bytes read for them."""
+        for _ in range(files):
+            self.observe("file_seconds", seconds / files, stage=stage)
+        self.inc("files_total", files, stage=stage)
+        if size:
+            self.inc("bytes_read_total", size, stage=stage)
+
+    def counter(self, name: str, **labels) -> float:
+        with self._lock:
+            return self._counters.get((name, _label_key(labels)), 0)
+
+    def quantile(self, name: str, fraction: float, **labels):
+        """Estimates the {fraction} quantile of a histogram from its buckets (the bucket's upper bound), or None."""
+        with self._lock:
+            histogram = self._histograms.get((name, _label_key(labels)))
+            if histogram is None:
+                return None
+            counts = histogram[:-1]
+        rank = fraction * sum(counts)
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS + (float("inf"),), counts):
+            seen += count
+            if seen >= rank and count:
+                return bound
+        return None
+
+    def stage_summary(self) -> dict:
+        """Returns {stage: {files, seconds, files_per_second, p50, p99, bytes_read}} from the per-file metrics."""
+        with self._lock:
+            stages = sorted({dict(labels)["stage"] for name, labels in self._counters if name == "files_total"})
+            run_seconds = {dict(labels)["stage"]: histogram[-1] for (name, labels), histogram in self._histograms.items()
+                           if name == "stage_seconds"}
+        summary = {}
+        for stage in stages:
+            files = self.counter("files_total", stage=stage)
+            # In streaming mode the stages overlap and share the wall time of the run
+            seconds = run_seconds.get(stage, run_seconds.get("stream"))
+            summary[stage] = {
+                "files": files,
+                "seconds": round(seconds, 3) if seconds is not None else None,
+                "files_per_second": round(files / seconds, 2) if seconds else None,
+                "p50": self.quantile("file_seconds", 0.5, stage=stage),
+                "p99": self.quantile("file_seconds", 0.99, stage=stage),
+                "bytes_read": self.counter("bytes_read_total", stage=stage),
+            }
+        return summary
+
+    def print_summary(self) -> None:
+        """Prints the files, throughput and per-file latency of each stage, and the Azure OpenAI and cache counts."""
+        for stage, row in self.stage_summary().items():
+            line = f"{stage}: {row['files']:g} files"
+            if row["files_per_second"] is not None:
+                line += f" in {row['seconds']} s ({row['files_per_second']} files/s)"
+            if row["p50"] is not None:
+                line += f", per file p50 <= {row['p50'] * 1000:g} ms, p99 <= {row['p99'] * 1000:g} ms"
+            if row["bytes_read"]:
+                line += f", {row['bytes_read'] / 2 ** 20:.1f} MB read"
+            print(f"Stage metrics: {line}")
+        tokens = self.counter("api_tokens_total", kind="prompt") + self.counter("api_tokens_total", kind="completion")
+        if tokens or self.counter("api_retries_total"):
+            print(f"Azure OpenAI: {self.counter('api_requests_total', outcome='ok'):g} requests, {tokens:g} tokens, "
+                  f"{self.counter('api_retries_total'):g} retries")
+        # Manifest lookups are labelled by stage as well; they are summed per cache here
+        lookups = {}
+        with self._lock:
+            for (name, labels), value in self._counters.items():
+                if name in ("cache_hits_total", "cache_misses_total"):
+                    counts = lookups.setdefault(dict(labels)["cache"], {"cache_hits_total": 0, "cache_misses_total": 0})
+                    counts[name] += value
+        for cache, counts in sorted(lookups.items()):
+            print(f"Cache {cache}: {counts['cache_hits_total']:g} hits, {counts['cache_misses_total']:g} misses")
+
+    def prometheus_text(self) -> str:
+        """Returns every metric in the Prometheus text exposition format."""
+        def label_text(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ""
+            return "{" + ",".join(f'{name}="{_escape_label(value)}"' for name, value in pairs) + "}"
+
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, list(value)) for key, value in self._histograms.items())
+        lines = []
+        declared = set()
+        for (name, labels), value in counters:
+            if name not in declared:
+                declared.add(name)
+                lines += [f"# HELP {METRIC_PREFIX}{name} {METRICS_HELP.get(name, name)}",
+                          f"# TYPE {METRIC_PREFIX}{name} counter"]
+            lines.append(f"{METRIC_PREFIX}{name}{label_text(labels)} {value}")
+        for (name, labels), histogram in histograms:
+            if name not in declared:
+                declared.add(name)
+                lines += [f"# HELP {METRIC_PREFIX}{name} {METRICS_HELP.get(name, name)}",
+                          f"# TYPE {METRIC_PREFIX}{name} histogram"]
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS + (float("inf"),), histogram[:-1]):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{METRIC_PREFIX}{name}_bucket{label_text(labels, [('le', le)])} {cumulative}")
+            lines.append(f"{METRIC_PREFIX}{name}_sum{label_text(labels)} {histogram[-1]}")
+            lines.append(f"{METRIC_PREFIX}{name}_count{label_text(labels)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+    def export(self) -> None:
+        """Writes the textfile (prometheus) or flushes the OpenTelemetry exporter (otel)."""
+        if self.exporter == "prometheus":
+            path = Path(self.textfile_path)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # Written aside and renamed, so the collector never reads a partial file
+            temp_path = path.with_name(path.name + f".{os.getpid()}.tmp")
+            temp_path.write_text(self.prometheus_text())
+            os.replace(temp_path, path)
+        elif self._otel is not None:
+            self._otel.force_flush()
+
+    def close(self) -> None:
+        if self._otel is not None:
+            self._otel.shutdown()
+            self._otel = None
+
+
+@contextmanager
+def profile_stage(stage: str, output_dir):
+    """
+    Profiles the with-block when PIPELINE_PROFILE=1: a cProfile of the calling thread (for async stages, the event
+    loop) is dumped to {output_dir}/{stage}-{time}.prof and a tracemalloc snapshot of all threads to
+    {stage}-{time}.tracemalloc, and the top allocations are printed. Does nothing otherwise.
+    """
+    if os.getenv("PIPELINE_PROFILE", "0") != "1":
+        yield
+        return
+    import cProfile
+    import tracemalloc
+
+    output_dir = Path(os.getenv("PIPELINE_PROFILE_DIR") or output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    name = f"{stage}-{time.strftime('%Y%m%d-%H%M%S')}"
+    started_tracing = not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start(int(os.getenv("PIPELINE_PROFILE_FRAMES", "10")))
+    tracemalloc.reset_peak()
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(str(output_dir / f"{name}.prof"))
+        # The profiler's own allocations would otherwise top the list
+        snapshot = tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, cProfile.__file__),
+                                                              tracemalloc.Filter(False, tracemalloc.__file__)])
+        snapshot.dump(str(output_dir / f"{name}.tracemalloc"))
+        current, peak = tracemalloc.get_traced_memory()
+        if started_tracing:
+            tracemalloc.stop()
+        print(f"Profile of stage {stage}: {output_dir / name}.prof, traced memory peak {peak / 2 ** 20:.1f} MB")
+        for statistic in snapshot.statistics("lineno")[:10]:
+            print(f"    {statistic}")
+
+
+@contextmanager
+def stage_run(stage: str, folder):
+    """
+    Times one stage run over {folder}, profiles it when enabled (into profiles in the state folder, which the reset
+    of the sample folder leaves alone) and exports the metrics when it ends.
+    """
+    metrics = get_metrics()
+    try:
+        with metrics.timer("stage_seconds", stage=stage), profile_stage(stage, Path(state_dir(), "profiles")):
+            yield
+    finally:
+        metrics.export()
+
+
+def instrumented_stage(stage: str):
+    """Decorates a folder-level stage method taking the folder as its first argument, sync or async, with stage_run()."""
+    def decorator(function):
+        if asyncio.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def async_wrapper(self, folder, *args, **kwargs):
+                with stage_run(stage, folder):
+                    return await function(self, folder, *args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(function)
+        def wrapper(self, folder, *args, **kwargs):
+            with stage_run(stage, folder):
+                return function(self, folder, *args, **kwargs)
+        return wrapper
+    return decorator
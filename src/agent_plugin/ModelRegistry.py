@@ -0,0 +1,87 @@
+import atexit
+import os
+import threading
+
+# Models loaded in this process, keyed by weights file, shared by every plugin instance
+_models = {}
+# Reentrant: a backend loads the model of its weights under the same lock
+_models_lock = threading.RLock()
+# Inference backends, keyed by weights, backend, input size, INT8, rendering and replicas
+_backends = {}
+
+
+def get_yolo_model(weights: str = "yolov8n.pt"):
+    """
+    Returns the YOLO model for the given weights, importing ultralytics and loading the model on first use only.
+    """
+    model = _models.get(weights)
+    if model is not None:
+        return model
+    with _models_lock:
+        if weights not in _models:
+            from ultralytics import YOLO
+            _models[weights] = YOLO(weights)
+        return _models[weights]
+
+
+def yolo_backend_settings() -> dict:
+    """Returns the inference backend selected by YOLO_BACKEND, YOLO_INT8 and YOLO_REPLICAS."""
+    return {"backend": os.getenv("YOLO_BACKEND", "torch").lower(),
+            "int8": os.getenv("YOLO_INT8", "0") == "1",
+            "replicas": max(1, int(os.getenv("YOLO_REPLICAS", "1")))}
+
+
+def get_yolo_backend(weights: str = "yolov8n.pt", imgsz: int = 640, render: bool = False):
+    """
+    Returns the inference backend for the given weights, as selected by yolo_backend_settings, created on first use.
+
+    'torch' runs the ultralytics model as is. 'onnx' (ONNX Runtime) and 'openvino' run a copy of it exported
+    once into YOLO_MODEL_DIR, in FP32 or, with YOLO_INT8=1, quantized to INT8. Every backend returns the same
+    detections for the same images (INT8 within quantization error). Each model replica gets YOLO_THREADS
+    intra-op threads; with YOLO_REPLICAS > 1, the batches are spread over that many worker processes.
+    """
+    from agent_plugin import YoloBackends
+
+    settings = yolo_backend_settings()
+    backend, int8, replicas = settings["backend"], settings["int8"], settings["replicas"]
+    key = (weights, backend, imgsz, int8, render, replicas)
+    runner = _backends.get(key)
+    if runner is not None:
+        return runner
+    with _models_lock:
+        if key in _backends:
+            return _backends[key]
+        if backend not in YoloBackends.BACKENDS:
+            raise ValueError(f"Unknown YOLO_BACKEND '{backend}', expected one of {', '.join(YoloBackends.BACKENDS)}")
+        threads = YoloBackends.default_threads(replicas)
+        if backend == "torch":
+            if int8:
+                raise ValueError("YOLO_INT8 needs the onnx or openvino YOLO_BACKEND")
+            model_path, names = weights, get_yolo_model(weights).names
+        else:
+            from agent_plugin.YoloExport import export_model
+            model_path, names = export_model(weights, backend, imgsz, int8)
+
+        if replicas > 1:
+            runner = YoloBackends.ReplicaPoolBackend(backend, model_path, names, imgsz, replicas, threads)
+        elif backend == "torch":
+            # The process-wide model is shared with the other users of get_yolo_model
+            if os.getenv("YOLO_THREADS"):
+                import torch
+                torch.set_num_threads(threads)
+            runner = YoloBackends.TorchYoloBackend(get_yolo_model(weights), imgsz, render)
+        else:
+            runner = YoloBackends.create_backend(backend, model_path, names, imgsz, threads)
+        print(f"YOLO backend: {backend}{' INT8' if int8 else ''}, {replicas} replica(s) x {threads} thread(s)")
+        _backends[key] = runner
+        return runner
+
+
+def _close_all_backends():
+    with _models_lock:
+        for runner in _backends.values():
+            runner.close()
+        _backends.clear()
+
+
+atexit.register(_close_all_backends)
@@ -0,0 +1,109 @@
+import threading
+from functools import lru_cache
+
+# pHash: DCT of a 32x32 grayscale thumbnail, keeping the 8x8 lowest frequencies as a 64-bit hash
+THUMBNAIL_SIZE = 32
+HASH_SIZE = 8
+
+
+@lru_cache(maxsize=None)
+def _dct_matrix(size: int):
+    """Returns the orthonormal DCT-II matrix, so that D @ X @ D.T is the 2-D DCT of X."""
+    import numpy as np
+
+    k = np.arange(size)[:, None]
+    n = np.arange(size)[None, :]
+    matrix = np.cos(np.pi * (2 * n + 1) * k / (2 * size)) * np.sqrt(2.0 / size)
+    matrix[0, :] = np.sqrt(1.0 / size)
+    return matrix.astype(np.float32)
+
+
+def load_thumbnail(image_path):
+    """
+    Returns the {THUMBNAIL_SIZE}x{THUMBNAIL_SIZE} grayscale float32 thumbnail of an image.
+
+    JPEGs are decoded in draft mode at a reduced scale, so only a fraction of the pixels is decoded.
+    """
+    import numpy as np
+    from PIL import Image, ImageOps
+
+    with Image.open(image_path) as image:
+        image.draft("L", (THUMBNAIL_SIZE * 4, THUMBNAIL_SIZE * 4))
+        image = ImageOps.exif_transpose(image).convert("L")
+        image = image.resize((THUMBNAIL_SIZE, THUMBNAIL_SIZE), Image.BOX)
+        return np.asarray(image, dtype=np.float32)
+
+
+def phash_batch(thumbnails) -> list:
+    """
+    Computes the 64-bit perceptual hashes of many thumbnails at once.
+
+    The 2-D DCTs of the whole batch are two matrix products over a (N, 32, 32) stack; each hash bit tells whether
+    a low-frequency coefficient is above the median of the 64 kept coefficients.
+    """
+    if len(thumbnails) == 0:
+        return []
+    import numpy as np
+
+    dct_matrix = _dct_matrix(THUMBNAIL_SIZE)
+    stack = np.stack(thumbnails).astype(np.float32)
+    coefficients = dct_matrix @ stack @ dct_matrix.T
+    low = coefficients[:, :HASH_SIZE, :HASH_SIZE].reshape(len(stack), -1)
+    bits = low > np.median(low, axis=1, keepdims=True)
+    packed = np.packbits(bits, axis=1)
+    return [int.from_bytes(row.tobytes(), "big") for row in packed]
+
+
+def phash(image_path) -> int:
+    return phash_batch([load_thumbnail(image_path)])[0]
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+# class for near-duplicate hash lookups
+class BKTree:
+    """
+    A Burkhard-Keller tree over 64-bit hashes with the Hamming distance.
+
+    Finding every hash within a small distance of a query visits only a few branches instead of every hash.
+    Safe to share between threads.
+    """
+
+    def __init__(self):
+        self._root = None  # [hash, item, {distance: child node}]
+        self._lock = threading.Lock()
+        self.size = 0
+
+    def add(self, hash_value: int, item) -> None:
+        with self._lock:
+            self.size += 1
+            if self._root is None:
+                self._root = [hash_value, item, {}]
+                return
+            node = self._root
+            while True:
+                distance = hamming(hash_value, node[0])
+                child = node[2].get(distance)
+                if child is None:
+                    node[2][distance] = [hash_value, item, {}]
+                    return
+                node = child
+
+    def search(self, hash_value: int, max_distance: int) -> list:
+        """Returns (distance, item) pairs of every hash within {max_distance} of {hash_value}, closest first."""
+        found = []
+        with self._lock:
+            stack = [self._root] if self._root is not None else []
+            while stack:
+                node = stack.pop()
+                distance = hamming(hash_value, node[0])
+                if distance <= max_distance:
+                    found.append((distance, node[1]))
+                # Triangle inequality: only children at distance d - max..d + max can hold matches
+                for child_distance, child in node[2].items():
+                    if distance - max_distance <= child_distance <= distance + max_distance:
+                        stack.append(child)
+        found.sort(key=lambda match: match[0])
+        return found
@@ -0,0 +1,122 @@
+import hashlib
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from agent_plugin.Metrics import get_metrics
+
+COMMIT_EVERY = 50
+
+
+def content_hash(text) -> str:
+    """Returns the SHA-256 hex digest of a str or bytes value."""
+    if isinstance(text, str):
+        text = text.encode("utf-8")
+    return hashlib.sha256(text).hexdigest()
+
+
+# class for the persistent Azure OpenAI response cache
+class ResponseCache:
+    """
+    A disk-backed, size-bounded LRU cache of model responses.
+
+    Entries are keyed by the hash of everything that determines a deterministic (temperature=0) response:
+    the request kind, the input payload hash, the prompt hash, the deployment name and the detail level.
+    Changing a prompt file or the deployment therefore misses only the affected entries. Once the stored
+    responses exceed {max_bytes}, the least recently used entries are evicted.
+    """
+
+    def __init__(self, db_path, max_bytes: int = 256 * 1024 * 1024):
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._pending_writes = 0
+        self._conn = sqlite3.connect(str(db_path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_access REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_access ON responses(last_access)")
+        self._conn.commit()
+        self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    @staticmethod
+    def make_key(*parts) -> str:
+        return content_hash("\x1f".join(str(part) for part in parts))
+
+    def __mark_dirty(self):
+        self._pending_writes += 1
+        if self._pending_writes >= COMMIT_EVERY:
+            self._conn.commit()
+            self._pending_writes = 0
+
+    def __evict(self):
+        while self._total_bytes > self.max_bytes:
+            rows = self._conn.execute(
+                "SELECT key, size FROM responses ORDER BY last_access LIMIT 100"
+            ).fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._total_bytes -= size
+                self.evictions += 1
+                if self._total_bytes <= self.max_bytes:
+                    break
+
+    def get(self, key: str):
+        """Returns the cached response for {key}, or None on a miss."""
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                get_metrics().inc("cache_misses_total", cache="response")
+                return None
+            self.hits += 1
+            get_metrics().inc("cache_hits_total", cache="response")
+            self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+            self.__mark_dirty()
+            return row[0]
+
+    def put(self, key: str, value: str) -> None:
+        """Stores a response, evicting least recently used entries when the cache grows over its size bound."""
+        size = len(value.encode("utf-8"))
+        with self._lock:
+            row = self._conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                self._total_bytes -= row[0]
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, value, size, time.time()),
+            )
+            self._total_bytes += size
+            self.__evict()
+            self.__mark_dirty()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "bytes": self._total_bytes,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.commit()
+                self._conn.close()
+                self._conn = None
@@ -0,0 +1,170 @@
+import atexit
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from agent_plugin.StatePaths import state_dir
+
+# Buffered records are written in one transaction once this many are pending, or after FLUSH_SECONDS
+FLUSH_EVERY = 200
+FLUSH_SECONDS = 2.0
+QUERY_PAGE_SIZE = 1000
+
+# Stores opened in this process, keyed by database path, so all stages append through one connection
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_results_store(sample_dir) -> "ResultsStore":
+    """
+    Returns the process-wide results store for the given sample directory.
+
+    The database lives at RESULTS_STORE_PATH when set, otherwise at results.db in the state folder (see
+    StatePaths.state_dir), which survives the reset of the sample folder.
+    """
+    db_path = os.getenv("RESULTS_STORE_PATH") or os.path.join(state_dir(), "results.db")
+    db_path = os.path.abspath(db_path)
+    with _stores_lock:
+        if db_path not in _stores:
+            _stores[db_path] = ResultsStore(db_path)
+        return _stores[db_path]
+
+
+def _close_all_stores():
+    with _stores_lock:
+        for store in _stores.values():
+            store.close()
+        _stores.clear()
+
+
+atexit.register(_close_all_stores)
+
+
+# class for the structured analysis results store
+class ResultsStore:
+    """
+    A local SQLite store of the analysis results, one record per file and stage.
+
+    Records are buffered in memory and written in batches, every {flush_every} records or {flush_seconds}
+    seconds, through a single connection, so a crash loses at most one batch. Each record keeps the stage's
+    structured result as JSON plus its human-readable log text; re-analyzing a file replaces its record.
+
+    Every written record gets a sequence number {seq} above those of all records written before it, so readers
+    such as the album index can follow the store with query(after=...) without missing a late flushed record.
+    """
+
+    def __init__(self, db_path: str, flush_every: int = FLUSH_EVERY, flush_seconds: float = FLUSH_SECONDS):
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self.db_path = db_path
+        self.flush_every = flush_every
+        self.flush_seconds = flush_seconds
+        self._lock = threading.RLock()
+        self._buffer = []
+        self._last_flush = time.monotonic()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS results (
+                path TEXT NOT NULL,
+                stage TEXT NOT NULL,
+                result TEXT NOT NULL,
+                log TEXT,
+                recorded_at REAL NOT NULL,
+                PRIMARY KEY (path, stage)
+            );
+            CREATE INDEX IF NOT EXISTS idx_results_stage_time ON results(stage, recorded_at);
+            CREATE INDEX IF NOT EXISTS idx_results_time ON results(recorded_at);
+            """
+        )
+        # Stores written before {seq} existed number their records in rowid order
+        if "seq" not in [column[1] for column in self._conn.execute("PRAGMA table_info(results)")]:
+            self._conn.execute("ALTER TABLE results ADD COLUMN seq INTEGER")
+            self._conn.execute("UPDATE results SET seq = rowid")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_results_seq ON results(seq)")
+        self._conn.commit()
+
+    def add(self, file_path, stage: str, result: dict, log: str = None) -> None:
+        """Buffers the result of {stage} for the file, with its optional human-readable {log} text."""
+        with self._lock:
+            self._buffer.append((os.path.abspath(str(file_path)), stage, json.dumps(result), log, time.time()))
+            if len(self._buffer) >= self.flush_every or time.monotonic() - self._last_flush >= self.flush_seconds:
+                self.flush()
+
+    def flush(self) -> None:
+        """Writes every buffered record in one transaction."""
+        with self._lock:
+            self._last_flush = time.monotonic()
+            if not self._buffer or self._conn is None:
+                return
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO results (path, stage, result, log, recorded_at, seq) "
+                    "VALUES (?, ?, ?, ?, ?, (SELECT COALESCE(MAX(seq), 0) + 1 FROM results))",
+                    self._buffer,
+                )
+            self._buffer = []
+
+    def get(self, file_path, stage: str):
+        """Returns the stored result of {stage} for the file, or None; buffered records are read without a flush."""
+        file_path = os.path.abspath(str(file_path))
+        with self._lock:
+            for path, buffered_stage, result, _, _ in reversed(self._buffer):
+                if path == file_path and buffered_stage == stage:
+                    return json.loads(result)
+            row = self._conn.execute(
+                "SELECT result FROM results WHERE path = ? AND stage = ?", (file_path, stage)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def query(self, stage: str = None, path_prefix: str = None, since: float = None, after: int = None):
+        """
+        Yields the stored records as dicts with 'path', 'stage', 'result', 'log', 'recorded_at' and 'seq', in the
+        order they were written.
+
+        Args:
+            stage (str): Only records of this stage.
+            path_prefix (str): Only files under this folder.
+            since (float): Only records recorded at or after this UNIX time.
+            after (int): Only records written after the record with this {seq}.
+        """
+        self.flush()
+        clauses, params = [], []
+        if stage is not None:
+            clauses.append("stage = ?")
+            params.append(stage)
+        if path_prefix is not None:
+            prefix = os.path.abspath(str(path_prefix)).rstrip(os.sep) + os.sep
+            clauses.append("substr(path, 1, ?) = ?")
+            params += [len(prefix), prefix]
+        if since is not None:
+            clauses.append("recorded_at >= ?")
+            params.append(since)
+        if after is not None:
+            clauses.append("seq > ?")
+            params.append(after)
+        sql = "SELECT path, stage, result, log, recorded_at, seq FROM results"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        with self._lock:
+            cursor = self._conn.execute(sql + " ORDER BY seq", params)
+        # Rows are read page by page, so very large stores are never loaded at once
+        while True:
+            with self._lock:
+                rows = cursor.fetchmany(QUERY_PAGE_SIZE)
+            if not rows:
+                break
+            for path, row_stage, result, log, recorded_at, seq in rows:
+                yield {"path": path, "stage": row_stage, "result": json.loads(result), "log": log,
+                       "recorded_at": recorded_at, "seq": seq}
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self.flush()
+                self._conn.close()
+                self._conn = None
@@ -0,0 +1,62 @@
+from dataclasses import dataclass, field
+
+
+# Typed outputs of the pipeline stages.
+# The direct runner hands them from one stage to the next; the kernel functions turn them into agent messages.
+
+@dataclass(frozen=True)
+class ValidationResult:
+    """Output of the media type validation of {source_dir}."""
+    source_dir: str
+    defective_dir: str
+    processed: int = 0
+    defective: int = 0
+
+
+@dataclass(frozen=True)
+class DuplicateResult:
+    """Output of the near-duplicate detection over the images of {source_dir}."""
+    source_dir: str
+    images: int = 0
+    duplicates: int = 0
+    groups: int = 0
+
+
+@dataclass(frozen=True)
+class OrganizeResult:
+    """Output of dating the files of {source_dir} and organizing them into {album_dir}."""
+    source_dir: str
+    album_dir: str
+    organized: int = 0
+    unprocessed: tuple = ()
+
+
+@dataclass(frozen=True)
+class DetectionResult:
+    """Output of the YOLO object detection over the images and videos of {album_dir}."""
+    album_dir: str
+    images: int = 0
+    with_objects: int = 0
+    videos: int = 0
+    videos_with_objects: int = 0
+
+
+@dataclass(frozen=True)
+class RoutingResult:
+    """Output of routing the images of {album_dir} to the vision model: skipped, at low or at high detail."""
+    album_dir: str
+    images: int = 0
+    skip: int = 0
+    low: int = 0
+    high: int = 0
+    reasons: dict = field(default_factory=dict)
+
+
+@dataclass(frozen=True)
+class VisionResult:
+    """Output of the Azure OpenAI content analysis over the images of {album_dir}."""
+    album_dir: str
+    images: int = 0
+    analyzed: int = 0
+    failed: int = 0
+    skipped: int = 0
@@ -0,0 +1,14 @@
+import os
+from pathlib import Path
+
+# Project root: the folder holding src/
+PROJECT_ROOT = Path(__file__).resolve().parents[2]
+
+
+def state_dir() -> Path:
+    """
+    Returns the folder of the state kept across runs: the manifest, the results store, the album index, the Azure
+    OpenAI caches and the batch jobs. It is MEDIA_STATE_DIR when set, otherwise .state in the project root, so
+    process_media.py can reset the sample folder before every run without losing what was already processed.
+    """
+    return Path(os.getenv("MEDIA_STATE_DIR") or PROJECT_ROOT / ".state")
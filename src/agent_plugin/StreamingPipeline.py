@@ -0,0 +1,422 @@
+import asyncio
+import os
+import time
+from pathlib import Path
+
+from agent_plugin import VideoProbe
+from agent_plugin.AlbumIndex import get_album_index
+from agent_plugin.AlbumOrganizer import AlbumOrganizer
+from agent_plugin.FolderWatcher import FolderWatcher
+from agent_plugin.MediaCatalog import get_catalog
+from agent_plugin.MediaManifest import get_manifest
+from agent_plugin.Metrics import get_metrics, stage_run
+from agent_plugin.ResultsStore import get_results_store
+from agent_plugin.WorkerPool import default_io_workers
+
+# Stages the streaming pipeline can run, in execution order
+STREAM_STAGES = ("validate", "dedupe", "metadata", "content", "route", "expert")
+
+# Fed between the bursts of watch mode: the pipeline drains and saves its results before taking more files
+_CHECKPOINT = object()
+
+
+# class for the streaming per-file pipeline
+class StreamingPipeline:
+    """
+    Runs the selected stages over one file at a time instead of one folder at a time.
+
+    Stages are connected by bounded asyncio queues of at most {queue_size} MediaFile records, so a file can be in
+    object detection while the next one is still being validated, and memory stays flat for any folder size.
+    Blocking work (header reads, EXIF parsing, moves) runs on worker threads; object detection gathers
+    micro-batches from its queue for the batched YOLO engine; the vision stage keeps several Azure OpenAI
+    requests in flight. Per-file results go to the manifest, the results store and the MediaFile records as each
+    file completes.
+
+    {plugins} maps each selected stage name to its agent plugin instance; the stages reuse the plugins' per-file
+    methods, so both execution modes produce the same results. With {record_latencies}, the time each file spent
+    in each stage (excluding queue waits) is kept in {latencies}, e.g. for benchmark.py.
+    """
+
+    def __init__(self, sample_dir, plugins: dict, queue_size: int = 64, detail_level: str = "low",
+                 record_latencies: bool = False):
+        self.sample_dir = Path(sample_dir)
+        self.stages = [stage for stage in STREAM_STAGES if stage in plugins]
+        self.plugins = plugins
+        self.queue_size = queue_size
+        self.detail_level = detail_level
+        self.manifest = get_manifest(self.sample_dir)
+        self.catalog = get_catalog(self.sample_dir)
+        self.store = get_results_store(self.sample_dir)
+        self.index = get_album_index(self.sample_dir)
+        self.album_dir = Path(self.sample_dir, "album")
+        self.stats = {stage: {"processed": 0, "passed": 0, "failed": 0} for stage in self.stages}
+        self.latencies = {stage: [] for stage in self.stages} if record_latencies else None
+        self.__content_engine = None
+
+    def __count(self, stage, passed=False, failed=False):
+        stats = self.stats[stage]
+        stats["processed"] += 1
+        stats["passed"] += 1 if passed else 0
+        stats["failed"] += 1 if failed else 0
+
+    def __record_latency(self, stage, started, files=1):
+        if self.latencies is not None:
+            self.latencies[stage] += [time.perf_counter() - started] * files
+
+    def __on_moved(self, old_path, new_path):
+        self.manifest.relocate(old_path, new_path)
+        self.catalog.relocate(old_path, new_path)
+        # The new path is indexed once its analysis is recorded
+        self.index.remove_file(old_path)
+
+    # ---- stage workers ------------------------------------------------------------------------------------------
+
+    async def __validate_worker(self, plugin, inbox, outbox):
+        defective_dir = Path(self.sample_dir, "defective")
+        while True:
+            media_file = await inbox.get()
+            started = time.perf_counter()
+            try:
+                valid = await asyncio.to_thread(plugin.validate_file, media_file, defective_dir,
+                                                self.manifest, self.catalog)
+                self.__count("validate", passed=valid)
+                self.__record_latency("validate", started)
+                if valid and outbox is not None:
+                    await outbox.put(media_file)
+            except Exception as e:
+                self.__count("validate", failed=True)
+                print(f"ERROR: Unable to validate {media_file.path}: {str(e)}")
+            finally:
+                inbox.task_done()
+
+    async def __dedupe_worker(self, plugin, tree, inbox, outbox):
+        while True:
+            media_file = await inbox.get()
+            started = time.perf_counter()
+            try:
+                if media_file.is_image:
+                    hash_value = await asyncio.to_thread(plugin.hash_file, media_file, self.manifest)
+                    # Matched on the event loop, so two near-duplicates in flight cannot both become representatives
+                    representative = plugin.match_hash(media_file, hash_value, tree, self.manifest)
+                    self.__count("dedupe", passed=representative is not None)
+                    self.__record_latency("dedupe", started)
+                if outbox is not None:
+                    await outbox.put(media_file)
+            except Exception as e:
+                self.__count("dedupe", failed=True)
+                print(f"ERROR: Unable to hash {media_file.path}: {str(e)}")
+                # An image that cannot be hashed is still organized and analyzed on its own
+                if outbox is not None:
+                    await outbox.put(media_file)
+            finally:
+                inbox.task_done()
+
+    def __date_and_organize(self, plugin, organizer, media_file):
+        status = plugin.date_file(media_file, self.manifest)
+        if status in plugin.UNPROCESSED:
+            return False
+        if organizer.organize_one(media_file.path, media_file.name, media_file.mtime, self.album_dir,
+                                  self.__on_moved) is None:
+            print(f"Skipping {media_file.name}: identical file already in the album")
+            return False
+        return True
+
+    async def __metadata_worker(self, plugin, organizer, inbox, outbox):
+        while True:
+            media_file = await inbox.get()
+            started = time.perf_counter()
+            try:
+                organized = await asyncio.to_thread(self.__date_and_organize, plugin, organizer, media_file)
+                self.__count("metadata", passed=organized)
+                self.__record_latency("metadata", started)
+                if organized and outbox is not None and media_file.kind != "other":
+                    await outbox.put(media_file)
+            except Exception as e:
+                self.__count("metadata", failed=True)
+                print(f"ERROR: Unable to organize {media_file.path}: {str(e)}")
+            finally:
+                inbox.task_done()
+
+    async def __content_batch(self, plugin, batch, outbox, videos_supported, counted):
+        """Detects the objects of {batch}; each file counted in the stats is added to {counted}."""
+        started = time.perf_counter()
+        pending = {}
+        videos = []
+        for media_file in batch:
+            if media_file.is_video:
+                videos.append(media_file)
+                continue
+            if not media_file.is_image:
+                counted.add(media_file.path)
+                continue
+            # A near-duplicate whose representative is still in flight is detected on its own
+            if await asyncio.to_thread(plugin.cached_objects, media_file, self.manifest, self.store) is not None or \
+                    await asyncio.to_thread(plugin.reuse_representative, media_file, self.manifest, self.store):
+                self.__count("content", passed=True)
+                counted.add(media_file.path)
+                if outbox is not None:
+                    await outbox.put(media_file)
+            else:
+                pending[media_file.path] = media_file
+        if pending:
+            if self.__content_engine is None:
+                # The model is loaded when the first image needs it, not when the pipeline starts
+                self.__content_engine = await asyncio.to_thread(plugin.create_engine)
+            engine = self.__content_engine
+            detected = await asyncio.to_thread(lambda: list(engine.detect(list(pending))))
+            # Every image of a micro-batch waits for the whole batch
+            self.__record_latency("content", started, len(pending))
+            for image_path, detections, error in detected:
+                if error is not None:
+                    self.__count("content", failed=True)
+                    counted.add(image_path)
+                    print(f"ERROR: Unable to decode {image_path}: {str(error)}")
+                    continue
+                media_file = pending[image_path]
+                obj_detected = plugin.record_objects(media_file, detections, self.manifest, self.store)
+                self.__count("content", passed=len(obj_detected) > 0)
+                counted.add(image_path)
+                if outbox is not None:
+                    await outbox.put(media_file)
+        # Each video streams its sampled frames through the same engine, one video at a time
+        for media_file in videos:
+            counted.add(media_file.path)
+            if not videos_supported:
+                print(f"Skipping video file: {media_file.path} (ffmpeg not found, see FFMPEG_FOLDER)")
+                self.__count("content")
+                continue
+            video_started = time.perf_counter()
+            try:
+                summary = await asyncio.to_thread(plugin.cached_video, media_file, self.manifest)
+                if summary is None:
+                    # The model is loaded by the first video not analyzed yet
+                    if self.__content_engine is None:
+                        self.__content_engine = await asyncio.to_thread(plugin.create_engine)
+                    summary = await asyncio.to_thread(plugin.detect_video, self.__content_engine, media_file,
+                                                      self.manifest, self.store)
+            except Exception as e:
+                self.__count("content", failed=True)
+                print(f"ERROR: Unable to analyze video {media_file.path}: {str(e)}")
+                continue
+            self.__count("content", passed=len(summary["objects"]) > 0)
+            self.__record_latency("content", video_started)
+
+    async def __content_worker(self, plugin, inbox, outbox):
+        self.__content_engine = None
+        videos_supported = VideoProbe.ffmpeg_tool("ffmpeg") is not None and VideoProbe.is_available()
+        while True:
+            # Wait for one image, then take whatever else is already queued, up to a full batch
+            batch = [await inbox.get()]
+            engine = self.__content_engine
+            batch_size = engine.batch_size if engine is not None else int(os.getenv("YOLO_BATCH_SIZE", "8"))
+            while len(batch) < batch_size and not inbox.empty():
+                batch.append(inbox.get_nowait())
+            counted = set()
+            try:
+                await self.__content_batch(plugin, batch, outbox, videos_supported, counted)
+            except Exception as e:
+                # Retry the files the batch did not get to one at a time, so only the ones that fail are counted
+                print(f"ERROR: Object detection failed for a batch of {len(batch)} files: {str(e)}")
+                for media_file in batch:
+                    if media_file.path in counted:
+                        continue
+                    try:
+                        await self.__content_batch(plugin, [media_file], outbox, videos_supported, counted)
+                    except Exception as e:
+                        if media_file.path not in counted:
+                            self.__count("content", failed=True)
+                        print(f"ERROR: Object detection failed for {media_file.path}: {str(e)}")
+            finally:
+                for _ in batch:
+                    inbox.task_done()
+
+    async def __route_worker(self, plugin, policy, inbox, outbox):
+        while True:
+            media_file = await inbox.get()
+            started = time.perf_counter()
+            try:
+                if media_file.is_image:
+                    decision = await asyncio.to_thread(plugin.route_file, media_file, policy, self.store)
+                    self.__count("route", passed=decision["route"] != "skip")
+                    self.__record_latency("route", started)
+                if outbox is not None:
+                    await outbox.put(media_file)
+            except Exception as e:
+                self.__count("route", failed=True)
+                print(f"ERROR: Unable to route {media_file.path}: {str(e)}")
+                # An image that cannot be routed is analyzed at the default detail level
+                if outbox is not None:
+                    await outbox.put(media_file)
+            finally:
+                inbox.task_done()
+
+    async def __expert_worker(self, plugin, engine, inbox):
+        while True:
+            media_file = await inbox.get()
+            started = time.perf_counter()
+            try:
+                detail_level = None
+                if media_file.is_image:
+                    # Without a route stage in this pipeline, the decision of an earlier run is read from the store
+                    detail_level = await asyncio.to_thread(plugin.detail_level_of, media_file, self.detail_level,
+                                                           self.store)
+                if detail_level is None or plugin.cached_analysis(media_file, detail_level,
+                                                                  self.manifest) is not None:
+                    # Routed past the vision model, or not an image
+                    self.__count("expert", passed=media_file.is_image and detail_level is not None)
+                    continue
+                if await asyncio.to_thread(plugin.reuse_representative, media_file, detail_level,
+                                           self.manifest, self.store):
+                    self.__count("expert", passed=True)
+                    continue
+                result = await engine.analyze(media_file.path, detail_level)
+                if result["error"] is not None:
+                    self.__count("expert", failed=True)
+                    print(f"ERROR: Analysis failed for {media_file.path}: {str(result['error'])}")
+                    continue
+                self.__count("expert", passed=True)
+                self.__record_latency("expert", started)
+                plugin.record_analysis(media_file, result, result["detail_level"], self.manifest, self.store)
+            except Exception as e:
+                self.__count("expert", failed=True)
+                print(f"ERROR: Analysis failed for {media_file.path}: {str(e)}")
+            finally:
+                inbox.task_done()
+
+    # ---- pipeline -----------------------------------------------------------------------------------------------
+
+    async def run(self, source_dir) -> dict:
+        """
+        Streams every file directly in {source_dir} through the selected stages.
+
+        Returns:
+            dict: per-stage counts of processed, passed and failed files.
+        """
+        # The per-file metrics come from the plugins; the run is timed and profiled as one 'stream' stage
+        with stage_run("stream", source_dir):
+            return await self.__run(self.__listing(source_dir))
+
+    async def watch(self, source_dir, stop_event: asyncio.Event, debounce: float = 1.0, polling: bool = False,
+                    checkpoint_seconds: float = 30.0) -> dict:
+        """
+        Streams the files already waiting in {source_dir}, then every file arriving there, until {stop_event} is set.
+
+        New files are picked up once fully written (see FolderWatcher) and go through the stages on their own, so
+        each upload costs its own processing only. Whenever no arrival is pending, and at least every
+        {checkpoint_seconds} during a long upload, the pipeline drains and saves the manifest, the results store,
+        the album index and the metrics.
+
+        Returns:
+            dict: per-stage counts of processed, passed and failed files since the watch started.
+        """
+        watcher = FolderWatcher(source_dir, debounce, polling).start()
+        try:
+            return await self.__run(self.__arrivals(source_dir, watcher, stop_event, checkpoint_seconds))
+        finally:
+            watcher.stop()
+
+    async def __listing(self, source_dir):
+        for media_file in self.catalog.files(source_dir, recursive=False):
+            yield media_file
+
+    async def __arrivals(self, source_dir, watcher, stop_event, checkpoint_seconds):
+        # The watcher is already running, so a file copied during the listing is not missed, nor fed twice
+        existing = self.catalog.files(source_dir, recursive=False)
+        watcher.mark_reported(existing)
+        for media_file in existing:
+            yield media_file
+        fed = len(existing)
+        last_checkpoint = time.monotonic()
+        async for paths in watcher.arrivals(stop_event):
+            for path in paths:
+                try:
+                    media_file = self.catalog.add(path)
+                except FileNotFoundError:
+                    continue
+                yield media_file
+                fed += 1
+            if fed and (watcher.idle or time.monotonic() - last_checkpoint >= checkpoint_seconds):
+                yield _CHECKPOINT
+                fed = 0
+                last_checkpoint = time.monotonic()
+
+    def __save(self):
+        self.store.flush()
+        self.manifest.commit()
+        self.index.update(self.store)
+
+    async def __checkpoint(self, queues):
+        # Once a queue is joined, everything it feeds is already enqueued downstream
+        for queue in queues:
+            await queue.join()
+        await asyncio.to_thread(self.__save)
+        get_metrics().export()
+        counts = ", ".join(f"{stage} {stats['processed']}" for stage, stats in self.stats.items())
+        print(f"Up to date, files processed so far: {counts}")
+
+    async def __run(self, media_files):
+        queues = [asyncio.Queue(maxsize=self.queue_size) for _ in self.stages]
+        outboxes = queues[1:] + [None]
+        workers = []
+        organizer = None
+        vision_engine = None
+        vision_plugin = None
+        for stage, inbox, outbox in zip(self.stages, queues, outboxes):
+            plugin = self.plugins[stage]
+            if stage == "validate":
+                count = int(os.getenv("MEDIA_TYPE_WORKERS", "0")) or default_io_workers()
+                coroutines = [self.__validate_worker(plugin, inbox, outbox) for _ in range(count)]
+            elif stage == "dedupe":
+                # New images are matched against the album and against the images streamed before them
+                tree = await asyncio.to_thread(plugin.album_tree, self.album_dir, self.manifest, self.catalog)
+                count = int(os.getenv("MEDIA_TYPE_WORKERS", "0")) or default_io_workers()
+                coroutines = [self.__dedupe_worker(plugin, tree, inbox, outbox) for _ in range(count)]
+            elif stage == "metadata":
+                organizer = AlbumOrganizer(Path(self.sample_dir, "organize_journal.jsonl"))
+                # Raises, naming the organize_journal.py commands, while moves of an interrupted run still fail
+                organizer.finish_pending(self.__on_moved)
+                organizer.begin()
+                count = int(os.getenv("METADATA_WORKERS", "0")) or default_io_workers()
+                coroutines = [self.__metadata_worker(plugin, organizer, inbox, outbox) for _ in range(count)]
+            elif stage == "content":
+                # One consumer: the GPU/CPU model is the bottleneck and batches best from a single queue
+                coroutines = [self.__content_worker(plugin, inbox, outbox)]
+            elif stage == "route":
+                from agent_plugin.VisionRouter import load_policy
+
+                # Routing is a results store lookup and a few comparisons: one worker keeps up
+                coroutines = [self.__route_worker(plugin, load_policy(), inbox, outbox)]
+            else:
+                vision_plugin = plugin
+                vision_engine = plugin.create_engine(self.sample_dir, self.manifest, self.detail_level)
+                coroutines = [self.__expert_worker(plugin, vision_engine, inbox)
+                              for _ in range(vision_engine.max_concurrency)]
+            workers.append([asyncio.create_task(coroutine) for coroutine in coroutines])
+
+        committed = False
+        try:
+            # Feed the first stage; put() blocks whenever the pipeline is full
+            async for media_file in media_files:
+                if media_file is _CHECKPOINT:
+                    await self.__checkpoint(queues)
+                else:
+                    await queues[0].put(media_file)
+            # Drain the stages in order: once a queue is joined, everything it feeds is already enqueued downstream
+            for queue, stage_workers in zip(queues, workers):
+                await queue.join()
+                for task in stage_workers:
+                    task.cancel()
+            # The organizer keeps the journal pending only if a move worth retrying failed
+            committed = True
+        finally:
+            for stage_workers in workers:
+                for task in stage_workers:
+                    task.cancel()
+            await asyncio.gather(*[task for stage_workers in workers for task in stage_workers],
+                                 return_exceptions=True)
+            if organizer is not None:
+                organizer.end(committed)
+            if vision_engine is not None:
+                await vision_plugin.close_engine(vision_engine)
+            self.__save()
+        return self.stats
@@ -0,0 +1,154 @@
+import json
+import os
+import queue
+import subprocess
+import threading
+
+import numpy as np
+
+from agent_plugin.VideoProbe import PROBE_TIMEOUT, ffmpeg_tool
+
+SAMPLE_MODES = ("keyframes", "interval", "scene")
+
+
+def sampling_settings() -> dict:
+    """Returns the frame sampling settings from the environment (VIDEO_SAMPLE_* variables)."""
+    mode = os.getenv("VIDEO_SAMPLE_MODE", "keyframes")
+    if mode not in SAMPLE_MODES:
+        raise ValueError(f"Unknown VIDEO_SAMPLE_MODE '{mode}'. Valid modes: {', '.join(SAMPLE_MODES)}")
+    return {
+        "mode": mode,
+        "interval": float(os.getenv("VIDEO_SAMPLE_INTERVAL", "1.0")),
+        "scene_threshold": float(os.getenv("VIDEO_SCENE_THRESHOLD", "0.3")),
+        "max_frames": int(os.getenv("VIDEO_MAX_FRAMES", "300")),
+    }
+
+
+def _frame_size(video_path, max_side: int):
+    """Returns the (width, height) of the sampled frames: the displayed video size scaled to fit {max_side}."""
+    ffprobe = ffmpeg_tool("ffprobe")
+    if ffprobe is None:
+        raise FileNotFoundError("ffprobe was not found in FFMPEG_FOLDER or on the PATH")
+    command = [ffprobe, "-v", "error", "-select_streams", "v:0",
+               "-show_entries", "stream=width,height:stream_tags=rotate:stream_side_data=rotation",
+               "-of", "json", str(video_path)]
+    completed = subprocess.run(command, capture_output=True, timeout=PROBE_TIMEOUT, check=False)
+    if completed.returncode != 0:
+        raise RuntimeError(completed.stderr.decode("utf-8", "replace").strip() or f"ffprobe exited with {completed.returncode}")
+    streams = json.loads(completed.stdout or b"{}").get("streams", [])
+    if not streams:
+        raise ValueError("No video stream found")
+    stream = streams[0]
+    width, height = int(stream["width"]), int(stream["height"])
+    rotation = stream.get("tags", {}).get("rotate")
+    for side_data in stream.get("side_data_list", []):
+        rotation = side_data.get("rotation", rotation)
+    # ffmpeg auto-rotates while decoding, so portrait videos come out with width and height swapped
+    if rotation is not None and abs(int(float(rotation))) % 180 == 90:
+        width, height = height, width
+    scale = min(1.0, max_side / max(width, height))
+    # Even sizes keep every pixel format converter happy
+    return max(2, int(width * scale) // 2 * 2), max(2, int(height * scale) // 2 * 2)
+
+
+def _read_timestamps(stderr, timestamps):
+    """Collects the pts_time of every frame reported by the showinfo filter, in output order."""
+    for line in stderr:
+        line = line.decode("utf-8", "replace")
+        if "pts_time:" in line:
+            value = line.split("pts_time:", 1)[1].split()[0]
+            try:
+                timestamps.put(float(value))
+            except ValueError:
+                timestamps.put(None)
+    timestamps.put(None)
+
+
+def iter_frames(video_path, max_side: int = 640, mode: str = "keyframes", interval: float = 1.0,
+                scene_threshold: float = 0.3, max_frames: int = 300):
+    """
+    Yields (timestamp in seconds, BGR frame array) for the sampled frames of a video.
+
+    ffmpeg decodes the video and pipes raw BGR frames, already scaled to fit {max_side}, straight into numpy; no
+    image file is written. Sampling modes:
+        keyframes: decode keyframes only (fastest), at most one frame every {interval} seconds.
+        interval: decode every frame, keep one every {interval} seconds.
+        scene: keep the first frame and every frame whose scene change score exceeds {scene_threshold}.
+    At most {max_frames} frames are produced, and only one frame is held in memory at a time.
+    """
+    ffmpeg = ffmpeg_tool("ffmpeg")
+    if ffmpeg is None:
+        raise FileNotFoundError("ffmpeg was not found in FFMPEG_FOLDER or on the PATH")
+    width, height = _frame_size(video_path, max_side)
+    frame_bytes = width * height * 3
+
+    if mode == "scene":
+        select = f"select='eq(n\\,0)+gt(scene\\,{scene_threshold})'"
+    else:
+        select = f"select='isnan(prev_selected_t)+gte(t-prev_selected_t\\,{interval})'"
+    command = [ffmpeg, "-hide_banner", "-nostdin", "-loglevel", "info"]
+    if mode == "keyframes":
+        command += ["-skip_frame", "nokey"]
+    command += ["-i", str(video_path), "-an", "-sn", "-dn",
+                "-vf", f"{select},scale={width}:{height},showinfo",
+                "-fps_mode", "passthrough", "-frames:v", str(max_frames),
+                "-f", "rawvideo", "-pix_fmt", "bgr24", "pipe:1"]
+
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, bufsize=frame_bytes)
+    timestamps = queue.Queue()
+    stderr_reader = threading.Thread(target=_read_timestamps, args=(process.stderr, timestamps), daemon=True)
+    stderr_reader.start()
+    try:
+        index = 0
+        while True:
+            data = process.stdout.read(frame_bytes)
+            if len(data) < frame_bytes:
+                break
+            try:
+                timestamp = timestamps.get(timeout=PROBE_TIMEOUT)
+            except queue.Empty:
+                timestamp = None
+            frame = np.frombuffer(data, dtype=np.uint8).reshape(height, width, 3)
+            yield (timestamp if timestamp is not None else float(index) * interval), frame
+            index += 1
+    finally:
+        # Stop decoding as soon as the consumer is done, e.g. after an error downstream
+        if process.poll() is None:
+            process.kill()
+        process.stdout.close()
+        process.wait()
+        stderr_reader.join(timeout=1)
+    if process.returncode not in (0, None) and index == 0:
+        raise RuntimeError(f"ffmpeg could not decode {video_path} (exit code {process.returncode})")
+
+
+def aggregate_detections(frame_detections) -> dict:
+    """
+    Summarizes per-frame detections of one video.
+
+    Args:
+        frame_detections: iterable of (timestamp, detections) pairs, as produced by the YOLO engine.
+
+    Returns:
+        dict: 'objects' (class names in order of first appearance), 'frames' (sampled frame count),
+        'detections' (per class: first/last timestamp, frames seen, best confidence) and 'timeline'
+        (timestamp and class names of every frame with detections).
+    """
+    summary = {}
+    timeline = []
+    frames = 0
+    for timestamp, detections in frame_detections:
+        frames += 1
+        names = []
+        for detection in detections:
+            name = detection["name"]
+            if name not in names:
+                names.append(name)
+            entry = summary.setdefault(name, {"first": timestamp, "last": timestamp, "frames": 0, "max_confidence": 0.0})
+            entry["last"] = timestamp
+            entry["max_confidence"] = max(entry["max_confidence"], detection["confidence"])
+        for name in names:
+            summary[name]["frames"] += 1
+        if names:
+            timeline.append({"time": round(timestamp, 3), "objects": names})
+    return {"objects": list(summary), "frames": frames, "detections": summary, "timeline": timeline}
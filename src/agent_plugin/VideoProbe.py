@@ -0,0 +1,107 @@
+import json
+import os
+import shutil
+import subprocess
+import threading
+from datetime import datetime
+
+# Container tags holding the capture time, most reliable first.
+# Apple devices write the local wall-clock time with its UTC offset; creation_time is UTC.
+LOCAL_DATE_TAGS = ("com.apple.quicktime.creationdate",)
+UTC_DATE_TAGS = ("creation_time",)
+
+# Default dates written by cameras and muxers that do not know the capture time
+EPOCH_YEARS = (1904, 1970)
+
+# ffprobe only parses the container header: limit the bytes and time it may spend probing the streams
+PROBE_SIZE = 1024 * 1024
+PROBE_TIMEOUT = 30
+
+_probe_slots = None
+_probe_slots_lock = threading.Lock()
+
+
+def ffmpeg_tool(name: str):
+    """
+    Returns the path of an FFmpeg tool ('ffmpeg', 'ffprobe'), looked up in FFMPEG_FOLDER (or its bin folder) first
+    and then on the PATH, or None when it is not installed.
+    """
+    executable = f"{name}.exe" if os.name == "nt" else name
+    folder = os.getenv("FFMPEG_FOLDER")
+    if folder:
+        for candidate in (os.path.join(folder, "bin", executable), os.path.join(folder, executable)):
+            if os.path.isfile(candidate):
+                return candidate
+    return shutil.which(name)
+
+
+def _slots():
+    """Bounds the number of concurrent ffprobe processes, whatever the number of calling threads."""
+    global _probe_slots
+    with _probe_slots_lock:
+        if _probe_slots is None:
+            workers = int(os.getenv("VIDEO_PROBE_WORKERS", "0")) or (os.cpu_count() or 1)
+            _probe_slots = threading.BoundedSemaphore(workers)
+        return _probe_slots
+
+
+def _parse_date(value: str, local: bool):
+    """Returns a 'YYYY:MM:DD HH:MM:SS' local time string from an ISO 8601 container date, or None."""
+    value = value.strip().replace("Z", "+00:00")
+    if len(value) > 5 and value[-5] in "+-" and value[-4:].isdigit():
+        value = f"{value[:-2]}:{value[-2:]}"  # +0200 -> +02:00
+    try:
+        date = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    if date.year in EPOCH_YEARS:
+        return None
+    if local:
+        # Keep the wall-clock time of the capture, like EXIF DateTimeOriginal
+        date = date.replace(tzinfo=None)
+    elif date.tzinfo is not None:
+        date = date.astimezone().replace(tzinfo=None)
+    return date.strftime("%Y:%m:%d %H:%M:%S")
+
+
+def capture_date_from_tags(probe: dict):
+    """
+    Returns (has_metadata, original_date) from ffprobe's JSON output of the format and stream tags.
+    """
+    tag_sets = [probe.get("format", {}).get("tags", {})]
+    tag_sets += [stream.get("tags", {}) for stream in probe.get("streams", [])]
+    tag_sets = [{name.lower(): value for name, value in tags.items()} for tags in tag_sets]
+    has_metadata = any(tags for tags in tag_sets)
+    for names, local in ((LOCAL_DATE_TAGS, True), (UTC_DATE_TAGS, False)):
+        for tags in tag_sets:
+            for name in names:
+                if name in tags:
+                    original_date = _parse_date(tags[name], local)
+                    if original_date:
+                        return True, original_date
+    return has_metadata, None
+
+
+def is_available() -> bool:
+    """Returns True when ffprobe can be found."""
+    return ffmpeg_tool("ffprobe") is not None
+
+
+def read_video_date(file_path):
+    """
+    Reads the capture date of a video from its container metadata with ffprobe, without decoding any frame.
+
+    Returns:
+        tuple: (has_metadata, original_date) where original_date is a 'YYYY:MM:DD HH:MM:SS' string or None.
+    """
+    ffprobe = ffmpeg_tool("ffprobe")
+    if ffprobe is None:
+        raise FileNotFoundError("ffprobe was not found in FFMPEG_FOLDER or on the PATH")
+    command = [ffprobe, "-v", "error", "-probesize", str(PROBE_SIZE), "-analyzeduration", "0",
+               "-show_entries", "format_tags:stream_tags", "-of", "json", str(file_path)]
+    with _slots():
+        completed = subprocess.run(command, capture_output=True, timeout=PROBE_TIMEOUT, check=False)
+    if completed.returncode != 0:
+        raise RuntimeError(completed.stderr.decode("utf-8", "replace").strip() or f"ffprobe exited with {completed.returncode}")
+    return capture_date_from_tags(json.loads(completed.stdout or b"{}"))
+
@@ -0,0 +1,446 @@
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from agent_plugin.Metrics import get_metrics
+from agent_plugin.StatePaths import state_dir
+
+# Batch statuses after which a job changes no more
+TERMINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+# Limits of one Azure OpenAI batch input file
+MAX_FILE_REQUESTS = 100000
+MAX_FILE_BYTES = 200 * 1024 * 1024
+# Batches created more than this long before a submission was recorded cannot be its batch
+SUBMISSION_CLOCK_SKEW = 600
+
+
+def batch_work_dir() -> Path:
+    """Returns the folder of the batch input files and of jobs.db, in the state folder (see StatePaths.state_dir)."""
+    return Path(state_dir(), "vision_batches")
+
+
+# class for the resumable batch job tracking
+class BatchJobTracker:
+    """
+    Tracks the requests and jobs of the vision bulk mode in SQLite at {db_path}, so a bulk run that was stopped, or
+    that submitted its jobs without waiting, resumes where it left off: a submitted request is never sent twice and
+    a finished job is collected once.
+
+    Each image goes through the 'detect' phase (image description, or the structured analysis in single-pass mode)
+    and, when needed, the 'summary' phase (fields extracted from the description). A request is 'queued', then
+    'submitted' in a job, then 'done' or 'failed' once its job finished, and 'merged' once the caller saved its
+    result.
+
+    A job is recorded as 'submitting', under the id of its uploaded input file, before the batch is created, and
+    takes the batch id once it is; a job left 'submitting' by a crash is matched to its batch on the next run
+    (see recover_submissions), so a billed batch is never lost.
+    """
+
+    def __init__(self, db_path):
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(db_path), check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS requests (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                path TEXT NOT NULL,
+                phase TEXT NOT NULL,
+                detail_level TEXT NOT NULL,
+                status TEXT NOT NULL,
+                job_id TEXT,
+                input TEXT,
+                response TEXT,
+                error TEXT,
+                started_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_requests_path ON requests(path);
+            CREATE INDEX IF NOT EXISTS idx_requests_status ON requests(status);
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                phase TEXT NOT NULL,
+                input_file TEXT NOT NULL,
+                input_file_id TEXT NOT NULL,
+                status TEXT NOT NULL,
+                requests INTEGER NOT NULL,
+                output_file_id TEXT,
+                error_file_id TEXT,
+                collected INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            """
+        )
+        self._conn.commit()
+
+    def latest(self, path):
+        """Returns the latest request of the image at {path}, or None."""
+        with self._lock:
+            return self._conn.execute("SELECT * FROM requests WHERE path = ? ORDER BY id DESC LIMIT 1",
+                                      (path,)).fetchone()
+
+    def add_request(self, path, phase: str, detail_level: str, input: str = None, started_at: float = None) -> int:
+        now = time.time()
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "INSERT INTO requests (path, phase, detail_level, status, input, started_at, updated_at) "
+                "VALUES (?, ?, ?, 'queued', ?, ?, ?)",
+                (path, phase, detail_level, input, started_at or now, now))
+            return cursor.lastrowid
+
+    def requests(self, status: str, phase: str = None) -> list:
+        sql, params = "SELECT * FROM requests WHERE status = ?", [status]
+        if phase is not None:
+            sql += " AND phase = ?"
+            params.append(phase)
+        with self._lock:
+            return self._conn.execute(sql + " ORDER BY id", params).fetchall()
+
+    def add_job(self, phase, input_file, input_file_id, request_ids) -> None:
+        """Records the job of an uploaded input file as 'submitting', before its batch is created."""
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO jobs (id, phase, input_file, input_file_id, status, requests, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, 'submitting', ?, ?, ?)",
+                (input_file_id, phase, str(input_file), input_file_id, len(request_ids), now, now))
+            self._conn.executemany("UPDATE requests SET status = 'submitted', job_id = ?, updated_at = ? WHERE id = ?",
+                                   [(input_file_id, now, request_id) for request_id in request_ids])
+
+    def start_job(self, input_file_id, job_id, status) -> None:
+        """Gives the 'submitting' job of {input_file_id} and its requests the id of the created batch."""
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE jobs SET id = ?, status = ?, updated_at = ? WHERE id = ? AND status = 'submitting'",
+                               (job_id, status, now, input_file_id))
+            self._conn.execute("UPDATE requests SET job_id = ?, updated_at = ? WHERE job_id = ?",
+                               (job_id, now, input_file_id))
+
+    def drop_job(self, input_file_id) -> None:
+        """Forgets a 'submitting' job whose batch was never created; its requests are queued again."""
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM jobs WHERE id = ? AND status = 'submitting'", (input_file_id,))
+            self._conn.execute("UPDATE requests SET status = 'queued', job_id = NULL, updated_at = ? "
+                               "WHERE job_id = ? AND status = 'submitted'", (now, input_file_id))
+
+    def submitting_jobs(self) -> list:
+        """Returns the jobs whose batch may or may not have been created."""
+        with self._lock:
+            return self._conn.execute("SELECT * FROM jobs WHERE status = 'submitting' ORDER BY created_at").fetchall()
+
+    def open_jobs(self) -> list:
+        """Returns the created jobs not collected yet."""
+        with self._lock:
+            return self._conn.execute("SELECT * FROM jobs WHERE collected = 0 AND status != 'submitting' "
+                                      "ORDER BY created_at").fetchall()
+
+    def jobs(self) -> list:
+        with self._lock:
+            return self._conn.execute("SELECT * FROM jobs ORDER BY created_at").fetchall()
+
+    def update_job(self, job_id, status, output_file_id=None, error_file_id=None) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE jobs SET status = ?, output_file_id = ?, error_file_id = ?, updated_at = ? "
+                               "WHERE id = ?", (status, output_file_id, error_file_id, time.time(), job_id))
+
+    def collect_job(self, job_id, responses: dict, errors: dict) -> None:
+        """
+        Stores the {responses} and {errors} of a finished job, both keyed by request id, in one transaction; its
+        requests with neither failed with the job's status.
+        """
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany("UPDATE requests SET status = 'done', response = ?, updated_at = ? WHERE id = ?",
+                                   [(response, now, request_id) for request_id, response in responses.items()])
+            self._conn.executemany("UPDATE requests SET status = 'failed', error = ?, updated_at = ? WHERE id = ?",
+                                   [(error, now, request_id) for request_id, error in errors.items()])
+            status = self._conn.execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()[0]
+            self._conn.execute("UPDATE requests SET status = 'failed', error = ?, updated_at = ? "
+                               "WHERE job_id = ? AND status = 'submitted'", (f"batch job {status}", now, job_id))
+            self._conn.execute("UPDATE jobs SET collected = 1, updated_at = ? WHERE id = ?", (now, job_id))
+
+    def set_status(self, request_id, status: str, error: str = None) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE requests SET status = ?, error = COALESCE(?, error), updated_at = ? WHERE id = ?",
+                               (status, error, time.time(), request_id))
+
+    def follow_up(self, request_id, phase: str, input: str) -> int:
+        """Queues the next {phase} of a finished request and marks the request merged, in one transaction."""
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT path, detail_level, started_at FROM requests WHERE id = ?",
+                                     (request_id,)).fetchone()
+            cursor = self._conn.execute(
+                "INSERT INTO requests (path, phase, detail_level, status, input, started_at, updated_at) "
+                "VALUES (?, ?, ?, 'queued', ?, ?, ?)",
+                (row["path"], phase, row["detail_level"], input, row["started_at"], now))
+            self._conn.execute("UPDATE requests SET status = 'merged', updated_at = ? WHERE id = ?", (now, request_id))
+            return cursor.lastrowid
+
+    def mark_merged(self, request_ids) -> None:
+        """Marks finished requests merged, once the caller saved their results."""
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany("UPDATE requests SET status = 'merged', updated_at = ? WHERE id = ? "
+                                   "AND status IN ('done', 'failed')", [(now, request_id) for request_id in request_ids])
+
+    def counts(self) -> dict:
+        """Returns the number of requests by (phase, status)."""
+        with self._lock:
+            rows = self._conn.execute("SELECT phase, status, COUNT(*) FROM requests GROUP BY phase, status").fetchall()
+        return {(phase, status): count for phase, status, count in rows}
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+async def recover_submissions(client, tracker) -> None:
+    """
+    Settles the jobs a crash left 'submitting': a job whose batch was created takes its id, the others are dropped
+    and their requests queued again. Batches are listed newest first, down to the oldest submission.
+    """
+    submitting = {job["input_file_id"]: job for job in tracker.submitting_jobs()}
+    if not submitting:
+        return
+    oldest = min(job["created_at"] for job in submitting.values()) - SUBMISSION_CLOCK_SKEW
+    async for batch in client.batches.list(limit=100):
+        if batch.input_file_id in submitting:
+            tracker.start_job(batch.input_file_id, batch.id, batch.status)
+            print(f"Recovered batch job {batch.id} of input file {batch.input_file_id}")
+            del submitting[batch.input_file_id]
+        if not submitting or batch.created_at < oldest:
+            break
+    for input_file_id, job in submitting.items():
+        tracker.drop_job(input_file_id)
+        Path(job["input_file"]).unlink(missing_ok=True)
+
+
+async def cancel_jobs(client, tracker) -> int:
+    """Cancels every job of the {tracker} still running; returns their number. Their requests fail when collected."""
+    await recover_submissions(client, tracker)
+    cancelled = 0
+    for job in tracker.open_jobs():
+        if job["status"] not in TERMINAL_STATUSES:
+            batch = await client.batches.cancel(job["id"])
+            tracker.update_job(job["id"], batch.status, batch.output_file_id, batch.error_file_id)
+            cancelled += 1
+    return cancelled
+
+
+# class for the Azure OpenAI Batch API bulk mode
+class VisionBatchJobs:
+    """
+    Analyzes images through the Azure OpenAI Batch API instead of one synchronous call per image.
+
+    The requests of the vision {engine} (same prompts, detail levels and image derivatives) are written to JSONL
+    files under {work_dir}, uploaded and submitted as batch jobs to {deployment} (a Global Batch deployment), and
+    polled every {poll_seconds}. Each input file holds at most {max_file_requests} requests and {max_file_bytes}
+    bytes. Results are handed back as jobs complete; the caller calls mark_merged() once it saved them. All state
+    is kept by a BatchJobTracker in {work_dir}/jobs.db.
+    """
+
+    def __init__(self, client, deployment, engine, work_dir, poll_seconds: float = 60.0,
+                 max_file_requests: int = MAX_FILE_REQUESTS, max_file_bytes: int = MAX_FILE_BYTES):
+        self.client = client
+        self.deployment = deployment
+        self.engine = engine
+        self.work_dir = Path(work_dir)
+        self.poll_seconds = poll_seconds
+        self.max_file_requests = max_file_requests
+        self.max_file_bytes = max_file_bytes
+        self.tracker = BatchJobTracker(Path(work_dir, "jobs.db"))
+        # Requests handed to the caller in this run and not merged yet
+        self._handed_over = set()
+
+    def __request_body(self, row) -> dict:
+        from agent_plugin.AsyncVisionEngine import encode_image_to_base64
+
+        if row["phase"] == "summary":
+            request = self.engine.summary_request(row["input"])
+        else:
+            if self.engine.preprocessor is not None:
+                image, mime_type = self.engine.preprocessor.encode(row["path"], row["detail_level"])
+            else:
+                image, mime_type = encode_image_to_base64(row["path"])
+            prompt = self.engine.prompt_structured or self.engine.prompt_img
+            request = self.engine.detect_request(image, mime_type, prompt, row["detail_level"])
+        return dict(model=self.deployment, **request)
+
+    def __write_files(self, phase, rows) -> list:
+        """Writes the queued {rows} of a phase to JSONL input files; returns (file path, request ids) pairs."""
+        files = []
+        output, request_ids, size = None, [], 0
+        for row in rows:
+            try:
+                line = json.dumps({"custom_id": f"{phase}-{row['id']}", "method": "POST", "url": "/chat/completions",
+                                   "body": self.__request_body(row)}, ensure_ascii=False).encode("utf-8") + b"\n"
+            except Exception as e:
+                print(f"ERROR: Unable to prepare the batch request of {row['path']}: {str(e)}")
+                self.tracker.set_status(row["id"], "failed", str(e))
+                continue
+            if output is not None and (len(request_ids) >= self.max_file_requests or size + len(line) > self.max_file_bytes):
+                output.close()
+                files.append((output.name, request_ids))
+                output, request_ids, size = None, [], 0
+            if output is None:
+                self.work_dir.mkdir(parents=True, exist_ok=True)
+                output = open(self.work_dir / f"{phase}-{int(time.time() * 1000)}-{len(files)}.jsonl", "wb")
+            output.write(line)
+            request_ids.append(row["id"])
+            size += len(line)
+        if output is not None:
+            output.close()
+            files.append((output.name, request_ids))
+        return files
+
+    async def __submit(self) -> int:
+        """Uploads and submits the queued requests of every phase; returns the number of jobs created."""
+        created = 0
+        for phase in ("detect", "summary"):
+            rows = self.tracker.requests("queued", phase)
+            if not rows:
+                continue
+            for input_file, request_ids in await asyncio.to_thread(self.__write_files, phase, rows):
+                with open(input_file, "rb") as file:
+                    uploaded = await self.client.files.create(file=file, purpose="batch")
+                # Recorded first, so a crash before the batch id is stored cannot lose a billed batch
+                self.tracker.add_job(phase, input_file, uploaded.id, request_ids)
+                batch = await self.client.batches.create(input_file_id=uploaded.id, endpoint="/chat/completions",
+                                                         completion_window="24h")
+                self.tracker.start_job(uploaded.id, batch.id, batch.status)
+                print(f"Submitted batch job {batch.id}: {len(request_ids)} {phase} requests from {input_file}")
+                created += 1
+        return created
+
+    async def __read_file(self, file_id) -> list:
+        content = await self.client.files.content(file_id)
+        return [json.loads(line) for line in content.text.splitlines() if line.strip()]
+
+    async def __collect(self, job, batch) -> None:
+        metrics = get_metrics()
+        responses, errors = {}, {}
+        lines = []
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if file_id:
+                lines += await self.__read_file(file_id)
+        for line in lines:
+            request_id = int(line["custom_id"].rsplit("-", 1)[1])
+            response = line.get("response") or {}
+            body = response.get("body") or {}
+            if response.get("status_code") == 200 and body.get("choices"):
+                responses[request_id] = body["choices"][0]["message"]["content"]
+                metrics.inc("api_requests_total", outcome="batch")
+                usage = body.get("usage") or {}
+                metrics.inc("api_tokens_total", usage.get("prompt_tokens", 0), kind="prompt")
+                metrics.inc("api_tokens_total", usage.get("completion_tokens", 0), kind="completion")
+            else:
+                error = line.get("error") or body.get("error") or {}
+                errors[request_id] = f"{response.get('status_code', '')} {error.get('code', '')}: {error.get('message', '')}".strip()
+                metrics.inc("api_requests_total", outcome="batch_error")
+        self.tracker.collect_job(job["id"], responses, errors)
+        # The input files hold every image in base64; they are not needed once the job is collected
+        Path(job["input_file"]).unlink(missing_ok=True)
+        print(f"Collected batch job {job['id']} ({batch.status}): {len(responses)} responses, {len(errors)} errors")
+
+    async def __poll(self) -> int:
+        """Refreshes the open jobs and collects the finished ones; returns the number of jobs still running."""
+        running = 0
+        for job in self.tracker.open_jobs():
+            batch = await self.client.batches.retrieve(job["id"])
+            self.tracker.update_job(job["id"], batch.status, batch.output_file_id, batch.error_file_id)
+            if batch.status in TERMINAL_STATUSES:
+                await self.__collect(job, batch)
+            else:
+                running += 1
+        return running
+
+    def __prepare(self, detail_levels) -> None:
+        # Images with a request in flight or a result not merged yet are resumed, not sent again
+        for path, detail_level in detail_levels.items():
+            latest = self.tracker.latest(path)
+            if latest is None or latest["status"] == "merged":
+                self.tracker.add_request(path, "detect", detail_level)
+
+    def __result(self, row, summary=None, error=None) -> dict:
+        self._handed_over.add(row["id"])
+        summary = summary or {}
+        return {"image": row["path"], "summary": summary.get("summary", []), "tags": summary.get("tags", []),
+                "named_entities": summary.get("named_entities", []), "detail_level": row["detail_level"],
+                "request_time": row["updated_at"] - row["started_at"], "error": error, "request_id": row["id"]}
+
+    def __advance(self, detail_levels) -> list:
+        """
+        Turns the finished requests of the selected images into final results or follow-up summary requests. A
+        result stays 'done' (or 'failed') until the caller marks it merged, so a crash before the caller saved it
+        hands it over again on the next run.
+        """
+        results = []
+        for row in self.tracker.requests("done") + self.tracker.requests("failed"):
+            if row["path"] not in detail_levels or row["id"] in self._handed_over:
+                continue
+            if row["status"] == "failed":
+                results.append(self.__result(row, error=RuntimeError(row["error"] or "batch request failed")))
+            elif row["phase"] == "summary":
+                try:
+                    results.append(self.__result(row, summary=json.loads(row["response"])))
+                except ValueError as e:
+                    results.append(self.__result(row, error=e))
+            else:
+                from agent_plugin.AsyncVisionEngine import parse_structured_analysis
+
+                summary = parse_structured_analysis(row["response"]) if self.engine.prompt_structured else None
+                if summary is not None:
+                    results.append(self.__result(row, summary=summary))
+                else:
+                    # Two-step path, or a single-pass answer that failed validation: extract the fields in a summary job
+                    try:
+                        self.engine.summary_request(row["response"])
+                    except ValueError as e:
+                        results.append(self.__result(row, error=e))
+                    else:
+                        self.tracker.follow_up(row["id"], "summary", row["response"])
+        return results
+
+    async def run(self, detail_levels: dict, wait: bool = True):
+        """
+        Analyzes the images of {detail_levels} (image path -> detail level) in batch jobs and yields their results,
+        as AsyncVisionEngine.analyze returns them plus their 'request_id', as the jobs finish. Without {wait}, it
+        submits what is queued, collects what already finished and returns; a later run picks up the jobs still
+        running.
+        """
+        await recover_submissions(self.client, self.tracker)
+        await asyncio.to_thread(self.__prepare, detail_levels)
+        while True:
+            running = await self.__poll()
+            for result in await asyncio.to_thread(self.__advance, detail_levels):
+                yield result
+            running += await self.__submit()
+            if running == 0 or not wait:
+                break
+            await asyncio.sleep(self.poll_seconds)
+
+    def in_flight(self) -> int:
+        """Returns the number of requests queued or submitted and not finished yet."""
+        return sum(count for (_, status), count in self.tracker.counts().items() if status in ("queued", "submitted"))
+
+    def mark_merged(self, request_ids) -> None:
+        """Marks the results of {request_ids}, as yielded by run(), merged once the caller saved them."""
+        self.tracker.mark_merged(request_ids)
+        self._handed_over.difference_update(request_ids)
+
+    async def cancel(self) -> int:
+        """Cancels every job still running; returns their number. Their requests fail when collected."""
+        return await cancel_jobs(self.client, self.tracker)
+
+    def close(self) -> None:
+        self.tracker.close()
@@ -0,0 +1,90 @@
+import hashlib
+import json
+import os
+
+# Where an image can be routed: no vision call, or a vision call at the low or high detail level
+ROUTES = ("skip", "low", "high")
+
+# Stage of the routing decisions, on the MediaFile records and in the results store
+ROUTE_STAGE = "vision_routing"
+
+# The first matching rule decides; see rule_matches for the conditions a rule can hold
+DEFAULT_POLICY = {
+    # Detections less confident than this are ignored by every rule
+    "min_confidence": 0.25,
+    # Route of the images no rule matches, and of the images without object detection results
+    "default": "low",
+    "rules": [
+        # Screens, books and signs carry text the low detail level cannot read
+        {"name": "text", "route": "high",
+         "classes": ["book", "laptop", "tv", "cell phone", "keyboard", "clock", "stop sign", "parking meter"]},
+        # Groups of people: faces, names and the occasion matter most in a family album
+        {"name": "group", "route": "high", "classes": ["person"], "min_objects": 4},
+        {"name": "busy scene", "route": "high", "min_objects": 10},
+        # One or two confidently detected animals, vehicles or dishes: the detected objects already tag the photo
+        {"name": "single subject", "route": "skip", "only": True, "max_objects": 2, "min_score": 0.8,
+         "classes": ["bird", "cat", "dog", "horse", "sheep", "cow", "elephant", "bear", "zebra", "giraffe",
+                     "bicycle", "car", "motorcycle", "airplane", "bus", "train", "truck", "boat",
+                     "banana", "apple", "sandwich", "orange", "broccoli", "carrot", "hot dog", "pizza", "donut",
+                     "cake"]},
+    ],
+}
+
+
+def load_policy(policy_path: str = None) -> dict:
+    """
+    Returns the routing policy of the JSON file at {policy_path} (default: CASCADE_POLICY_PATH), or DEFAULT_POLICY.
+    Keys missing from the file are taken from DEFAULT_POLICY.
+    """
+    policy_path = policy_path or os.getenv("CASCADE_POLICY_PATH")
+    policy = dict(DEFAULT_POLICY)
+    if policy_path:
+        with open(policy_path, "r", encoding="utf-8") as file:
+            policy.update(json.load(file))
+    for rule in policy["rules"]:
+        if rule.get("route") not in ROUTES:
+            raise ValueError(f"Routing rule {rule.get('name', rule)} has route {rule.get('route')!r}, expected one of {', '.join(ROUTES)}")
+    if policy["default"] not in ROUTES:
+        raise ValueError(f"Default route {policy['default']!r} is not one of {', '.join(ROUTES)}")
+    return policy
+
+
+def policy_version(policy: dict) -> str:
+    """Returns a short hash of {policy}, recorded with each decision so decisions of different policies can be told apart."""
+    return hashlib.sha1(json.dumps(policy, sort_keys=True).encode("utf-8")).hexdigest()[:12]
+
+
+def rule_matches(rule: dict, detections: list) -> bool:
+    """
+    Returns True when the {detections} (dicts with 'name' and 'confidence') meet every condition of the {rule}:
+        classes: only detections of these classes are counted, and at least one is needed
+        only: every detection is of one of the classes
+        min_objects / max_objects: bounds of the number of counted detections
+        min_score: the lowest confidence of the counted detections
+    A rule without conditions matches every image.
+    """
+    classes = rule.get("classes")
+    counted = [detection for detection in detections if classes is None or detection["name"] in classes]
+    if rule.get("only") and len(counted) != len(detections):
+        return False
+    if len(counted) < rule.get("min_objects", 1 if classes is not None else 0):
+        return False
+    if "max_objects" in rule and len(counted) > rule["max_objects"]:
+        return False
+    if "min_score" in rule and any(detection["confidence"] < rule["min_score"] for detection in counted):
+        return False
+    return True
+
+
+def route_image(detections, policy: dict):
+    """
+    Returns (route, reason) for an image from its YOLO {detections}; None means the image has no object detection
+    results, which takes the default route.
+    """
+    if detections is None:
+        return policy["default"], "no object detection"
+    confident = [detection for detection in detections if detection["confidence"] >= policy["min_confidence"]]
+    for rule in policy["rules"]:
+        if rule_matches(rule, confident):
+            return rule["route"], rule.get("name", rule["route"])
+    return policy["default"], "default"
@@ -0,0 +1,83 @@
+from collections import Counter
+from pathlib import Path
+
+from agent_plugin.KernelFunction import kernel_function
+from agent_plugin.MediaCatalog import get_catalog
+from agent_plugin.Metrics import get_metrics, instrumented_stage
+from agent_plugin.ResultsStore import get_results_store
+from agent_plugin.StageResults import RoutingResult
+from agent_plugin.VisionRouter import ROUTE_STAGE, load_policy, policy_version, route_image
+
+# class for VisionRouter functions
+class VisionRouterPlugin:
+    """A plugin that decides from the YOLO detections which images need the Azure OpenAI vision model, and at which detail level."""
+    STAGE = ROUTE_STAGE
+    DETECTION_STAGE = "object_detection"
+
+    def detections_of(self, media_file, store=None):
+        """
+        Returns the YOLO detections of an image read from the results {store} (for a near-duplicate, those of its
+        representative), or None when the image has no object detection results.
+        """
+        record = store.get(media_file.path, self.DETECTION_STAGE) if store is not None else None
+        if record is not None and "detections" not in record and record.get("duplicate_of"):
+            record = store.get(record["duplicate_of"], self.DETECTION_STAGE)
+        return record.get("detections") if record is not None else None
+
+    def route_file(self, media_file, policy, store=None) -> dict:
+        """
+        Routes one image by the {policy} (see VisionRouter.load_policy) and keeps the decision on its record, for
+        ExpertContentAnalystPlugin, and in the results {store}.
+
+        Returns:
+            dict: the decision, with the 'route' (skip, low or high), the 'reason' and the 'policy' version.
+        """
+        route, reason = route_image(self.detections_of(media_file, store), policy)
+        decision = {"route": route, "reason": reason, "policy": policy_version(policy)}
+        media_file.results[self.STAGE] = decision
+        get_metrics().inc("routes_total", route=route)
+        if store is not None:
+            store.add(media_file.path, self.STAGE, decision)
+        return decision
+
+    def print_report(self, routes, reasons) -> None:
+        total = sum(routes.values())
+        print(f"Vision routing of {total} images: {routes['skip']} skipped, {routes['low']} at low detail, "
+              f"{routes['high']} at high detail.")
+        for reason, count in reasons.most_common():
+            print(f"  {reason}: {count}")
+
+    @instrumented_stage("route")
+    def route_folder(self, album_dir) -> RoutingResult:
+        """
+        Routes every image of {album_dir} after object detection: skip the vision model, call it at low detail or
+        escalate to high detail.
+        """
+        sample_dir = Path(album_dir).parent
+        if not sample_dir:
+            raise FileNotFoundError("Parent directory does not exist.")
+
+        images = get_catalog(sample_dir).files(album_dir, kind="image")
+        store = get_results_store(sample_dir)
+        policy = load_policy()
+        routes = Counter({"skip": 0, "low": 0, "high": 0})
+        reasons = Counter()
+        for media_file in images:
+            decision = self.route_file(media_file, policy, store)
+            routes[decision["route"]] += 1
+            reasons[f"{decision['route']} ({decision['reason']})"] += 1
+        store.flush()
+        self.print_report(routes, reasons)
+        return RoutingResult(str(album_dir), len(images), routes["skip"], routes["low"], routes["high"], dict(reasons))
+
+    @kernel_function(description="Decide which images stored in {album_dir} need the OpenAI vision model, and at which detail level, from their detected objects.")
+    def route_images(self, album_dir:str) -> str:
+        try:
+            self.route_folder(album_dir)
+            return f"Run OpenAI content and tags extraction and record the results applicable to the files stored in {{album_dir}} = '{album_dir}' "
+        except FileNotFoundError as e:
+            print(f"ERROR: The specified directory does not exist: {e}")
+            return f"ERROR: The specified directory does not exist: {e}"
+        except Exception as e:
+            print(f"ERROR:An error occurred: {str(e)}")
+            return f"ERROR:An error occurred: {str(e)}"
@@ -0,0 +1,34 @@
+import os
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+def default_io_workers() -> int:
+    """Thread count for I/O-bound work: 4 per CPU, at most 32."""
+    return min(32, (os.cpu_count() or 1) * 4)
+
+
+def map_unordered(function, items, max_workers=None, window=4):
+    """
+    Applies {function} to every item on a thread pool and yields (item, result, error) as each call completes.
+
+    At most {window} x {max_workers} calls are queued at once, so memory stays bounded for very long inputs.
+    """
+    max_workers = max_workers or default_io_workers()
+    items = iter(items)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = {}
+        for item in items:
+            pending[executor.submit(function, item)] = item
+            if len(pending) >= max_workers * window:
+                break
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                item = pending.pop(future)
+                next_item = next(items, None)
+                if next_item is not None:
+                    pending[executor.submit(function, next_item)] = next_item
+                try:
+                    yield item, future.result(), None
+                except Exception as e:
+                    yield item, None, e
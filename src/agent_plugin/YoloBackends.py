@@ -0,0 +1,195 @@
+import math
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+BACKENDS = ("torch", "onnx", "openvino")
+
+# Same defaults as the ultralytics NMS, so every backend keeps the same boxes
+IOU_THRESHOLD = 0.7
+MAX_DETECTIONS = 300
+MAX_CANDIDATES = 30000
+MAX_WH = 7680  # class offset: boxes of different classes never overlap in one NMS pass
+
+
+def preprocess(images):
+    """Stacks letterboxed BGR images into the float32 NCHW RGB batch (0-1) the exported models take."""
+    batch = np.stack(images)[..., ::-1].transpose(0, 3, 1, 2)
+    return np.ascontiguousarray(batch, dtype=np.float32) / 255.0
+
+
+def xywh_to_xyxy(boxes):
+    xyxy = np.empty_like(boxes)
+    half_width, half_height = boxes[:, 2] / 2, boxes[:, 3] / 2
+    xyxy[:, 0] = boxes[:, 0] - half_width
+    xyxy[:, 1] = boxes[:, 1] - half_height
+    xyxy[:, 2] = boxes[:, 0] + half_width
+    xyxy[:, 3] = boxes[:, 1] + half_height
+    return xyxy
+
+
+def nms(boxes, scores, iou_threshold: float):
+    """Returns the indexes of the boxes kept by greedy non-maximum suppression, by decreasing score."""
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    order = scores.argsort()[::-1]
+    keep = []
+    while order.size > 0:
+        best = order[0]
+        keep.append(best)
+        rest = order[1:]
+        width = np.clip(np.minimum(boxes[best, 2], boxes[rest, 2]) - np.maximum(boxes[best, 0], boxes[rest, 0]), 0, None)
+        height = np.clip(np.minimum(boxes[best, 3], boxes[rest, 3]) - np.maximum(boxes[best, 1], boxes[rest, 1]), 0, None)
+        overlap = width * height
+        iou = overlap / (areas[best] + areas[rest] - overlap + 1e-7)
+        order = rest[iou <= iou_threshold]
+    return np.array(keep, dtype=np.int64)
+
+
+def postprocess(output, conf: float, iou_threshold: float = IOU_THRESHOLD, max_detections: int = MAX_DETECTIONS):
+    """
+    Turns the raw (batch, 4 + classes, anchors) output of an exported YOLOv8 model into one (n, 6) array per
+    image of x1, y1, x2, y2, confidence, class in letterboxed pixels, as the ultralytics predictor does.
+    """
+    detections = []
+    for prediction in np.asarray(output):
+        prediction = prediction.T
+        scores = prediction[:, 4:]
+        classes = scores.argmax(axis=1)
+        confidences = scores[np.arange(len(scores)), classes]
+        candidates = np.flatnonzero(confidences > conf)
+        if len(candidates) > MAX_CANDIDATES:
+            candidates = candidates[confidences[candidates].argsort()[::-1][:MAX_CANDIDATES]]
+        if len(candidates) == 0:
+            detections.append(np.zeros((0, 6), dtype=np.float32))
+            continue
+        boxes = xywh_to_xyxy(prediction[candidates, :4])
+        confidences, classes = confidences[candidates], classes[candidates]
+        kept = nms(boxes + classes[:, None] * MAX_WH, confidences, iou_threshold)[:max_detections]
+        detections.append(np.column_stack([boxes[kept], confidences[kept], classes[kept]]).astype(np.float32))
+    return detections
+
+
+def default_threads(replicas: int = 1) -> int:
+    """Returns the intra-op threads of each model replica: YOLO_THREADS, otherwise the CPUs shared by the replicas."""
+    threads = int(os.getenv("YOLO_THREADS", "0"))
+    return threads if threads > 0 else max(1, (os.cpu_count() or 1) // max(1, replicas))
+
+
+# class for the stock PyTorch backend
+class TorchYoloBackend:
+    """Runs the ultralytics model itself; {render} displays and saves annotated images for debugging."""
+
+    def __init__(self, model, imgsz: int = 640, render: bool = False):
+        self.model = model
+        self.names = model.names
+        self.imgsz = imgsz
+        self.render = render
+
+    def infer(self, images, conf: float):
+        results = self.model.predict(list(images), imgsz=self.imgsz, conf=conf, verbose=False,
+                                     show=self.render, save=self.render)
+        return [result.boxes.data.cpu().numpy() for result in results]
+
+    def close(self):
+        pass
+
+
+# class for the ONNX Runtime backend
+class OnnxYoloBackend:
+    """Runs an exported ONNX model (FP32 or INT8) on the CPU with {threads} intra-op threads."""
+
+    def __init__(self, model_path, names: dict, threads: int = 1):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(str(model_path), options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+        self.names = names
+
+    def infer(self, images, conf: float):
+        output = self.session.run(None, {self.input_name: preprocess(images)})[0]
+        return postprocess(output, conf)
+
+    def close(self):
+        self.session = None
+
+
+# class for the OpenVINO backend
+class OpenVinoYoloBackend:
+    """Runs an OpenVINO IR model (FP32 or INT8) on the CPU with {threads} inference threads."""
+
+    def __init__(self, model_path, names: dict, threads: int = 1):
+        import openvino as ov
+
+        core = ov.Core()
+        # One batch runs at a time, so all the threads go to that batch
+        self.model = core.compile_model(str(model_path), "CPU", {"INFERENCE_NUM_THREADS": threads,
+                                                                 "PERFORMANCE_HINT": "LATENCY"})
+        self.names = names
+
+    def infer(self, images, conf: float):
+        output = self.model([preprocess(images)])[self.model.output(0)]
+        return postprocess(output, conf)
+
+    def close(self):
+        self.model = None
+
+
+def create_backend(backend: str, model_path, names=None, imgsz: int = 640, threads: int = 1, render: bool = False):
+    """Returns a {backend} runner for the model at {model_path}, exported beforehand for onnx and openvino."""
+    if backend == "torch":
+        # torch shares one intra-op pool per process
+        import torch
+        from ultralytics import YOLO
+
+        torch.set_num_threads(threads)
+        return TorchYoloBackend(YOLO(str(model_path)), imgsz, render)
+    if backend == "onnx":
+        return OnnxYoloBackend(model_path, names, threads)
+    if backend == "openvino":
+        return OpenVinoYoloBackend(model_path, names, threads)
+    raise ValueError(f"Unknown YOLO backend '{backend}', expected one of {', '.join(BACKENDS)}")
+
+
+# The model replica of a pool worker process
+_replica = None
+
+
+def _init_replica(backend, model_path, names, imgsz, threads):
+    global _replica
+    _replica = create_backend(backend, model_path, names, imgsz, threads)
+
+
+def _replica_infer(images, conf):
+    return _replica.infer(images, conf)
+
+
+# class for a process pool of model replicas
+class ReplicaPoolBackend:
+    """
+    Spreads each batch over {replicas} worker processes, each holding its own copy of the model with {threads}
+    intra-op threads. Worker processes are spawned, not forked, since the parent already runs loader threads.
+    """
+
+    def __init__(self, backend: str, model_path, names: dict, imgsz: int = 640, replicas: int = 2, threads: int = 1):
+        self.names = names
+        self.replicas = replicas
+        self.executor = ProcessPoolExecutor(replicas, mp_context=multiprocessing.get_context("spawn"),
+                                            initializer=_init_replica,
+                                            initargs=(backend, str(model_path), names, imgsz, threads))
+
+    def infer(self, images, conf: float):
+        images = list(images)
+        chunk = math.ceil(len(images) / self.replicas)
+        futures = [self.executor.submit(_replica_infer, images[start:start + chunk], conf)
+                   for start in range(0, len(images), chunk)]
+        return [detections for future in futures for detections in future.result()]
+
+    def close(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
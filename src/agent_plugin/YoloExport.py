@@ -0,0 +1,145 @@
+import json
+import mimetypes
+import os
+import random
+import shutil
+from pathlib import Path
+
+from agent_plugin.ModelRegistry import get_yolo_model
+from agent_plugin.StatePaths import state_dir
+
+CALIBRATION_SEED = 0
+
+
+def model_dir() -> Path:
+    """
+    Returns the folder of the exported models: YOLO_MODEL_DIR, otherwise models in the state folder (see
+    StatePaths.state_dir), so the reset of the sample folder does not export and calibrate them again.
+    """
+    return Path(os.getenv("YOLO_MODEL_DIR") or Path(state_dir(), "models"))
+
+
+def calibration_folder() -> Path:
+    """Returns the folder of the INT8 calibration photos: YOLO_CALIBRATION_DIR, otherwise the album."""
+    folder = os.getenv("YOLO_CALIBRATION_DIR")
+    if folder:
+        return Path(folder)
+    source_path = os.getenv("MEDIA_SOURCE_PATH")
+    album_dir = Path(source_path).parent / "album" if source_path else Path("album")
+    return album_dir if album_dir.is_dir() else Path(source_path or ".")
+
+
+def calibration_images(folder, samples: int, imgsz: int) -> list:
+    """
+    Returns up to {samples} photos of {folder}, picked at random (always the same ones for the same folder) and
+    letterboxed exactly as YoloInferenceEngine feeds them to the model.
+    """
+    from agent_plugin.YoloInferenceEngine import letterbox, read_image
+
+    image_paths = sorted(os.path.join(root, name) for root, _, names in os.walk(folder) for name in names
+                         if (mimetypes.guess_type(name)[0] or "").startswith("image/"))
+    random.Random(CALIBRATION_SEED).shuffle(image_paths)
+    images = []
+    for image_path in image_paths:
+        if len(images) >= samples:
+            break
+        try:
+            images.append(letterbox(read_image(image_path), imgsz)[0])
+        except Exception as e:
+            print(f"Skipping calibration image {image_path}: {str(e)}")
+    if not images:
+        raise ValueError(f"No photos to calibrate the INT8 model found in {folder} (see YOLO_CALIBRATION_DIR)")
+    return images
+
+
+def _export_onnx(model, imgsz, model_path):
+    # Dynamic axes, so one export serves every batch size
+    exported = model.export(format="onnx", imgsz=imgsz, dynamic=True, simplify=True, verbose=False)
+    shutil.move(exported, model_path)
+
+
+def _quantize_onnx(fp32_path, int8_path, images):
+    from onnxruntime.quantization import (CalibrationDataReader, CalibrationMethod, QuantFormat, QuantType,
+                                          quantize_static)
+
+    from agent_plugin.YoloBackends import preprocess
+
+    class PhotoReader(CalibrationDataReader):
+        def __init__(self):
+            self.batches = iter(images)
+
+        def get_next(self):
+            image = next(self.batches, None)
+            # 'images' is the input name of the ultralytics export
+            return None if image is None else {"images": preprocess([image])}
+
+    # Only the convolutions are quantized: the box decoding of the detection head stays in FP32
+    quantize_static(str(fp32_path), str(int8_path), PhotoReader(), quant_format=QuantFormat.QDQ,
+                    op_types_to_quantize=["Conv"], per_channel=True, activation_type=QuantType.QUInt8,
+                    weight_type=QuantType.QInt8, calibrate_method=CalibrationMethod.MinMax)
+
+
+def _export_openvino(onnx_path, model_path, images=None):
+    import openvino as ov
+
+    ov_model = ov.convert_model(str(onnx_path))
+    if images is not None:
+        import nncf
+
+        from agent_plugin.YoloBackends import preprocess
+
+        ov_model = nncf.quantize(ov_model, nncf.Dataset(images, lambda image: preprocess([image])),
+                                 preset=nncf.QuantizationPreset.MIXED, subset_size=len(images))
+    ov.save_model(ov_model, str(model_path), compress_to_fp16=False)
+
+
+def export_model(weights: str, backend: str, imgsz: int = 640, int8: bool = False):
+    """
+    Exports the YOLO model of {weights} for the {backend} ('onnx' or 'openvino') into model_dir(), once: later
+    calls (and later runs) reuse the exported files without importing torch or ultralytics at all. With {int8},
+    the model is quantized with calibration photos of our own (see calibration_folder and
+    YOLO_CALIBRATION_SAMPLES); delete the exported files to calibrate again.
+
+    Returns:
+        tuple: (path of the exported model, class names by index)
+    """
+    folder = model_dir()
+    folder.mkdir(parents=True, exist_ok=True)
+    name = f"{Path(weights).stem}-{imgsz}-{'int8' if int8 else 'fp32'}"
+    if backend == "onnx":
+        model_path = folder / f"{name}.onnx"
+    else:
+        model_path = folder / f"{name}_openvino" / f"{name}.xml"
+    info_path = folder / f"{name}-{backend}.json"
+    # The info file is written last, so an interrupted export is redone
+    if info_path.exists() and model_path.exists():
+        with open(info_path, "r") as file:
+            info = json.load(file)
+        return model_path, {int(index): label for index, label in info["names"].items()}
+
+    model = get_yolo_model(weights)
+    print(f"Exporting {weights} for {backend}{' INT8' if int8 else ''} to {model_path}")
+    fp32_onnx = folder / f"{Path(weights).stem}-{imgsz}-fp32.onnx"
+    if not fp32_onnx.exists():
+        _export_onnx(model, imgsz, fp32_onnx)
+
+    images = None
+    if int8:
+        samples = int(os.getenv("YOLO_CALIBRATION_SAMPLES", "200"))
+        images = calibration_images(calibration_folder(), samples, imgsz)
+        print(f"Calibrating INT8 quantization on {len(images)} photos")
+
+    if backend == "onnx":
+        if int8:
+            _quantize_onnx(fp32_onnx, model_path, images)
+    elif backend == "openvino":
+        model_path.parent.mkdir(parents=True, exist_ok=True)
+        _export_openvino(fp32_onnx, model_path, images)
+    else:
+        raise ValueError(f"Cannot export a YOLO model for the '{backend}' backend")
+
+    names = dict(model.names)
+    with open(info_path, "w") as file:
+        json.dump({"weights": weights, "backend": backend, "imgsz": imgsz, "int8": int8,
+                   "calibration_images": len(images) if images is not None else 0, "names": names}, file, indent=2)
+    return model_path, names
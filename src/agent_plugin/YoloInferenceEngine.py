@@ -0,0 +1,152 @@
+import queue
+import threading
+import time
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from agent_plugin.Metrics import get_metrics
+
+_END = object()
+
+
+def letterbox(image, size: int, color=(114, 114, 114)):
+    """
+    Resizes a BGR image to fit a {size}x{size} square keeping its aspect ratio, padding the borders.
+
+    Returns:
+        tuple: (padded image, scale factor, (pad_x, pad_y)) needed to map boxes back to the original image.
+    """
+    height, width = image.shape[:2]
+    scale = min(size / height, size / width)
+    new_width, new_height = int(round(width * scale)), int(round(height * scale))
+    if (new_width, new_height) != (width, height):
+        interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_LINEAR
+        image = cv2.resize(image, (new_width, new_height), interpolation=interpolation)
+    pad_x = (size - new_width) // 2
+    pad_y = (size - new_height) // 2
+    padded = cv2.copyMakeBorder(image, pad_y, size - new_height - pad_y, pad_x, size - new_width - pad_x,
+                                cv2.BORDER_CONSTANT, value=color)
+    return padded, scale, (pad_x, pad_y)
+
+
+def read_image(image_path):
+    """Decodes an image file into a BGR array, falling back to PIL for formats OpenCV cannot read (e.g. GIF)."""
+    image = cv2.imread(image_path, cv2.IMREAD_COLOR)
+    if image is None:
+        with Image.open(image_path) as pil_image:
+            image = cv2.cvtColor(np.asarray(pil_image.convert("RGB")), cv2.COLOR_RGB2BGR)
+    return image
+
+
+# class for batched YOLO inference
+class YoloInferenceEngine:
+    """
+    Runs a YOLO model over many images in batches.
+
+    Loader threads decode and letterbox images ahead of the model into a bounded queue, the model
+    runs on batches of {batch_size}, and detections are yielded batch by batch as they finish.
+    {model} is an inference backend (see ModelRegistry.get_yolo_backend): PyTorch, ONNX Runtime or OpenVINO.
+    """
+
+    def __init__(self, model, batch_size: int = 8, imgsz: int = 640, prefetch: int = 32,
+                 loader_threads: int = 2, conf: float = 0.25):
+        self.model = model
+        self.batch_size = max(1, batch_size)
+        self.imgsz = imgsz
+        self.prefetch = max(self.batch_size, prefetch)
+        self.loader_threads = max(1, loader_threads)
+        self.conf = conf
+
+    def __loader(self, paths_iter, paths_lock, out_queue, stop_event):
+        while not stop_event.is_set():
+            with paths_lock:
+                image_path = next(paths_iter, _END)
+            if image_path is _END:
+                break
+            try:
+                image, scale, pad = letterbox(read_image(image_path), self.imgsz)
+                out_queue.put((image_path, image, scale, pad, None))
+            except Exception as e:
+                out_queue.put((image_path, None, None, None, e))
+        out_queue.put(_END)
+
+    def __predict(self, batch):
+        """Runs the model on a batch of (key, letterboxed image, scale, pad) and returns (key, detections) pairs."""
+        # Each backend returns (x1, y1, x2, y2, confidence, class) rows in letterboxed pixels
+        results = self.model.infer([item[1] for item in batch], self.conf)
+        output = []
+        for (key, _, scale, (pad_x, pad_y)), boxes in zip(batch, results):
+            detections = []
+            for x1, y1, x2, y2, confidence, class_idx in boxes.tolist():
+                detections.append({
+                    "name": self.model.names[int(class_idx)],
+                    "confidence": round(float(confidence), 4),
+                    "box": [round((x1 - pad_x) / scale, 1), round((y1 - pad_y) / scale, 1),
+                            round((x2 - pad_x) / scale, 1), round((y2 - pad_y) / scale, 1)],
+                })
+            output.append((key, detections))
+        return output
+
+    def detect_arrays(self, frames):
+        """
+        Yields (key, detections) for every (key, BGR image array) pair of {frames}, batching them for the model.
+
+        {frames} is consumed lazily, so at most one batch of arrays is held here at a time (e.g. video frames).
+        """
+        batch = []
+        for key, image in frames:
+            padded, scale, pad = letterbox(image, self.imgsz)
+            batch.append((key, padded, scale, pad))
+            if len(batch) >= self.batch_size:
+                yield from self.__predict(batch)
+                batch = []
+        if batch:
+            yield from self.__predict(batch)
+
+    def detect(self, image_paths):
+        """
+        Yields (image_path, detections, error) for every image, in batch completion order.
+
+        Each detection is a dict with the class 'name', 'confidence' and 'box' in original image pixels.
+        Images that cannot be decoded are yielded with an empty detection list and the decoding error.
+        """
+        out_queue = queue.Queue(maxsize=self.prefetch)
+        stop_event = threading.Event()
+        paths_iter = iter(image_paths)
+        paths_lock = threading.Lock()
+        loaders = [threading.Thread(target=self.__loader, args=(paths_iter, paths_lock, out_queue, stop_event),
+                                    daemon=True)
+                   for _ in range(self.loader_threads)]
+        for loader in loaders:
+            loader.start()
+
+        try:
+            running = len(loaders)
+            batch = []
+            while running:
+                item = out_queue.get()
+                if item is _END:
+                    running -= 1
+                else:
+                    image_path, image, scale, pad, error = item
+                    if error is not None:
+                        yield image_path, [], error
+                        continue
+                    batch.append((image_path, image, scale, pad))
+                if len(batch) >= self.batch_size or (batch and not running):
+                    started = time.perf_counter()
+                    predictions = self.__predict(batch)
+                    get_metrics().record_file("content", time.perf_counter() - started, files=len(batch))
+                    for image_path, detections in predictions:
+                        yield image_path, detections, None
+                    batch = []
+        finally:
+            # Unblock the loaders if the consumer stopped early
+            stop_event.set()
+            while any(loader.is_alive() for loader in loaders):
+                try:
+                    out_queue.get(timeout=0.1)
+                except queue.Empty:
+                    pass
@@ -0,0 +1,220 @@
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks.Measurements import StageTimer, latency_summary, process_peak_rss
+
+"""
+Benchmarks the pipeline stages offline, on a synthetic corpus and against a local mock of Azure OpenAI, e.g.:
+    python benchmark.py --images 500 --duplicates 50 --junk 30 --stages validate,dedupe,metadata,expert
+    python benchmark.py --mode stream --latency-ms 800 --throttle-rate 0.05 --output bench.json
+    python benchmark.py --mode bulk --batch-seconds 5 --batch-error-rate 0.02
+    python benchmark.py --baseline bench.json --max-regression 0.2
+"""
+
+
+def configure_environment(sample_dir, endpoint=None) -> None:
+    """Points every store of the run into {sample_dir} and, when given, Azure OpenAI to the mock {endpoint}."""
+    os.environ["MEDIA_SOURCE_PATH"] = str(Path(sample_dir, "source"))
+    os.environ["MEDIA_STATE_DIR"] = str(Path(sample_dir, "state"))
+    os.environ["MEDIA_MANIFEST_PATH"] = str(Path(sample_dir, "manifest.db"))
+    os.environ["RESULTS_STORE_PATH"] = str(Path(sample_dir, "results.db"))
+    os.environ["ALBUM_INDEX_PATH"] = str(Path(sample_dir, "album_index.db"))
+    if endpoint is not None:
+        os.environ["AZURE_OPENAI_ENDPOINT"] = endpoint
+        os.environ["AZURE_OPENAI_API_KEY"] = "benchmark"
+        os.environ["AZURE_OPENAI_API_VERSION"] = "2024-10-21"
+        os.environ["AZURE_OPENAI_DEPLOYMENT_NAME"] = "mock-gpt-4o"
+
+
+def stage_files(result) -> int:
+    """Returns the number of files a direct-mode stage result covers."""
+    if hasattr(result, "processed"):
+        return result.processed
+    if hasattr(result, "organized"):
+        return result.organized + len(result.unprocessed)
+    return getattr(result, "images", 0) + getattr(result, "videos", 0)
+
+
+async def benchmark_direct(source_dir, stages, bulk=False) -> dict:
+    """
+    Runs the stages one after the other, timing each one and sampling its peak RSS. With {bulk}, the expert stage
+    runs in the Batch API bulk mode.
+    """
+    from process_media import load_plugin, run_direct
+
+    report = {}
+    for stage in stages:
+        with StageTimer() as timer:
+            if bulk and stage == "expert":
+                album_dir = str(Path(source_dir).parent / "album")
+                results = {stage: await load_plugin(stage).bulk_analyze_folder(album_dir)}
+            else:
+                results = await run_direct(source_dir, [stage])
+        files = stage_files(results[stage])
+        report[stage] = {"files": files, "seconds": round(timer.seconds, 3),
+                         "files_per_second": round(files / timer.seconds, 2) if timer.seconds > 0 else None,
+                         "latency": None, "peak_rss_mb": round(timer.peak / 2 ** 20, 1)}
+    return report
+
+
+async def benchmark_stream(source_dir, stages, queue_size) -> dict:
+    """Streams the corpus through the stages, recording the time each file spends in each stage."""
+    from agent_plugin.ClientRegistry import close_clients
+    from agent_plugin.StreamingPipeline import STREAM_STAGES, StreamingPipeline
+    from process_media import load_plugin
+
+    plugins = {stage: load_plugin(stage) for stage in stages if stage in STREAM_STAGES}
+    pipeline = StreamingPipeline(Path(source_dir).parent, plugins, queue_size=queue_size, record_latencies=True)
+    try:
+        with StageTimer() as timer:
+            stats = await pipeline.run(source_dir)
+    finally:
+        await close_clients()
+    # The stages overlap, so they share the wall time and the peak RSS of the whole run
+    return {stage: {"files": counts["processed"], "seconds": round(timer.seconds, 3),
+                    "files_per_second": round(counts["processed"] / timer.seconds, 2) if timer.seconds > 0 else None,
+                    "latency": latency_summary(pipeline.latencies[stage]), "peak_rss_mb": round(timer.peak / 2 ** 20, 1)}
+            for stage, counts in stats.items()}
+
+
+def print_report(report) -> None:
+    print(f"\n***** Benchmark ({report['mode']} mode, corpus seed {report['seed']}) *****")
+    print(f"Corpus: {report['corpus']} generated in {report['corpus_seconds']} s")
+    print(f"{'stage':<10}{'files':>8}{'seconds':>10}{'files/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'peak RSS MB':>13}")
+    for stage, row in report["stages"].items():
+        latency = row["latency"] or {}
+        cells = [row["files"], row["seconds"], row["files_per_second"], latency.get("p50_ms"), latency.get("p99_ms")]
+        cells = ["-" if cell is None else cell for cell in cells]
+        print(f"{stage:<10}{cells[0]:>8}{cells[1]:>10}{cells[2]:>10}{cells[3]:>10}{cells[4]:>10}{row['peak_rss_mb']:>13}")
+    if report.get("mock"):
+        mock = report["mock"]
+        print(f"Mock Azure OpenAI: {mock['requests']} requests, {mock['throttled']} throttled (429), "
+              f"p50 {mock['latency']['p50_ms']} ms, p99 {mock['latency']['p99_ms']} ms")
+        if mock["batch_jobs"]:
+            print(f"Mock Azure OpenAI Batch API: {mock['batch_jobs']} jobs, {mock['batch_requests']} requests")
+    print(f"Process peak RSS: {report['peak_rss_mb']} MB")
+
+
+def compare_to_baseline(report, baseline, max_regression) -> list:
+    """
+    Returns the regressions of {report} against a {baseline} report of the same stages: throughput lower, or p99
+    latency or peak RSS higher, by more than the {max_regression} fraction.
+    """
+    regressions = []
+    for stage, row in report["stages"].items():
+        before = baseline.get("stages", {}).get(stage)
+        if before is None:
+            continue
+        checks = [("files/s", before["files_per_second"], row["files_per_second"], False),
+                  ("p99 ms", (before["latency"] or {}).get("p99_ms"), (row["latency"] or {}).get("p99_ms"), True),
+                  ("peak RSS MB", before["peak_rss_mb"], row["peak_rss_mb"], True)]
+        for name, old, new, higher_is_worse in checks:
+            if not old or new is None:
+                continue
+            change = (new - old) / old if higher_is_worse else (old - new) / old
+            if change > max_regression:
+                regressions.append(f"{stage} {name}: {old} -> {new} ({change:+.0%})")
+    return regressions
+
+
+# Start the app
+if __name__ == "__main__":
+    from process_media import DEFAULT_STAGES, parse_stages
+
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline offline on a synthetic corpus.")
+    parser.add_argument("--images", type=int, default=200, help="Distinct synthetic photos (default: 200)")
+    parser.add_argument("--no-exif", type=float, default=0.1, help="Fraction of photos without EXIF (default: 0.1)")
+    parser.add_argument("--no-date", type=float, default=0.1,
+                        help="Fraction of photos with EXIF but no capture date (default: 0.1)")
+    parser.add_argument("--duplicates", type=int, default=20, help="Near-duplicate copies of photos (default: 20)")
+    parser.add_argument("--videos", type=int, default=0, help="Synthetic video clips, generated with ffmpeg (default: 0)")
+    parser.add_argument("--junk", type=int, default=20, help="Non-media and broken files (default: 20)")
+    parser.add_argument("--size", default="1600x1200", help="Photo size in pixels (default: 1600x1200)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the corpus and the mock (default: 0)")
+    parser.add_argument("--stages", type=parse_stages, default=DEFAULT_STAGES,
+                        help=f"Comma separated stages to benchmark (default: {','.join(DEFAULT_STAGES)})")
+    parser.add_argument("--mode", choices=["direct", "stream", "bulk"], default="direct",
+                        help="direct: one stage after the other, each timed on its own (default); "
+                             "stream: all stages overlapped, with per-file latencies; "
+                             "bulk: as direct, with the expert stage in the Batch API bulk mode")
+    parser.add_argument("--latency-ms", type=float, default=500.0, help="Mean mock Azure OpenAI latency (default: 500)")
+    parser.add_argument("--jitter-ms", type=float, default=100.0, help="Mock latency deviation (default: 100)")
+    parser.add_argument("--throttle-rate", type=float, default=0.0,
+                        help="Fraction of mock requests answered with 429 (default: 0)")
+    parser.add_argument("--retry-after-ms", type=int, default=200, help="retry-after-ms of the mock 429s (default: 200)")
+    parser.add_argument("--batch-seconds", type=float, default=2.0,
+                        help="Time the mock takes to complete a batch job (default: 2)")
+    parser.add_argument("--batch-error-rate", type=float, default=0.0,
+                        help="Fraction of mock batch requests that fail (default: 0)")
+    parser.add_argument("--live", action="store_true", help="Call the Azure OpenAI endpoint of .env instead of the mock")
+    parser.add_argument("--workdir", default=None,
+                        help="Folder for the corpus and the stores, wiped first (default: a temporary folder, removed afterwards)")
+    parser.add_argument("--output", default=None, help="Write the report as JSON to this file")
+    parser.add_argument("--baseline", default=None, help="JSON report of an earlier run to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.2,
+                        help="Fail when a stage is worse than the baseline by more than this fraction (default: 0.2)")
+    args = parser.parse_args()
+    stages = [stage for stage in args.stages if stage != "dispatcher"]
+    width, height = (int(value) for value in args.size.lower().split("x"))
+
+    workdir = Path(args.workdir or tempfile.mkdtemp(prefix="photo-benchmark-"))
+    sample_dir = Path(workdir, "sample_media")
+    if sample_dir.exists():
+        shutil.rmtree(sample_dir)
+
+    mock = None
+    if "expert" in stages and not args.live:
+        from benchmarks.MockAzureOpenAI import MockAzureOpenAI
+        mock = MockAzureOpenAI(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, throttle_rate=args.throttle_rate,
+                               retry_after_ms=args.retry_after_ms, seed=args.seed,
+                               batch_seconds=args.batch_seconds, batch_error_rate=args.batch_error_rate).start()
+    configure_environment(sample_dir, mock.endpoint if mock is not None else None)
+    if mock is not None and args.mode == "bulk":
+        # Poll the mock's batch jobs at a fraction of their duration instead of every minute
+        os.environ["AZURE_OPENAI_BATCH_POLL_SECONDS"] = str(max(0.1, args.batch_seconds / 4))
+
+    try:
+        from benchmarks.SyntheticCorpus import generate_corpus
+
+        started = time.perf_counter()
+        corpus = generate_corpus(Path(sample_dir, "source"), images=args.images, no_exif=args.no_exif,
+                                 no_date=args.no_date, videos=args.videos, junk=args.junk,
+                                 duplicates=args.duplicates, width=width, height=height, seed=args.seed)
+        corpus_seconds = round(time.perf_counter() - started, 2)
+
+        source_dir = os.environ["MEDIA_SOURCE_PATH"]
+        if args.mode in ("direct", "bulk"):
+            stage_report = asyncio.run(benchmark_direct(source_dir, stages, bulk=args.mode == "bulk"))
+        else:
+            stage_report = asyncio.run(benchmark_stream(source_dir, stages,
+                                                        int(os.environ.get("STREAM_QUEUE_SIZE", "64"))))
+        from agent_plugin.Metrics import get_metrics
+
+        # The pipeline's own per-file metrics (histogram-estimated percentiles) are kept alongside the measurements
+        report = {"mode": args.mode, "seed": args.seed, "corpus": corpus, "corpus_seconds": corpus_seconds,
+                  "stages": stage_report, "mock": mock.stats() if mock is not None else None,
+                  "metrics": get_metrics().stage_summary(),
+                  "peak_rss_mb": round(process_peak_rss() / 2 ** 20, 1)}
+    finally:
+        if mock is not None:
+            mock.stop()
+        if args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print_report(report)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+    if args.baseline:
+        with open(args.baseline, "r") as file:
+            regressions = compare_to_baseline(report, json.load(file), args.max_regression)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}")
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,81 @@
+import math
+import os
+import resource
+import threading
+import time
+
+
+def percentile(values, fraction: float):
+    """Returns the {fraction} (0-1) percentile of {values} by nearest rank, or None when there are no values."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, math.ceil(fraction * len(ordered)) - 1))
+    return ordered[rank]
+
+
+def latency_summary(latencies) -> dict:
+    """Returns the count, p50, p99 and max of a list of durations in seconds, as milliseconds."""
+    to_ms = lambda value: round(value * 1000, 2) if value is not None else None
+    return {"count": len(latencies), "p50_ms": to_ms(percentile(latencies, 0.50)),
+            "p99_ms": to_ms(percentile(latencies, 0.99)), "max_ms": to_ms(max(latencies) if latencies else None)}
+
+
+def current_rss() -> int:
+    """Returns the resident set size of this process in bytes, read from /proc on Linux."""
+    try:
+        with open("/proc/self/statm", "r") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def process_peak_rss() -> int:
+    """Returns the peak resident set size of this process since it started, in bytes."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+# class for sampling the memory of one benchmark stage
+class PeakRssSampler:
+    """
+    Samples the resident set size of the process every {interval} seconds on a background thread and keeps the
+    highest value, so each stage of a run gets its own peak (the kernel only tracks the peak of the whole process).
+    Use it as a context manager around the measured code.
+    """
+
+    def __init__(self, interval: float = 0.02):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, current_rss())
+
+    def __enter__(self):
+        self.peak = current_rss()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.__sample, name="rss-sampler", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss())
+        return False
+
+
+# class for timing one benchmark stage
+class StageTimer(PeakRssSampler):
+    """A PeakRssSampler that also measures the wall time of the stage, in {seconds}."""
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        self.seconds = 0.0
+        return super().__enter__()
+
+    def __exit__(self, *exc_info):
+        self.seconds = time.perf_counter() - self.started
+        return super().__exit__(*exc_info)
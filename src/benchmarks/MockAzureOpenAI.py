@@ -0,0 +1,324 @@
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from benchmarks.Measurements import latency_summary
+
+CHAT_PATH = re.compile(r"^/openai/deployments/(?P<deployment>[^/]+)/chat/completions$")
+FILES_PATH = re.compile(r"^/openai/files$")
+FILE_PATH = re.compile(r"^/openai/files/(?P<file_id>[^/]+)(?P<content>/content)?$")
+BATCHES_PATH = re.compile(r"^/openai/batches$")
+BATCH_PATH = re.compile(r"^/openai/batches/(?P<batch_id>[^/]+)(?P<cancel>/cancel)?$")
+
+# Vocabulary of the canned analyses; each request picks from it by the hash of its body, so answers are stable
+TAGS = ["beach", "mountain", "city", "dog", "cat", "family", "birthday", "sunset", "forest", "snow", "car",
+        "boat", "food", "garden", "museum", "concert", "bicycle", "lake", "bridge", "portrait"]
+ENTITIES = ["Paris", "Toronto", "Eiffel Tower", "Lake Louise", "Bucharest", "Golden Gate Bridge", "Alice", "Bob"]
+
+
+def canned_analysis(body: bytes) -> str:
+    """Returns a deterministic summary/tags/named_entities JSON answer for a request body."""
+    digest = hashlib.sha256(body).digest()
+    tags = sorted({TAGS[byte % len(TAGS)] for byte in digest[:4]})
+    entities = sorted({ENTITIES[byte % len(ENTITIES)] for byte in digest[4:5 + digest[5] % 2]})
+    return json.dumps({
+        "summary": [f"A synthetic photo showing {', '.join(tags)}."],
+        "tags": tags,
+        "named_entities": entities,
+    })
+
+
+# class for the local Azure OpenAI stand-in
+class MockAzureOpenAI:
+    """
+    A local HTTP server that answers the Azure OpenAI chat completions endpoint, for offline benchmarks.
+
+    Each request waits a latency drawn from a normal distribution ({latency_ms} mean, {jitter_ms} deviation), so
+    concurrency and connection pooling behave as against the real service. A {throttle_rate} fraction of the
+    requests is rejected with 429 and a retry-after-ms header of {retry_after_ms}. Answers are canned JSON
+    analyses derived from the request body. The same {seed} gives the same latencies and 429s for the same order
+    of requests.
+
+    The file and batch endpoints of the Batch API are answered too: a batch job is validating, then in progress,
+    and completes {batch_seconds} after its creation, with a {batch_error_rate} fraction of its requests failed
+    (status 500) in the error file.
+
+    Usage:
+        with MockAzureOpenAI(latency_ms=800, throttle_rate=0.05) as mock:
+            os.environ["AZURE_OPENAI_ENDPOINT"] = mock.endpoint
+    """
+
+    def __init__(self, latency_ms: float = 500.0, jitter_ms: float = 100.0, throttle_rate: float = 0.0,
+                 retry_after_ms: int = 200, host: str = "127.0.0.1", port: int = 0, seed: int = 0,
+                 batch_seconds: float = 2.0, batch_error_rate: float = 0.0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.throttle_rate = throttle_rate
+        self.retry_after_ms = retry_after_ms
+        self.batch_seconds = batch_seconds
+        self.batch_error_rate = batch_error_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._batch_lock = threading.Lock()  # one request at a time advances the batch jobs
+        self._latencies = []
+        self.requests = 0
+        self.throttled = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.batch_jobs = 0
+        self.batch_requests = 0
+        self._files = {}  # file id -> (file object, content)
+        self._batches = {}  # batch id -> batch object
+        self._server = ThreadingHTTPServer((host, port), self.__handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def endpoint(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _draw(self):
+        """Returns (throttled, latency in seconds) of the next request."""
+        with self._lock:
+            self.requests += 1
+            if self._random.random() < self.throttle_rate:
+                self.throttled += 1
+                return True, 0.0
+            return False, max(0.0, self._random.gauss(self.latency_ms, self.jitter_ms)) / 1000
+
+    def _record(self, latency, prompt_tokens, completion_tokens):
+        with self._lock:
+            self._latencies.append(latency)
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+
+    def _add_file(self, filename, purpose, content: bytes) -> dict:
+        with self._lock:
+            file = {"id": f"file-mock-{len(self._files) + 1}", "object": "file", "bytes": len(content),
+                    "created_at": int(time.time()), "filename": filename, "purpose": purpose, "status": "processed"}
+            self._files[file["id"]] = (file, content)
+        return file
+
+    def _file(self, file_id):
+        with self._lock:
+            return self._files.get(file_id)
+
+    def _create_batch(self, request: dict):
+        if self._file(request.get("input_file_id")) is None:
+            return None
+        now = int(time.time())
+        with self._lock:
+            self.batch_jobs += 1
+            batch = {"id": f"batch_mock-{self.batch_jobs}", "object": "batch", "endpoint": request.get("endpoint"),
+                     "errors": None, "input_file_id": request["input_file_id"],
+                     "completion_window": request.get("completion_window", "24h"), "status": "validating",
+                     "output_file_id": None, "error_file_id": None, "created_at": now, "in_progress_at": None,
+                     "expires_at": now + 24 * 3600, "finalizing_at": None, "completed_at": None, "failed_at": None,
+                     "expired_at": None, "cancelling_at": None, "cancelled_at": None,
+                     "request_counts": {"total": 0, "completed": 0, "failed": 0},
+                     "metadata": request.get("metadata"), "_started": time.monotonic()}
+            self._batches[batch["id"]] = batch
+        return batch
+
+    def __run_batch(self, batch) -> None:
+        """Answers the requests of a batch job into its output and error files."""
+        _, content = self._file(batch["input_file_id"])
+        output, errors = [], []
+        for line in content.decode("utf-8").splitlines():
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            with self._lock:
+                self.batch_requests += 1
+                failed = self._random.random() < self.batch_error_rate
+            if failed:
+                errors.append({"id": f"batch_req_mock-{self.batch_requests}", "custom_id": request["custom_id"],
+                               "response": {"status_code": 500, "request_id": f"mock-{self.batch_requests}",
+                                            "body": {"error": {"code": "server_error",
+                                                               "message": "The server had an error."}}},
+                               "error": None})
+                continue
+            body = json.dumps(request["body"]).encode("utf-8")
+            answer = canned_analysis(body)
+            prompt_tokens, completion_tokens = len(body) // 4, len(answer) // 4
+            with self._lock:
+                self.prompt_tokens += prompt_tokens
+                self.completion_tokens += completion_tokens
+            output.append({"id": f"batch_req_mock-{self.batch_requests}", "custom_id": request["custom_id"],
+                           "response": {"status_code": 200, "request_id": f"mock-{self.batch_requests}", "body": {
+                               "id": f"chatcmpl-mock-batch-{self.batch_requests}",
+                               "object": "chat.completion",
+                               "created": int(time.time()),
+                               "model": request["body"].get("model"),
+                               "choices": [{"index": 0, "finish_reason": "stop",
+                                            "message": {"role": "assistant", "content": answer}}],
+                               "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                                         "total_tokens": prompt_tokens + completion_tokens}}},
+                           "error": None})
+        for key, lines in (("output_file_id", output), ("error_file_id", errors)):
+            if lines:
+                text = "".join(json.dumps(line) + "\n" for line in lines).encode("utf-8")
+                batch[key] = self._add_file(f"{batch['id']}-{key.split('_')[0]}.jsonl", "batch_output", text)["id"]
+        batch["request_counts"] = {"total": len(output) + len(errors), "completed": len(output),
+                                   "failed": len(errors)}
+
+    def _batch(self, batch_id, cancel: bool = False):
+        """Returns the batch job, advanced to its current status (or cancelled), or None."""
+        with self._lock:
+            batch = self._batches.get(batch_id)
+        if batch is None:
+            return None
+        with self._batch_lock:
+            now = int(time.time())
+            elapsed = time.monotonic() - batch["_started"]
+            if batch["status"] in ("validating", "in_progress"):
+                if cancel:
+                    batch.update(status="cancelled", cancelling_at=now, cancelled_at=now)
+                elif elapsed >= self.batch_seconds:
+                    self.__run_batch(batch)
+                    batch.update(status="completed", in_progress_at=batch["in_progress_at"] or now, finalizing_at=now,
+                                 completed_at=now)
+                elif elapsed >= self.batch_seconds / 10:
+                    batch.update(status="in_progress", in_progress_at=batch["in_progress_at"] or now)
+        return {key: value for key, value in batch.items() if not key.startswith("_")}
+
+    def __handler_class(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive, like the real service
+
+            def log_message(self, format, *args):
+                pass
+
+            def __send_json(self, status, payload, headers=None):
+                body = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def __not_found(self):
+                self.__send_json(404, {"error": {"code": "404", "message": "Resource not found"}})
+
+            def __upload(self, body):
+                # multipart/form-data with the 'purpose' field and the 'file' part
+                message = BytesParser(policy=HTTP).parsebytes(
+                    f"Content-Type: {self.headers.get('Content-Type')}\r\n\r\n".encode("utf-8") + body)
+                fields, filename, content = {}, None, None
+                for part in message.iter_parts():
+                    name = part.get_param("name", header="content-disposition")
+                    if name == "file":
+                        filename, content = part.get_filename(), part.get_payload(decode=True)
+                    else:
+                        fields[name] = part.get_content().strip()
+                if content is None:
+                    self.__send_json(400, {"error": {"code": "invalidPayload", "message": "No file was uploaded."}})
+                    return
+                self.__send_json(200, mock._add_file(filename, fields.get("purpose", "batch"), content))
+
+            def do_GET(self):
+                path = self.path.split("?", 1)[0]
+                match = FILE_PATH.match(path)
+                if match is not None:
+                    file = mock._file(match.group("file_id"))
+                    if file is None:
+                        self.__not_found()
+                    elif match.group("content"):
+                        self.send_response(200)
+                        self.send_header("Content-Type", "application/octet-stream")
+                        self.send_header("Content-Length", str(len(file[1])))
+                        self.end_headers()
+                        self.wfile.write(file[1])
+                    else:
+                        self.__send_json(200, file[0])
+                    return
+                match = BATCH_PATH.match(path)
+                batch = mock._batch(match.group("batch_id")) if match is not None and not match.group("cancel") else None
+                if batch is None:
+                    self.__not_found()
+                else:
+                    self.__send_json(200, batch)
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", "0")))
+                path = self.path.split("?", 1)[0]
+                if FILES_PATH.match(path):
+                    self.__upload(body)
+                    return
+                if BATCHES_PATH.match(path):
+                    batch = mock._create_batch(json.loads(body or b"{}"))
+                    if batch is None:
+                        self.__send_json(400, {"error": {"code": "invalidInputFile", "message": "Input file not found."}})
+                    else:
+                        self.__send_json(200, mock._batch(batch["id"]))
+                    return
+                match = BATCH_PATH.match(path)
+                if match is not None and match.group("cancel"):
+                    batch = mock._batch(match.group("batch_id"), cancel=True)
+                    if batch is None:
+                        self.__not_found()
+                    else:
+                        self.__send_json(200, batch)
+                    return
+                match = CHAT_PATH.match(path)
+                if match is None:
+                    self.__not_found()
+                    return
+                started = time.perf_counter()
+                throttled, latency = mock._draw()
+                if throttled:
+                    self.__send_json(429, {"error": {"code": "429", "message": "Rate limit is exceeded."}},
+                                     {"retry-after-ms": str(mock.retry_after_ms),
+                                      "retry-after": str(max(1, round(mock.retry_after_ms / 1000)))})
+                    return
+                time.sleep(latency)
+                content = canned_analysis(body)
+                # Roughly 4 characters per token, as a stand-in for the real token counts
+                prompt_tokens, completion_tokens = len(body) // 4, len(content) // 4
+                mock._record(time.perf_counter() - started, prompt_tokens, completion_tokens)
+                self.__send_json(200, {
+                    "id": f"chatcmpl-mock-{mock.requests}",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": match.group("deployment"),
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": content}}],
+                    "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                              "total_tokens": prompt_tokens + completion_tokens},
+                })
+
+        return Handler
+
+    def start(self) -> "MockAzureOpenAI":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="mock-azure-openai", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+        return False
+
+    def stats(self) -> dict:
+        """Returns the request, 429, token and batch counts and the latency summary of the answered requests."""
+        with self._lock:
+            return {"requests": self.requests, "throttled": self.throttled, "prompt_tokens": self.prompt_tokens,
+                    "completion_tokens": self.completion_tokens, "batch_jobs": self.batch_jobs,
+                    "batch_requests": self.batch_requests, "latency": latency_summary(self._latencies)}
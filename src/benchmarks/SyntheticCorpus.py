@@ -0,0 +1,134 @@
+import random
+import struct
+import subprocess
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+# Capture dates are spread over these years, so the album gets many year/month folders
+FIRST_YEAR = 2015
+LAST_YEAR = 2024
+
+
+def exif_date_bytes(date_taken: str = None) -> bytes:
+    """
+    Returns a minimal little-endian Exif APP1 payload: IFD0 points to an Exif IFD holding DateTimeOriginal
+    ({date_taken} as 'YYYY:MM:DD HH:MM:SS'), or to an empty Exif IFD when {date_taken} is None.
+    """
+    ifd0_offset = 8
+    exif_ifd_offset = ifd0_offset + 2 + 12 + 4
+    tiff = b"II" + struct.pack("<HI", 42, ifd0_offset)
+    tiff += struct.pack("<H", 1) + struct.pack("<HHII", 0x8769, 4, 1, exif_ifd_offset) + struct.pack("<I", 0)
+    if date_taken is None:
+        tiff += struct.pack("<H", 0) + struct.pack("<I", 0)
+    else:
+        value = date_taken.encode("ascii") + b"\x00"
+        value_offset = exif_ifd_offset + 2 + 12 + 4
+        tiff += struct.pack("<H", 1) + struct.pack("<HHII", 0x9003, 2, len(value), value_offset) + struct.pack("<I", 0)
+        tiff += value
+    return b"Exif\x00\x00" + tiff
+
+
+def synthetic_image(rng, width: int, height: int):
+    """Returns a random smooth RGB image: an upscaled grid of random colors plus a little sensor noise."""
+    grid = rng.integers(0, 256, size=(rng.integers(3, 9), rng.integers(3, 9), 3), dtype=np.uint8)
+    image = Image.fromarray(grid, "RGB").resize((width, height), Image.BICUBIC)
+    pixels = np.asarray(image, dtype=np.int16) + rng.integers(-8, 9, size=(height, width, 3), dtype=np.int16)
+    return Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8), "RGB")
+
+
+def random_date(rng) -> datetime:
+    start = datetime(FIRST_YEAR, 1, 1)
+    span = (datetime(LAST_YEAR, 12, 31) - start).total_seconds()
+    return start + timedelta(seconds=int(rng.integers(0, int(span))))
+
+
+def _write_video(ffmpeg, video_path, seconds, creation_time):
+    subprocess.run(
+        [ffmpeg, "-hide_banner", "-loglevel", "error", "-y", "-f", "lavfi", "-i", "testsrc2=size=640x360:rate=24",
+         "-t", str(seconds), "-pix_fmt", "yuv420p", "-metadata", f"creation_time={creation_time}", str(video_path)],
+        check=True, stdin=subprocess.DEVNULL,
+    )
+
+
+def generate_corpus(source_dir, images: int = 100, no_exif: float = 0.1, no_date: float = 0.1, videos: int = 0,
+                    junk: int = 0, duplicates: int = 0, width: int = 1600, height: int = 1200,
+                    video_seconds: int = 5, seed: int = 0) -> dict:
+    """
+    Writes a reproducible synthetic media folder into {source_dir}.
+
+    Args:
+        images (int): Number of distinct JPEG photos. A {no_exif} fraction has no EXIF at all and a {no_date}
+            fraction has EXIF without DateTimeOriginal; the others carry a random capture date.
+        videos (int): Number of MP4 clips of {video_seconds} seconds with a creation_time tag (needs ffmpeg).
+        junk (int): Number of junk files: text files, random bytes named as photos and truncated JPEGs.
+        duplicates (int): Number of near-duplicates of the photos: re-encoded at a lower quality and resized.
+        seed (int): The same seed always produces the same files.
+
+    Returns:
+        dict: the number of files written per kind.
+    """
+    rng = np.random.default_rng(seed)
+    source_dir = Path(source_dir)
+    source_dir.mkdir(parents=True, exist_ok=True)
+    counts = {"dated": 0, "no_exif": 0, "no_date": 0, "videos": 0, "junk": 0, "duplicates": 0}
+
+    originals = []
+    for i in range(images):
+        image_path = source_dir / f"IMG_{i:05d}.jpg"
+        roll = rng.random()
+        if roll < no_exif:
+            exif, kind = None, "no_exif"
+        elif roll < no_exif + no_date:
+            exif, kind = exif_date_bytes(None), "no_date"
+        else:
+            exif, kind = exif_date_bytes(random_date(rng).strftime("%Y:%m:%d %H:%M:%S")), "dated"
+        image = synthetic_image(rng, width, height)
+        if exif is None:
+            image.save(image_path, "JPEG", quality=90)
+        else:
+            image.save(image_path, "JPEG", quality=90, exif=exif)
+        originals.append((image_path, exif))
+        counts[kind] += 1
+
+    for i in range(min(duplicates, len(originals) * 4)):
+        original_path, exif = originals[int(rng.integers(0, len(originals)))]
+        scale = float(rng.uniform(0.5, 0.9))
+        with Image.open(original_path) as image:
+            copy = image.resize((int(image.width * scale), int(image.height * scale)), Image.BILINEAR)
+        copy_path = source_dir / f"{original_path.stem}_copy{i:04d}.jpg"
+        quality = int(rng.integers(50, 80))
+        if exif is None:
+            copy.save(copy_path, "JPEG", quality=quality)
+        else:
+            copy.save(copy_path, "JPEG", quality=quality, exif=exif)
+        counts["duplicates"] += 1
+
+    if videos > 0:
+        from agent_plugin.VideoProbe import ffmpeg_tool
+
+        ffmpeg = ffmpeg_tool("ffmpeg")
+        if ffmpeg is None:
+            print("ffmpeg not found (see FFMPEG_FOLDER): no synthetic videos generated")
+        else:
+            for i in range(videos):
+                creation_time = random_date(rng).strftime("%Y-%m-%dT%H:%M:%S.000000Z")
+                _write_video(ffmpeg, source_dir / f"VID_{i:05d}.mp4", video_seconds, creation_time)
+                counts["videos"] += 1
+
+    junk_random = random.Random(seed)
+    for i in range(junk):
+        kind = i % 3
+        if kind == 0:
+            (source_dir / f"notes_{i:04d}.txt").write_text(f"Synthetic note {i}\n" * junk_random.randint(1, 50))
+        elif kind == 1:
+            # Random bytes behind a photo extension: only the header sniffing can tell
+            (source_dir / f"IMG_junk_{i:04d}.jpg").write_bytes(junk_random.randbytes(junk_random.randint(1024, 65536)))
+        else:
+            # A JPEG cut off after its first bytes, as left behind by an interrupted copy
+            (source_dir / f"IMG_truncated_{i:04d}.jpg").write_bytes(b"\xff\xd8\xff\xe0" + b"\x00" * 12)
+        counts["junk"] += 1
+
+    return counts
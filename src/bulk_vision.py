@@ -0,0 +1,61 @@
+import argparse
+import asyncio
+import os
+from datetime import datetime
+from pathlib import Path
+
+from agent_plugin.ClientRegistry import load_environment
+from agent_plugin.ExpertContentAnalystPlugin import ExpertContentAnalystPlugin
+from agent_plugin.VisionBatchJobs import BatchJobTracker, batch_work_dir, cancel_jobs
+
+"""
+Analyzes the album with Azure OpenAI batch jobs (the offline bulk mode) instead of synchronous calls, e.g.:
+    python bulk_vision.py run --no-wait     # submit the jobs and return
+    python bulk_vision.py status            # list the jobs and requests
+    python bulk_vision.py run               # collect the finished jobs and wait for the others
+Runs after the album was built (and optionally routed) by process_media.py.
+"""
+
+
+def print_status(tracker) -> None:
+    jobs = tracker.jobs()
+    if not jobs:
+        print("No batch jobs submitted yet.")
+    for job in jobs:
+        created = datetime.fromtimestamp(job["created_at"]).strftime("%Y-%m-%d %H:%M:%S")
+        collected = "collected" if job["collected"] else "not collected"
+        print(f"{job['id']}: {job['phase']}, {job['requests']} requests, {job['status']} ({collected}), submitted {created}")
+    for (phase, status), count in sorted(tracker.counts().items()):
+        print(f"  {phase} requests {status}: {count}")
+
+
+# Start the app
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Analyze the album with Azure OpenAI batch jobs.")
+    parser.add_argument("action", choices=["run", "status", "cancel"])
+    parser.add_argument("--no-wait", action="store_true",
+                        help="Submit the jobs and record the finished ones, without waiting for the others")
+    parser.add_argument("--detail-level", choices=["low", "high"], default="low",
+                        help="Detail level of the images the cascade router did not route")
+    parser.add_argument("--sample-dir", default=None,
+                        help="Folder holding the album (default: parent of MEDIA_SOURCE_PATH)")
+    args = parser.parse_args()
+    load_environment()
+    if args.sample_dir is None and not os.environ.get("MEDIA_SOURCE_PATH"):
+        parser.error("--sample-dir is required when MEDIA_SOURCE_PATH is not set (in the environment or .env)")
+
+    sample_dir = Path(args.sample_dir or Path(os.environ["MEDIA_SOURCE_PATH"]).parent)
+    if args.action == "run":
+        plugin = ExpertContentAnalystPlugin()
+        asyncio.run(plugin.bulk_analyze_folder(str(Path(sample_dir, "album")), args.detail_level,
+                                               wait=not args.no_wait))
+    else:
+        tracker = BatchJobTracker(Path(batch_work_dir(), "jobs.db"))
+        if args.action == "status":
+            print_status(tracker)
+        else:
+            from agent_plugin.ClientRegistry import get_openai_client
+
+            cancelled = asyncio.run(cancel_jobs(get_openai_client(), tracker))
+            print(f"Cancelled {cancelled} batch jobs; run the bulk mode again to record their failed requests.")
+        tracker.close()
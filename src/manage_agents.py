@@ -1,6 +1,3 @@
-from azure.identity.aio import DefaultAzureCredential
-from azure.ai.agents.aio import AgentsClient
-import jwt
 import asyncio
 from pathlib import Path
 import os
@@ -28,6 +25,10 @@ def init_agents():
     with open(f"{root_folder}/src/agent_instructions/media_analyst.txt", "r") as file:
         Media_Analyst_Instructions = file.read()
 
+    Duplicate_Analyst_Role = "DuplicateAnalystAgent"
+    with open(f"{root_folder}/src/agent_instructions/duplicate_analyst.txt", "r") as file:
+        Duplicate_Analyst_Instructions = file.read()
+
     Metadata_Analyst_Role = "MetadataAnalystAgent"
     with open(f"{root_folder}/src/agent_instructions/metadata_analyst.txt", "r") as file:
         Metadata_Analyst_Instructions = file.read()
@@ -36,6 +37,10 @@ def init_agents():
     with open(f"{root_folder}/src/agent_instructions/content_analyst.txt", "r") as file:
         Content_Analyst_Instructions = file.read()
 
+    Vision_Router = "VisionRouterAgent"
+    with open(f"{root_folder}/src/agent_instructions/vision_router.txt", "r") as file:
+        Vision_Router_Instructions = file.read()
+
     Expert_Content_Analyst = "ExpertContentAnalystAgent"
     with open(f"{root_folder}/src/agent_instructions/expert_content_analyst.txt", "r") as file:
         Expert_Content_Analyst_Instructions = file.read()
@@ -46,14 +51,19 @@ def init_agents():
 
     return {
         "media_analyst" : (Media_Analyst_Role, Media_Analyst_Instructions),
-        "meatadata_analyst" : (Metadata_Analyst_Role, Metadata_Analyst_Instructions),
+        "duplicate_analyst" : (Duplicate_Analyst_Role, Duplicate_Analyst_Instructions),
+        "metadata_analyst" : (Metadata_Analyst_Role, Metadata_Analyst_Instructions),
         "content_analyst" : (Content_Analyst, Content_Analyst_Instructions),
+        "vision_router" : (Vision_Router, Vision_Router_Instructions),
         "expert_content_analyst" : (Expert_Content_Analyst, Expert_Content_Analyst_Instructions),
         "dispatcher" : (Dispatcher, Dispatcher_Instructions)
     }
 
 async def delete_agent(agent_id):
     """Delete an agent by its ID."""
+    from azure.identity.aio import DefaultAzureCredential
+    from azure.ai.agents.aio import AgentsClient
+
     # Acquire a token
     spn_creds = DefaultAzureCredential(exclude_environment_credential=True, 
             exclude_managed_identity_credential=True)
@@ -64,6 +74,9 @@ async def delete_agent(agent_id):
         print(f"Deleted agent with ID: {agent_id}")
 
 async def list_ai_agents():
+    from azure.identity.aio import DefaultAzureCredential
+    from azure.ai.agents.aio import AgentsClient
+
     agent_list = []
     
     # Acquire a token
@@ -83,6 +96,9 @@ async def list_ai_agents():
     return agent_list
 
 async def list_ai_agents_instances():
+    from azure.identity.aio import DefaultAzureCredential
+    from azure.ai.agents.aio import AgentsClient
+
     agent_list = []
     
     # Acquire a token
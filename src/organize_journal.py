@@ -0,0 +1,53 @@
+import argparse
+import os
+from pathlib import Path
+
+from agent_plugin.AlbumIndex import get_album_index
+from agent_plugin.AlbumOrganizer import AlbumOrganizer
+from agent_plugin.ClientRegistry import load_environment
+from agent_plugin.MediaManifest import get_manifest
+
+"""
+Resumes, skips the remaining moves of, or rolls back a photo organization that was interrupted, using its move
+journal.
+"""
+
+# Start the app
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Resume, skip or roll back an interrupted album organization.")
+    parser.add_argument("action", choices=["resume", "skip", "rollback", "status"])
+    parser.add_argument("--sample-dir", default=None,
+                        help="Folder holding the album and the journal (default: parent of MEDIA_SOURCE_PATH)")
+    args = parser.parse_args()
+    load_environment()
+    if args.sample_dir is None and not os.environ.get("MEDIA_SOURCE_PATH"):
+        parser.error("--sample-dir is required when MEDIA_SOURCE_PATH is not set (in the environment or .env)")
+
+    sample_dir = Path(args.sample_dir or Path(os.environ["MEDIA_SOURCE_PATH"]).parent)
+    organizer = AlbumOrganizer(Path(sample_dir, "organize_journal.jsonl"))
+    if not organizer.has_pending():
+        print("No interrupted organization found.")
+    elif args.action == "status":
+        print(f"An interrupted organization is pending in {organizer.journal_path}.")
+    else:
+        manifest = get_manifest(sample_dir)
+        index = get_album_index(sample_dir)
+
+        def on_moved(old_path, new_path):
+            manifest.relocate(old_path, new_path)
+            index.remove_file(old_path)
+
+        if args.action == "resume":
+            moved, failed = organizer.resume(on_moved)
+            print(f"Resumed organization: {moved} files moved, {len(failed)} failed.")
+            for file_path, error in failed:
+                print(f"ERROR: Unable to move {file_path}: {error}")
+            if organizer.has_pending():
+                print("Some moves can be retried later; run 'skip' to leave those files where they are instead.")
+        elif args.action == "skip":
+            skipped = organizer.skip()
+            print(f"Closed the interrupted organization: {skipped} remaining moves skipped, their files left in place.")
+        else:
+            restored = organizer.rollback(on_moved)
+            print(f"Rolled back organization: {restored} files moved back to their source folder.")
+        manifest.commit()
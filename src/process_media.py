@@ -1,22 +1,16 @@
 # Copyright (c) Microsoft. All rights reserved.
 
+import argparse
 import asyncio
+import importlib
 import os
 import shutil
+import signal
+import time
 from pathlib import Path
 
-from semantic_kernel.agents import Agent, ChatCompletionAgent, SequentialOrchestration
-from semantic_kernel.agents.runtime import InProcessRuntime
-from semantic_kernel.connectors.ai.open_ai import AzureChatCompletion
-from semantic_kernel.contents import ChatMessageContent
-
-from agent_plugin.MetadataAnalystPlugin import MetadataAnalystPlugin
-from agent_plugin.MediaAnalystPlugin import MediaAnalystPlugin
-from agent_plugin.ContentAnalystPlugin import ContentAnalystPlugin
-from agent_plugin.ExpertContentAnalystPlugin import ExpertContentAnalystPlugin
-from agent_plugin.DispatcherPlugin import DispatcherPlugin
-
-from manage_agents import init_agents
+from agent_plugin.ClientRegistry import close_clients, get_openai_client, load_environment
+from agent_plugin.Metrics import get_metrics
 
 """
 The following sample demonstrates how to create a sequential orchestration for
@@ -28,95 +22,134 @@ a sequential orchestration, invoking the orchestration, and finally waiting for
 results.
 """
 
-def get_agents() -> list[Agent]:
-    """Return a list of agents that will participate in the sequential orchestration."""
+# Pipeline stages in execution order.
+# Plugin modules are imported only for the selected stages, so e.g. a validation-only run
+# never loads torch/ultralytics, PIL or the OpenAI SDK.
+STAGES = {
+    "validate": {
+        "agent": "media_validate_agent",
+        "instructions": "media_analyst",
+        "plugin": ("agent_plugin.MediaAnalystPlugin", "MediaAnalystPlugin"),
+        "api_key": "AZURE_OPENAI_API_KEY",
+        "api_version": "AZURE_OPENAI_API_VERSION",
+    },
+    "dedupe": {
+        "agent": "duplicate_analyst_agent",
+        "instructions": "duplicate_analyst",
+        "plugin": ("agent_plugin.DuplicateAnalystPlugin", "DuplicateAnalystPlugin"),
+        "api_key": "AZURE_OPENAI_API_KEY",
+        "api_version": "AZURE_OPENAI_API_VERSION",
+    },
+    "metadata": {
+        "agent": "metadata_analyst_agent",
+        "instructions": "metadata_analyst",
+        "plugin": ("agent_plugin.MetadataAnalystPlugin", "MetadataAnalystPlugin"),
+        "api_key": "AZURE_OPENAI_API_KEY_2",
+        "api_version": "AZURE_OPENAI_API_VERSION_2",
+    },
+    "content": {
+        "agent": "content_analyst_agent",
+        "instructions": "content_analyst",
+        "plugin": ("agent_plugin.ContentAnalystPlugin", "ContentAnalystPlugin"),
+        "api_key": "AZURE_OPENAI_API_KEY",
+        "api_version": "AZURE_OPENAI_API_VERSION",
+    },
+    "route": {
+        "agent": "vision_router_agent",
+        "instructions": "vision_router",
+        "plugin": ("agent_plugin.VisionRouterPlugin", "VisionRouterPlugin"),
+        "api_key": "AZURE_OPENAI_API_KEY",
+        "api_version": "AZURE_OPENAI_API_VERSION",
+    },
+    "expert": {
+        "agent": "expert_content_analyst_agent",
+        "instructions": "expert_content_analyst",
+        "plugin": ("agent_plugin.ExpertContentAnalystPlugin", "ExpertContentAnalystPlugin"),
+        "api_key": "AZURE_OPENAI_API_KEY",
+        "api_version": "AZURE_OPENAI_API_VERSION",
+    },
+    "dispatcher": {
+        "agent": "dispatcher_agent",
+        "instructions": "dispatcher",
+        "plugin": ("agent_plugin.DispatcherPlugin", "DispatcherPlugin"),
+        "api_key": "AZURE_OPENAI_API_KEY",
+        "api_version": "AZURE_OPENAI_API_VERSION",
+    },
+}
+
+DEFAULT_STAGES = ["validate", "dedupe", "metadata", "content"]
+
+
+def load_plugin(stage: str):
+    """Imports the plugin module of the given stage and returns a new plugin instance."""
+    module_name, class_name = STAGES[stage]["plugin"]
+    module = importlib.import_module(module_name)
+    return getattr(module, class_name)()
+
+
+def get_agents(stages: list[str] = DEFAULT_STAGES) -> dict[str, "Agent"]:
+    """Return the agents of the selected stages that will participate in the sequential orchestration."""
+    # Semantic Kernel agents are only loaded for the agent orchestration mode
+    from semantic_kernel.agents import ChatCompletionAgent
+    from semantic_kernel.connectors.ai.open_ai import AzureChatCompletion
+    from agent_plugin.KernelFunction import bind_kernel_functions
+    from manage_agents import init_agents
     
     agents_info_list = init_agents()
 
-    Media_Analyst_ID, Media_Analyst_Instructions = agents_info_list["media_analyst"]
-    Metadata_Analyst_ID, Metadata_Analyst_Instructions = agents_info_list["metadata_analyst"]
-    Content_Analyst_ID, Content_Analyst_Instructions = agents_info_list["content_analyst"]
-    Expert_Content_Analyst_ID, Expert_Content_Analyst_Instructions = agents_info_list["expert_content_analyst"]
-    Dispatcher_ID, Dispatcher_Instructions = agents_info_list["dispatcher"]
-
-    media_validate_agent = ChatCompletionAgent(
-        name=Media_Analyst_ID,
-        instructions=Media_Analyst_Instructions,
-        service=AzureChatCompletion(service_id="alvaz-openai",
-            deployment_name=os.environ.get("AZURE_OPENAI_DEPLOYMENT_NAME"),  # Your Azure deployment name
-            endpoint=os.environ.get("AZURE_OPENAI_ENDPOINT"),
-            api_key=os.environ.get("AZURE_OPENAI_API_KEY"),
-            api_version=os.environ.get("AZURE_OPENAI_API_VERSION")),
-        plugins=[MediaAnalystPlugin()]
-    )
-    metadata_analyst_agent = ChatCompletionAgent(
-        name=Metadata_Analyst_ID,
-        instructions=Metadata_Analyst_Instructions,
-        service=AzureChatCompletion(service_id="alvaz-openai",
-            deployment_name=os.environ.get("AZURE_OPENAI_DEPLOYMENT_NAME"),  # Your Azure deployment name
-            endpoint=os.environ.get("AZURE_OPENAI_ENDPOINT"),
-            api_key=os.environ.get("AZURE_OPENAI_API_KEY_2"),
-            api_version=os.environ.get("AZURE_OPENAI_API_VERSION_2")),
-        plugins=[MetadataAnalystPlugin()]
-    )
-    content_analyst_agent = ChatCompletionAgent(
-        name=Content_Analyst_ID,
-        instructions=Content_Analyst_Instructions,
-        service=AzureChatCompletion(service_id="alvaz-openai",
-            deployment_name=os.environ.get("AZURE_OPENAI_DEPLOYMENT_NAME"),  # Your Azure deployment name
-            endpoint=os.environ.get("AZURE_OPENAI_ENDPOINT"),
-            api_key=os.environ.get("AZURE_OPENAI_API_KEY"),
-            api_version=os.environ.get("AZURE_OPENAI_API_VERSION")),
-        plugins=[ContentAnalystPlugin()]
-    )
-    expert_content_analyst_agent = ChatCompletionAgent(
-        name=Expert_Content_Analyst_ID,
-        instructions=Expert_Content_Analyst_Instructions,
-        service=AzureChatCompletion(service_id="alvaz-openai",
-            deployment_name=os.environ.get("AZURE_OPENAI_DEPLOYMENT_NAME"),  # Your Azure deployment name
-            endpoint=os.environ.get("AZURE_OPENAI_ENDPOINT"),
-            api_key=os.environ.get("AZURE_OPENAI_API_KEY"),
-            api_version=os.environ.get("AZURE_OPENAI_API_VERSION")),
-        plugins=[ExpertContentAnalystPlugin()]
-    )
-    dispatcher_agent = ChatCompletionAgent(
-        name=Dispatcher_ID,
-        instructions=Dispatcher_Instructions,
-        service=AzureChatCompletion(service_id="alvaz-openai",
-            deployment_name=os.environ.get("AZURE_OPENAI_DEPLOYMENT_NAME"),  # Your Azure deployment name
-            endpoint=os.environ.get("AZURE_OPENAI_ENDPOINT"),
-            api_key=os.environ.get("AZURE_OPENAI_API_KEY"),
-            api_version=os.environ.get("AZURE_OPENAI_API_VERSION")),
-        plugins=[DispatcherPlugin()]
-    )
-
     # Return all agents in a dictionary
     # This allows for easy access to each agent by its name.
-    return {
-        "media_validate_agent": media_validate_agent,
-        "metadata_analyst_agent": metadata_analyst_agent,
-        "content_analyst_agent": content_analyst_agent,
-        "expert_content_analyst_agent": expert_content_analyst_agent,
-        "dispatcher_agent": dispatcher_agent
-    }
+    agents = {}
+    for stage in stages:
+        stage_info = STAGES[stage]
+        agent_id, agent_instructions = agents_info_list[stage_info["instructions"]]
+        # Agents with the same endpoint, key and API version share one pooled client
+        client = get_openai_client(endpoint=os.environ.get("AZURE_OPENAI_ENDPOINT"),
+                                   api_key=os.environ.get(stage_info["api_key"]),
+                                   api_version=os.environ.get(stage_info["api_version"]))
+        agents[stage_info["agent"]] = ChatCompletionAgent(
+            name=agent_id,
+            instructions=agent_instructions,
+            service=AzureChatCompletion(service_id="alvaz-openai",
+                deployment_name=os.environ.get("AZURE_OPENAI_DEPLOYMENT_NAME"),  # Your Azure deployment name
+                async_client=client),
+            plugins=[bind_kernel_functions(load_plugin(stage))]
+        )
+    return agents
+
+
+# Time of the previous agent message of the orchestration, to measure each agent hop
+_last_agent_message = {"time": None}
 
 
-def agent_response_callback(message: ChatMessageContent) -> None:
-    """Observer function to print the messages from the agents."""
+def agent_response_callback(message: "ChatMessageContent") -> None:
+    """Observer function to print the messages from the agents, counting each agent hop and its tokens."""
+    now = time.perf_counter()
+    metrics = get_metrics()
+    metrics.inc("agent_messages_total", agent=message.name)
+    if _last_agent_message["time"] is not None:
+        metrics.observe("agent_hop_seconds", now - _last_agent_message["time"], agent=message.name)
+    _last_agent_message["time"] = now
+    usage = (message.metadata or {}).get("usage")
+    if usage is not None:
+        metrics.inc("api_tokens_total", getattr(usage, "prompt_tokens", 0) or 0, kind="prompt")
+        metrics.inc("api_tokens_total", getattr(usage, "completion_tokens", 0) or 0, kind="completion")
     print(f"# {message.name}\n{message.content}")
 
 
-async def main(user_query: str) -> None:
+async def main(user_query: str, stages: list[str] = DEFAULT_STAGES) -> None:
     """Main function to run the agents orchestrations."""
+    from semantic_kernel.agents import SequentialOrchestration
+    from semantic_kernel.agents.runtime import InProcessRuntime
 
     # 1. Create a sequential orchestration with multiple agents and an agent
     #    response callback to observe the output from each agent.
-    agent_list = get_agents()
+    agent_list = get_agents(stages)
     
     # Create a sequential orchestration with the agents
     # The agents will be executed in the order they are listed.
     sequential_orchestration = SequentialOrchestration(
-        members=[agent_list("media_validate_agent"), agent_list("metadata_analyst_agent"), agent_list("content_analyst_agent")],
+        members=[agent_list[STAGES[stage]["agent"]] for stage in stages],
         agent_response_callback=agent_response_callback,
     )
 
@@ -125,6 +158,7 @@ async def main(user_query: str) -> None:
     runtime.start()
 
     # 3. Invoke the orchestration with a task and the runtime
+    _last_agent_message["time"] = time.perf_counter()
     orchestration_result = await sequential_orchestration.invoke(
         task=user_query,
         runtime=runtime,
@@ -134,8 +168,96 @@ async def main(user_query: str) -> None:
     value = await orchestration_result.get(timeout=300)
     print(f"***** Final Result *****\n{value}")
 
-    # 5. Stop the runtime when idle
+    # 5. Stop the runtime when idle, then release the shared connection pools
     await runtime.stop_when_idle()
+    await close_clients()
+
+async def run_direct(source_dir: str, stages: list[str] = DEFAULT_STAGES) -> dict:
+    """
+    Runs the selected stages by calling their plugins directly, in pipeline order, without any LLM round trip.
+
+    Each stage returns a typed result (see agent_plugin/StageResults.py) and the next stage takes its input from it,
+    e.g. object detection runs on the album folder reported by the metadata stage. A failing stage stops the run.
+    """
+    results = {}
+    album_dir = str(Path(source_dir).parent / "album")
+    for stage in stages:
+        if stage == "dispatcher":
+            print("Direct mode has no dispatcher: the stages are chained in code.")
+            continue
+        plugin = load_plugin(stage)
+        if stage == "validate":
+            results[stage] = plugin.validate_folder(source_dir)
+        elif stage == "dedupe":
+            results[stage] = plugin.find_duplicates(source_dir)
+        elif stage == "metadata":
+            results[stage] = plugin.organize_folder(source_dir)
+            album_dir = results[stage].album_dir
+        elif stage == "content":
+            results[stage] = plugin.detect_folder(album_dir)
+        elif stage == "route":
+            results[stage] = plugin.route_folder(album_dir)
+        elif stage == "expert":
+            try:
+                results[stage] = await plugin.analyze_folder(album_dir)
+            finally:
+                await close_clients()
+        print(f"# {stage}\n{results[stage]}")
+    return results
+
+async def run_stream(source_dir: str, stages: list[str] = DEFAULT_STAGES) -> None:
+    """Runs the selected stages file by file over bounded queues, without agent orchestration."""
+    from agent_plugin.StreamingPipeline import STREAM_STAGES, StreamingPipeline
+
+    skipped = [stage for stage in stages if stage not in STREAM_STAGES]
+    if skipped:
+        print(f"Streaming mode does not run the stage(s): {', '.join(skipped)}")
+    plugins = {stage: load_plugin(stage) for stage in stages if stage in STREAM_STAGES}
+    pipeline = StreamingPipeline(Path(source_dir).parent, plugins,
+                                 queue_size=int(os.environ.get("STREAM_QUEUE_SIZE", "64")))
+    try:
+        stats = await pipeline.run(source_dir)
+    finally:
+        await close_clients()
+    print_stream_stats(stats)
+
+async def run_watch(source_dir: str, stages: list[str] = DEFAULT_STAGES) -> None:
+    """
+    Watches the source folder and streams every file that arrives there through the selected stages, until Ctrl+C
+    or SIGTERM. Files already waiting are processed first; nothing is wiped.
+    """
+    from agent_plugin.StreamingPipeline import STREAM_STAGES, StreamingPipeline
+
+    skipped = [stage for stage in stages if stage not in STREAM_STAGES]
+    if skipped:
+        print(f"Watch mode does not run the stage(s): {', '.join(skipped)}")
+    plugins = {stage: load_plugin(stage) for stage in stages if stage in STREAM_STAGES}
+    os.makedirs(source_dir, exist_ok=True)
+    pipeline = StreamingPipeline(Path(source_dir).parent, plugins,
+                                 queue_size=int(os.environ.get("STREAM_QUEUE_SIZE", "64")))
+
+    # Stop gracefully: the files in flight finish and the organization journal is committed
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(signum, stop_event.set)
+        except NotImplementedError:
+            pass  # Windows: Ctrl+C interrupts the run instead
+    print(f"Watching {source_dir} for new media files (Ctrl+C to stop)")
+    try:
+        stats = await pipeline.watch(source_dir, stop_event,
+                                     debounce=float(os.environ.get("WATCH_DEBOUNCE_SECONDS", "1.0")),
+                                     polling=os.environ.get("WATCH_POLLING", "0") == "1",
+                                     checkpoint_seconds=float(os.environ.get("WATCH_CHECKPOINT_SECONDS", "30")))
+    finally:
+        await close_clients()
+    print_stream_stats(stats)
+
+def print_stream_stats(stats: dict) -> None:
+    print("***** Final Result *****")
+    for stage, counts in stats.items():
+        print(f"{stage}: {counts['processed']} processed, {counts['passed']} passed, {counts['failed']} failed")
 
 def delete_all_in_directory(directory: str) -> None:
     """
@@ -174,14 +296,47 @@ def __prepare_test_media_files():
             shutil.copy2(src_file, dst_file)
     print("Sample media files prepared.")
 
+def parse_stages(value: str) -> list[str]:
+    """Parses a comma separated list of stage names, keeping the pipeline order."""
+    selected = [stage.strip() for stage in value.split(",") if stage.strip()]
+    unknown = [stage for stage in selected if stage not in STAGES]
+    if unknown:
+        raise argparse.ArgumentTypeError(f"Unknown stage(s): {', '.join(unknown)}. Valid stages: {', '.join(STAGES)}")
+    return [stage for stage in STAGES if stage in selected]
+
 # Start the app
 if __name__ == "__main__":
-    # Prepare the sample_media folder for the sample to run
-    __prepare_test_media_files()
+    parser = argparse.ArgumentParser(description="Organize and analyze a folder of media files.")
+    parser.add_argument("--stages", type=parse_stages, default=DEFAULT_STAGES,
+                        help=f"Comma separated stages to load and run (default: {','.join(DEFAULT_STAGES)}). "
+                             f"Available: {','.join(STAGES)}")
+    parser.add_argument("--mode", choices=["direct", "stream", "watch", "agents"], default="direct",
+                        help="direct: call the stage plugins one after the other, without LLM round trips (default); "
+                             "stream: every file flows through the stages as soon as the previous one is done with it; "
+                             "watch: keep running and stream every new file of the source folder as it arrives; "
+                             "agents: interactive sequential orchestration of AI agents")
+    parser.add_argument("--profile", action="store_true",
+                        help="Save a cProfile and a tracemalloc snapshot of every stage (same as PIPELINE_PROFILE=1)")
+    args = parser.parse_args()
+    load_environment()
+    if args.profile:
+        os.environ["PIPELINE_PROFILE"] = "1"
+
+    # Prepare the sample_media folder for the sample to run; the watch daemon keeps the folder as it is
+    if args.mode != "watch":
+        __prepare_test_media_files()
 
     # Define the user query for the agents
     # This query will be passed to the first agent in the sequential orchestration.
     USER_QUERY = "Create a photo album, keeping both photos and videos organized by year and month, from a set of media files stored in the sample_media folder.\n"
     USER_QUERY += f"The source directory for media files is {os.environ.get('MEDIA_SOURCE_PATH')}."
     
-    asyncio.run(main(USER_QUERY))
+    if args.mode == "direct":
+        asyncio.run(run_direct(os.environ.get('MEDIA_SOURCE_PATH'), args.stages))
+    elif args.mode == "stream":
+        asyncio.run(run_stream(os.environ.get('MEDIA_SOURCE_PATH'), args.stages))
+    elif args.mode == "watch":
+        asyncio.run(run_watch(os.environ.get('MEDIA_SOURCE_PATH'), args.stages))
+    else:
+        asyncio.run(main(USER_QUERY, args.stages))
+    get_metrics().print_summary()
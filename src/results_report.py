@@ -0,0 +1,43 @@
+import argparse
+import json
+import os
+import time
+from pathlib import Path
+
+from agent_plugin.ClientRegistry import load_environment
+from agent_plugin.ResultsStore import get_results_store
+
+"""
+Prints the analysis results recorded by the pipeline stages, as readable log text or as JSON lines.
+"""
+
+STAGE_ALIASES = {
+    "objects": "object_detection",
+    "video-objects": "video_object_detection",
+    "vision": "vision_analysis",
+}
+
+# Start the app
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report the recorded analysis results.")
+    parser.add_argument("--stage", default=None,
+                        help=f"Only this stage: {', '.join(STAGE_ALIASES)} or a stage name (default: all stages)")
+    parser.add_argument("--folder", default=None, help="Only files under this folder")
+    parser.add_argument("--days", type=float, default=None, help="Only results recorded in the last N days")
+    parser.add_argument("--json", action="store_true", help="Print one JSON record per line instead of the log text")
+    parser.add_argument("--sample-dir", default=None,
+                        help="Sample folder of the run (default: parent of MEDIA_SOURCE_PATH)")
+    args = parser.parse_args()
+    load_environment()
+    if args.sample_dir is None and not os.environ.get("MEDIA_SOURCE_PATH"):
+        parser.error("--sample-dir is required when MEDIA_SOURCE_PATH is not set (in the environment or .env)")
+
+    sample_dir = Path(args.sample_dir or Path(os.environ["MEDIA_SOURCE_PATH"]).parent)
+    store = get_results_store(sample_dir)
+    stage = STAGE_ALIASES.get(args.stage, args.stage)
+    since = time.time() - args.days * 86400 if args.days is not None else None
+    for record in store.query(stage=stage, path_prefix=args.folder, since=since):
+        if args.json:
+            print(json.dumps(record))
+        elif record["log"]:
+            print(record["log"].rstrip("\n"))
@@ -0,0 +1,49 @@
+import argparse
+import os
+import time
+from pathlib import Path
+
+from agent_plugin.AlbumIndex import KINDS, get_album_index
+from agent_plugin.ClientRegistry import load_environment
+from agent_plugin.ResultsStore import get_results_store
+
+"""
+Searches the album by detected objects, tags, named entities, year and month, e.g.:
+    python search_album.py --object dog --year 2021
+"""
+
+# Start the app
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Search the album through its tag and object index.")
+    parser.add_argument("--object", action="append", help="Detected object class, e.g. dog (repeatable)")
+    parser.add_argument("--tag", action="append", help="Azure OpenAI tag (repeatable)")
+    parser.add_argument("--entity", action="append", help="Named entity, e.g. a place or a person (repeatable)")
+    parser.add_argument("--year", action="append", help="Capture year, e.g. 2021")
+    parser.add_argument("--month", action="append", help="Capture month, as a name or a number")
+    parser.add_argument("--any", action="append", help="Term of any kind (repeatable)")
+    parser.add_argument("--limit", type=int, default=None, help="Maximum number of paths to print")
+    parser.add_argument("--top", choices=KINDS, default=None, help="List the most frequent terms of a kind instead")
+    parser.add_argument("--sample-dir", default=None,
+                        help="Sample folder of the run (default: parent of MEDIA_SOURCE_PATH)")
+    args = parser.parse_args()
+    load_environment()
+    if args.sample_dir is None and not os.environ.get("MEDIA_SOURCE_PATH"):
+        parser.error("--sample-dir is required when MEDIA_SOURCE_PATH is not set (in the environment or .env)")
+
+    sample_dir = Path(args.sample_dir or Path(os.environ["MEDIA_SOURCE_PATH"]).parent)
+    index = get_album_index(sample_dir)
+    # Catch up with results recorded since the last update; this never rebuilds the index
+    index.update(get_results_store(sample_dir))
+
+    if args.top:
+        for value, files in index.terms(args.top, limit=args.limit or 50):
+            print(f"{files:>8}  {value}")
+    elif not any([args.object, args.tag, args.entity, args.year, args.month, args.any]):
+        parser.error("give at least one of --object, --tag, --entity, --year, --month, --any or --top")
+    else:
+        start_time = time.perf_counter()
+        paths = index.search(limit=args.limit, object=args.object, tag=args.tag, entity=args.entity,
+                             year=args.year, month=args.month, any=args.any)
+        for path in paths:
+            print(path)
+        print(f"{len(paths)} files found in {(time.perf_counter() - start_time) * 1000:.1f} ms.")
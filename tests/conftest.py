@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# The application imports its modules as agent_plugin.*, relative to src/
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
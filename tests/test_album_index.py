@@ -0,0 +1,96 @@
+import os
+
+import pytest
+
+from agent_plugin.AlbumIndex import AlbumIndex, date_terms, normalize_term
+from agent_plugin.ResultsStore import ResultsStore
+
+
+def make_album_file(tmp_path, name, year="2021", month="july"):
+    path = tmp_path / "album" / year / month / name
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b"photo")
+    return str(path)
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = ResultsStore(str(tmp_path / "results.db"))
+    yield store
+    store.close()
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = AlbumIndex(str(tmp_path / "album_index.db"))
+    yield index
+    index.close()
+
+
+def test_terms_are_normalized():
+    assert normalize_term("month", "March") == "03"
+    assert normalize_term("month", "3") == "03"
+    assert normalize_term("entity", {"name": " Paris "}) == "paris"
+    assert date_terms("/album/2019/december/a.jpg") == [("year", "2019"), ("month", "12")]
+
+
+def test_update_indexes_new_records_and_search_intersects_criteria(tmp_path, store, index):
+    dog = make_album_file(tmp_path, "dog.jpg")
+    cat = make_album_file(tmp_path, "cat.jpg", year="2020")
+    store.add(dog, "object_detection", {"objects": ["dog", "person"]})
+    store.add(cat, "object_detection", {"objects": ["cat", "person"]})
+    store.add(dog, "vision_analysis", {"tags": ["Beach"], "named_entities": [{"name": "Nice"}]})
+
+    assert index.update(store) == 3
+    assert index.update(store) == 0
+    assert index.search(object="person") == sorted([cat, dog])
+    assert index.search(object="person", year=2021) == [dog]
+    assert index.search(tag="beach", month="July", entity="nice") == [dog]
+    assert index.search(any="cat") == [cat]
+    assert index.search(object="horse") == []
+    with pytest.raises(ValueError):
+        index.search(colour="red")
+
+
+def test_reanalysis_replaces_the_postings_of_the_stage(tmp_path, store, index):
+    dog = make_album_file(tmp_path, "dog.jpg")
+    store.add(dog, "object_detection", {"objects": ["dog"]})
+    index.update(store)
+    store.add(dog, "object_detection", {"objects": ["horse"]})
+    index.update(store)
+
+    assert index.search(object="dog") == []
+    assert index.search(object="horse") == [dog]
+
+
+def test_update_catches_records_flushed_after_newer_ones(tmp_path, store, index):
+    early = make_album_file(tmp_path, "early.jpg")
+    late = make_album_file(tmp_path, "late.jpg")
+    # A second writer buffers its record first but flushes it last
+    other = ResultsStore(store.db_path, flush_seconds=3600)
+    try:
+        other.add(early, "object_detection", {"objects": ["dog"]})
+        store.add(late, "object_detection", {"objects": ["dog"]})
+        store.flush()
+        index.update(store)
+        other.flush()
+    finally:
+        other.close()
+
+    assert index.update(store) == 1
+    assert index.search(object="dog") == sorted([early, late])
+
+
+def test_removed_and_deleted_files_leave_the_index(tmp_path, store, index):
+    moved = make_album_file(tmp_path, "moved.jpg")
+    deleted = make_album_file(tmp_path, "deleted.jpg")
+    kept = make_album_file(tmp_path, "kept.jpg")
+    for path in (moved, deleted, kept):
+        store.add(path, "object_detection", {"objects": ["dog"]})
+    index.update(store)
+
+    index.remove_file(moved)
+    os.remove(deleted)
+
+    assert index.search(object="dog", limit=1) == [kept]
+    assert index.terms("object") == [("dog", 1)]
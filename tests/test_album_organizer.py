@@ -0,0 +1,197 @@
+import errno
+import json
+import os
+import shutil
+
+import pytest
+
+from agent_plugin import AlbumOrganizer as organizer_module
+from agent_plugin.AlbumOrganizer import AlbumOrganizer, album_folder
+
+
+def make_file(path, content=b"photo", mtime=1_600_000_000):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(content)
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+@pytest.fixture
+def folders(tmp_path):
+    source = tmp_path / "source"
+    album = tmp_path / "album"
+    source.mkdir()
+    return source, album, tmp_path / "organize_journal.jsonl"
+
+
+def archives(journal):
+    return list(journal.parent.glob(f"{journal.stem}.*.done"))
+
+
+def failing_move(monkeypatch, name, error):
+    """Makes shutil.move fail with {error} for the files called {name}."""
+    real_move = shutil.move
+
+    def move(src, dst):
+        if os.path.basename(src) == name:
+            raise error
+        return real_move(src, dst)
+
+    monkeypatch.setattr(organizer_module.shutil, "move", move)
+
+
+def test_plan_renames_collisions_and_skips_identical_files(folders):
+    source, album, journal = folders
+    make_file(source / "a.jpg", b"new")
+    make_file(source / "b.jpg", b"same")
+    make_file(source / "c.jpg")
+    year, month = album_folder(1_600_000_000)
+    make_file(album / year / month / "a.jpg", b"other")
+    make_file(album / year / month / "b.jpg", b"same")
+
+    moves, skipped = AlbumOrganizer(journal).plan(source, album, skip_names=["c.jpg"])
+
+    assert [os.path.basename(move["dst"]) for move in moves] == ["a (1).jpg"]
+    assert sorted(os.path.basename(path) for path, _ in skipped) == ["b.jpg", "c.jpg"]
+
+
+def test_apply_moves_files_and_archives_the_journal(folders):
+    source, album, journal = folders
+    for name in ("a.jpg", "b.jpg"):
+        make_file(source / name)
+    organizer = AlbumOrganizer(journal)
+    relocated = []
+
+    moved, failed = organizer.apply(organizer.plan(source, album)[0], lambda old, new: relocated.append(new))
+
+    assert (moved, failed) == (2, [])
+    assert len(relocated) == 2 and all(os.path.exists(path) for path in relocated)
+    assert not organizer.has_pending()
+    assert len(archives(journal)) == 1
+
+
+def test_nothing_to_move_leaves_no_archive(folders):
+    source, album, journal = folders
+    organizer = AlbumOrganizer(journal)
+
+    assert organizer.apply([]) == (0, [])
+    assert not organizer.has_pending()
+    assert archives(journal) == []
+
+
+def test_permanent_failure_is_journaled_and_the_journal_commits(folders):
+    source, album, journal = folders
+    make_file(source / "a.jpg")
+    make_file(source / "gone.jpg")
+    organizer = AlbumOrganizer(journal)
+    moves, _ = organizer.plan(source, album)
+    os.remove(source / "gone.jpg")
+
+    moved, failed = organizer.apply(moves)
+
+    assert moved == 1
+    assert [os.path.basename(path) for path, _ in failed] == ["gone.jpg"]
+    assert not organizer.has_pending()
+    # The next run is not blocked
+    assert organizer.apply(organizer.plan(source, album)[0]) == (0, [])
+
+
+def test_retryable_failure_keeps_the_journal_until_resumed(folders, monkeypatch):
+    source, album, journal = folders
+    make_file(source / "a.jpg")
+    make_file(source / "busy.jpg")
+    organizer = AlbumOrganizer(journal)
+    failing_move(monkeypatch, "busy.jpg", OSError(errno.ENOSPC, "No space left on device"))
+
+    moved, failed = organizer.apply(organizer.plan(source, album)[0])
+
+    assert moved == 1 and len(failed) == 1
+    assert organizer.has_pending()
+    with pytest.raises(RuntimeError, match="organize_journal.py skip"):
+        organizer.finish_pending()
+    with pytest.raises(RuntimeError, match="pending"):
+        organizer.begin()
+
+    monkeypatch.undo()
+    moved, failed = organizer.resume()
+    assert (moved, failed) == (1, [])
+    assert not organizer.has_pending()
+    assert not (source / "busy.jpg").exists()
+
+
+def test_skip_closes_a_journal_that_keeps_failing(folders, monkeypatch):
+    source, album, journal = folders
+    make_file(source / "busy.jpg")
+    organizer = AlbumOrganizer(journal)
+    failing_move(monkeypatch, "busy.jpg", OSError(errno.EBUSY, "Device or resource busy"))
+    organizer.apply(organizer.plan(source, album)[0])
+    assert organizer.has_pending()
+
+    assert organizer.skip() == 1
+    assert not organizer.has_pending()
+    assert (source / "busy.jpg").exists()
+    organizer.begin()
+    organizer.end()
+
+
+def test_rollback_moves_files_back(folders, monkeypatch):
+    source, album, journal = folders
+    make_file(source / "a.jpg")
+    make_file(source / "busy.jpg")
+    organizer = AlbumOrganizer(journal)
+    failing_move(monkeypatch, "busy.jpg", OSError(errno.EIO, "Input/output error"))
+    organizer.apply(organizer.plan(source, album)[0])
+    monkeypatch.undo()
+
+    assert organizer.rollback() == 1
+    assert (source / "a.jpg").exists() and (source / "busy.jpg").exists()
+    assert not organizer.has_pending()
+
+
+def test_session_commits_despite_a_permanent_failure(folders):
+    source, album, journal = folders
+    make_file(source / "a.jpg")
+    organizer = AlbumOrganizer(journal)
+    organizer.begin()
+
+    assert organizer.organize_one(str(source / "a.jpg"), "a.jpg", 1_600_000_000, album) is not None
+    with pytest.raises(FileNotFoundError):
+        organizer.organize_one(str(source / "gone.jpg"), "gone.jpg", 1_600_000_000, album)
+
+    assert organizer.end() is True
+    assert not organizer.has_pending()
+
+
+def write_journal(journal, records, torn=""):
+    journal.write_text("".join(json.dumps(record) + "\n" for record in records) + torn)
+
+
+def test_crashed_run_is_replayed_from_the_journal(folders):
+    source, album, journal = folders
+    year, month = album_folder(1_600_000_000)
+    target = album / year / month
+    moves = [{"op": "move", "id": index, "src": str(source / name), "dst": str(target / name)}
+             for index, name in enumerate(("done.jpg", "moved.jpg", "waiting.jpg"))]
+    # done.jpg was moved and journaled, moved.jpg was moved just before the crash, waiting.jpg was not moved
+    make_file(target / "done.jpg")
+    make_file(target / "moved.jpg")
+    make_file(source / "waiting.jpg")
+    write_journal(journal, moves + [{"op": "planned", "count": 3}, {"op": "done", "id": 0}], torn='{"op": "do')
+    relocated = []
+
+    AlbumOrganizer(journal).finish_pending(lambda old, new: relocated.append(os.path.basename(new)))
+
+    assert sorted(relocated) == ["moved.jpg", "waiting.jpg"]
+    assert sorted(path.name for path in target.iterdir()) == ["done.jpg", "moved.jpg", "waiting.jpg"]
+    assert list(source.iterdir()) == []
+    assert not journal.exists() and len(archives(journal)) == 1
+
+
+def test_crash_while_planning_moves_nothing(folders):
+    source, album, journal = folders
+    make_file(source / "a.jpg")
+    write_journal(journal, [{"op": "move", "id": 0, "src": str(source / "a.jpg"), "dst": str(album / "a.jpg")}])
+
+    assert AlbumOrganizer(journal).resume() == (0, [])
+    assert (source / "a.jpg").exists()
+    assert not journal.exists() and archives(journal) == []
@@ -0,0 +1,166 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+
+openai = pytest.importorskip("openai")
+httpx = pytest.importorskip("httpx")
+
+from agent_plugin import AsyncVisionEngine as engine_module  # noqa: E402
+from agent_plugin.AsyncVisionEngine import (AsyncVisionEngine, parse_structured_analysis,  # noqa: E402
+                                            retry_after_seconds)
+
+# The tests replace asyncio.sleep to record the retry delays; the fake service keeps the real one
+real_sleep = asyncio.sleep
+SUMMARY = {"summary": ["A dog on a beach"], "tags": ["dog", "beach"], "named_entities": []}
+STRUCTURED_PROMPT = "Return the summary, tags and named entities"
+
+
+class FakePreprocessor:
+    def encode(self, image_path, detail_level=None):
+        return "aGVsbG8=", "image/jpeg"
+
+
+def completion(content):
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))], usage=None)
+
+
+def rate_limit_error(headers):
+    request = httpx.Request("POST", "https://example.openai.azure.com/openai/deployments/gpt/chat/completions")
+    response = httpx.Response(429, headers=headers, request=request)
+    return openai.RateLimitError("Too Many Requests", response=response, body=None)
+
+
+class FakeClient:
+    """
+    Answers the detect calls with an object list, the summary calls with SUMMARY and the single-pass calls with
+    {structured}, after {failures} errors.
+    """
+
+    def __init__(self, failures=(), structured=None):
+        self.failures = list(failures)
+        self.structured = structured
+        self.calls = 0
+        self.prompts = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    async def create(self, model, messages, **request):
+        self.calls += 1
+        system = messages[0]["content"]
+        self.prompts.append(system[0]["text"] if isinstance(system, list) else system)
+        if self.failures:
+            raise self.failures.pop(0)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await real_sleep(0.01)
+        finally:
+            self.in_flight -= 1
+        if self.prompts[-1] == STRUCTURED_PROMPT:
+            return completion(self.structured)
+        if isinstance(messages[-1]["content"], list):
+            return completion(json.dumps({"objects": ["dog"]}))
+        return completion(json.dumps(SUMMARY))
+
+
+def make_engine(client, **kwargs):
+    return AsyncVisionEngine(client, "gpt", "Describe the image", "Summarize", preprocessor=FakePreprocessor(),
+                             **kwargs)
+
+
+def test_retry_after_headers():
+    def error(headers):
+        return SimpleNamespace(response=SimpleNamespace(headers=headers))
+
+    assert retry_after_seconds(error({"retry-after-ms": "250"})) == 0.25
+    assert retry_after_seconds(error({"retry-after": "3"})) == 3.0
+    assert retry_after_seconds(error({"retry-after": "Wed, 21 Oct 2026 07:28:00 GMT"})) is None
+    assert retry_after_seconds(error({})) is None
+    assert retry_after_seconds(SimpleNamespace()) is None
+
+
+def test_throttled_requests_wait_for_retry_after(monkeypatch):
+    delays = []
+
+    async def fake_sleep(delay):
+        delays.append(delay)
+        await real_sleep(0)
+
+    monkeypatch.setattr(engine_module.asyncio, "sleep", fake_sleep)
+    client = FakeClient([rate_limit_error({"retry-after-ms": "1500"}), rate_limit_error({"retry-after": "2"})])
+    engine = make_engine(client)
+
+    result = asyncio.run(engine.analyze("dog.jpg"))
+
+    assert result["error"] is None
+    assert result["tags"] == SUMMARY["tags"]
+    assert engine.retries == 2
+    # Only the retries sleep; the service's delays are used as they are, without jitter
+    assert delays == [1.5, 2.0]
+
+
+def test_retries_give_up_after_max_retries(monkeypatch):
+    async def no_sleep(delay):
+        pass
+
+    monkeypatch.setattr(engine_module.asyncio, "sleep", no_sleep)
+    client = FakeClient([rate_limit_error({}) for _ in range(3)])
+    engine = make_engine(client, max_retries=2)
+
+    result = asyncio.run(engine.analyze("dog.jpg"))
+
+    assert isinstance(result["error"], openai.RateLimitError)
+    assert client.calls == 3
+    assert engine.retries == 2
+
+
+def test_in_flight_images_are_bounded():
+    client = FakeClient()
+    engine = make_engine(client, max_concurrency=3)
+
+    async def run():
+        return [result async for result in engine.analyze_all([f"{index}.jpg" for index in range(10)])]
+
+    results = asyncio.run(run())
+
+    assert sorted(result["image"] for result in results) == sorted(f"{index}.jpg" for index in range(10))
+    assert all(result["error"] is None for result in results)
+    assert client.max_in_flight == 3
+
+
+def test_parse_structured_analysis():
+    assert parse_structured_analysis(json.dumps(SUMMARY)) == SUMMARY
+    # A single string is accepted as a one-item list, and named_entities may be left out
+    assert parse_structured_analysis(json.dumps({"summary": "A dog", "tags": ["dog"]})) == \
+        {"summary": ["A dog"], "tags": ["dog"], "named_entities": []}
+    assert parse_structured_analysis("not json") is None
+    assert parse_structured_analysis(None) is None
+    assert parse_structured_analysis(json.dumps(["A dog"])) is None
+    assert parse_structured_analysis(json.dumps({"summary": ["A dog"], "tags": []})) is None
+    assert parse_structured_analysis(json.dumps({"summary": ["A dog"], "tags": [1, 2]})) is None
+
+
+def test_single_pass_needs_one_call_per_image():
+    client = FakeClient(structured=json.dumps(SUMMARY))
+    engine = make_engine(client, prompt_structured=STRUCTURED_PROMPT)
+
+    result = asyncio.run(engine.analyze("dog.jpg"))
+
+    assert result["summary"] == SUMMARY["summary"]
+    assert client.prompts == [STRUCTURED_PROMPT]
+    assert engine.single_pass_fallbacks == 0
+
+
+def test_single_pass_falls_back_to_two_steps_on_an_invalid_response():
+    client = FakeClient(structured=json.dumps({"summary": ["A dog"]}))
+    engine = make_engine(client, prompt_structured=STRUCTURED_PROMPT)
+
+    result = asyncio.run(engine.analyze("dog.jpg"))
+
+    assert result["error"] is None
+    assert result["tags"] == SUMMARY["tags"]
+    assert client.prompts == [STRUCTURED_PROMPT, "Describe the image", "Summarize"]
+    assert engine.single_pass_fallbacks == 1
@@ -0,0 +1,127 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from agent_plugin.VisionBatchJobs import BatchJobTracker, VisionBatchJobs, cancel_jobs, recover_submissions
+
+
+@pytest.fixture
+def tracker(tmp_path):
+    tracker = BatchJobTracker(tmp_path / "jobs.db")
+    yield tracker
+    tracker.close()
+
+
+class FakeBatches:
+    """The batches API of the client, over {batches} listed newest first."""
+
+    def __init__(self, batches):
+        self.batches = batches
+        self.cancelled = []
+
+    async def list(self, limit=20):
+        for batch in self.batches:
+            yield batch
+
+    async def cancel(self, batch_id):
+        self.cancelled.append(batch_id)
+        return SimpleNamespace(id=batch_id, status="cancelling", output_file_id=None, error_file_id=None)
+
+
+def fake_client(*batches):
+    return SimpleNamespace(batches=FakeBatches(list(batches)))
+
+
+def batch(batch_id, input_file_id, created_at, status="validating"):
+    return SimpleNamespace(id=batch_id, input_file_id=input_file_id, created_at=created_at, status=status)
+
+
+def statuses(tracker):
+    return {(row["id"], row["status"], row["job_id"]) for status in ("queued", "submitted", "done", "failed", "merged")
+            for row in tracker.requests(status)}
+
+
+def test_request_and_job_lifecycle(tracker, tmp_path):
+    first = tracker.add_request("/album/a.jpg", "detect", "low")
+    second = tracker.add_request("/album/b.jpg", "detect", "high")
+    third = tracker.add_request("/album/c.jpg", "detect", "low")
+
+    tracker.add_job("detect", tmp_path / "detect.jsonl", "file-1", [first, second, third])
+    assert [job["status"] for job in tracker.submitting_jobs()] == ["submitting"]
+    # A job is only polled once its batch exists
+    assert tracker.open_jobs() == []
+
+    tracker.start_job("file-1", "batch-1", "validating")
+    assert [(job["id"], job["input_file_id"]) for job in tracker.open_jobs()] == [("batch-1", "file-1")]
+    assert statuses(tracker) == {(first, "submitted", "batch-1"), (second, "submitted", "batch-1"),
+                                 (third, "submitted", "batch-1")}
+
+    tracker.update_job("batch-1", "completed", "out-1")
+    tracker.collect_job("batch-1", {first: "a description"}, {second: "400 content_filter: blocked"})
+    assert tracker.open_jobs() == []
+    assert tracker.latest("/album/c.jpg")["error"] == "batch job completed"
+    assert tracker.counts() == {("detect", "done"): 1, ("detect", "failed"): 2}
+
+    summary = tracker.follow_up(first, "summary", "a description")
+    tracker.mark_merged([second, summary])
+    assert tracker.latest("/album/a.jpg")["id"] == summary
+    assert tracker.counts() == {("detect", "merged"): 2, ("detect", "failed"): 1, ("summary", "queued"): 1}
+
+
+def test_recovery_adopts_created_batches_and_requeues_the_others(tracker, tmp_path):
+    created = tracker.add_request("/album/a.jpg", "detect", "low")
+    lost = tracker.add_request("/album/b.jpg", "summary", "low", "text")
+    (tmp_path / "lost.jsonl").write_text("{}\n")
+    tracker.add_job("detect", tmp_path / "created.jsonl", "file-1", [created])
+    tracker.add_job("summary", tmp_path / "lost.jsonl", "file-2", [lost])
+    now = tracker.submitting_jobs()[0]["created_at"]
+    client = fake_client(batch("batch-9", "file-9", now + 5), batch("batch-1", "file-1", now),
+                         batch("batch-0", "file-0", now - 7200))
+
+    asyncio.run(recover_submissions(client, tracker))
+
+    assert tracker.submitting_jobs() == []
+    assert [job["id"] for job in tracker.open_jobs()] == ["batch-1"]
+    assert statuses(tracker) == {(created, "submitted", "batch-1"), (lost, "queued", None)}
+    assert not (tmp_path / "lost.jsonl").exists()
+
+
+def test_cancel_needs_only_the_client_and_the_tracker(tracker, tmp_path):
+    request = tracker.add_request("/album/a.jpg", "detect", "low")
+    tracker.add_job("detect", tmp_path / "detect.jsonl", "file-1", [request])
+    now = tracker.submitting_jobs()[0]["created_at"]
+    client = fake_client(batch("batch-1", "file-1", now))
+
+    assert asyncio.run(cancel_jobs(client, tracker)) == 1
+    assert client.batches.cancelled == ["batch-1"]
+    assert tracker.jobs()[0]["status"] == "cancelling"
+
+
+def test_results_stay_unmerged_until_the_caller_saved_them(tmp_path):
+    def collect(jobs, detail_levels):
+        async def run():
+            return [result async for result in jobs.run(detail_levels)]
+        return asyncio.run(run())
+
+    jobs = VisionBatchJobs(fake_client(), "batch-deployment", None, tmp_path)
+    request = jobs.tracker.add_request("/album/a.jpg", "summary", "low", "a description")
+    jobs.tracker.add_job("summary", tmp_path / "summary.jsonl", "file-1", [request])
+    jobs.tracker.start_job("file-1", "batch-1", "completed")
+    summary = {"summary": ["a dog"], "tags": ["dog"], "named_entities": []}
+    jobs.tracker.collect_job("batch-1", {request: json.dumps(summary)}, {})
+
+    results = collect(jobs, {"/album/a.jpg": "low"})
+    assert [(result["request_id"], result["tags"], result["error"]) for result in results] == [(request, ["dog"], None)]
+    # Handed over once per run, and kept 'done' until merged
+    assert collect(jobs, {"/album/a.jpg": "low"}) == []
+    assert jobs.tracker.latest("/album/a.jpg")["status"] == "done"
+    jobs.close()
+
+    # A run that stopped before saving hands the result over again
+    jobs = VisionBatchJobs(fake_client(), "batch-deployment", None, tmp_path)
+    assert [result["request_id"] for result in collect(jobs, {"/album/a.jpg": "low"})] == [request]
+    jobs.mark_merged([request])
+    assert jobs.tracker.latest("/album/a.jpg")["status"] == "merged"
+    jobs.close()
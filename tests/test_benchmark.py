@@ -0,0 +1,86 @@
+import json
+import urllib.error
+import urllib.request
+
+import pytest
+
+from agent_plugin.StageResults import DetectionResult, OrganizeResult, ValidationResult
+from benchmark import compare_to_baseline, stage_files
+from benchmarks.Measurements import StageTimer, latency_summary, percentile
+from benchmarks.MockAzureOpenAI import MockAzureOpenAI, canned_analysis
+
+CHAT_PATH = "/openai/deployments/mock-gpt-4o/chat/completions?api-version=2024-10-21"
+
+
+def post(endpoint, path, payload):
+    request = urllib.request.Request(endpoint + path, data=json.dumps(payload).encode("utf-8"),
+                                     headers={"Content-Type": "application/json"}, method="POST")
+    with urllib.request.urlopen(request, timeout=10) as response:
+        return response.status, json.loads(response.read())
+
+
+def row(files_per_second, p99_ms, peak_rss_mb):
+    return {"files": 100, "seconds": 1.0, "files_per_second": files_per_second,
+            "latency": {"p99_ms": p99_ms} if p99_ms is not None else None, "peak_rss_mb": peak_rss_mb}
+
+
+def test_percentiles_by_nearest_rank():
+    values = [0.005, 0.001, 0.003, 0.002, 0.004]
+    assert percentile(values, 0.5) == 0.003
+    assert percentile(values, 0.99) == 0.005
+    assert percentile([], 0.5) is None
+    assert latency_summary(values) == {"count": 5, "p50_ms": 3.0, "p99_ms": 5.0, "max_ms": 5.0}
+    assert latency_summary([]) == {"count": 0, "p50_ms": None, "p99_ms": None, "max_ms": None}
+
+
+def test_stage_timer_measures_the_block():
+    with StageTimer(interval=0.005) as timer:
+        data = bytearray(8 * 2 ** 20)
+    assert timer.seconds > 0
+    assert timer.peak > len(data)
+
+
+def test_stage_files_of_each_result():
+    assert stage_files(ValidationResult("source", "defective", processed=7)) == 7
+    assert stage_files(OrganizeResult("source", "album", organized=5, unprocessed=("a.jpg", "b.jpg"))) == 7
+    assert stage_files(DetectionResult("album", images=4, videos=2)) == 6
+
+
+def test_compare_to_baseline_flags_only_large_regressions():
+    baseline = {"stages": {"metadata": row(100.0, 10.0, 200.0), "expert": row(10.0, 900.0, 300.0)}}
+    report = {"stages": {"metadata": row(85.0, 11.0, 210.0), "expert": row(10.0, 1200.0, 300.0),
+                         "content": row(5.0, None, 900.0)}}
+
+    assert compare_to_baseline(report, baseline, 0.2) == ["expert p99 ms: 900.0 -> 1200.0 (+33%)"]
+    assert compare_to_baseline(report, baseline, 0.1) == ["metadata files/s: 100.0 -> 85.0 (+15%)",
+                                                          "expert p99 ms: 900.0 -> 1200.0 (+33%)"]
+
+
+def test_mock_answers_chat_completions_deterministically():
+    payload = {"messages": [{"role": "user", "content": "Image: ..."}]}
+    with MockAzureOpenAI(latency_ms=1, jitter_ms=0) as mock:
+        status, first = post(mock.endpoint, CHAT_PATH, payload)
+        _, second = post(mock.endpoint, CHAT_PATH, payload)
+        stats = mock.stats()
+
+    assert status == 200
+    content = first["choices"][0]["message"]["content"]
+    assert content == second["choices"][0]["message"]["content"]
+    assert content == canned_analysis(json.dumps(payload).encode("utf-8"))
+    assert set(json.loads(content)) == {"summary", "tags", "named_entities"}
+    assert stats["requests"] == 2 and stats["throttled"] == 0 and stats["latency"]["count"] == 2
+
+
+def test_mock_throttles_with_retry_after():
+    with MockAzureOpenAI(throttle_rate=1.0, retry_after_ms=1500) as mock:
+        with pytest.raises(urllib.error.HTTPError) as error:
+            post(mock.endpoint, CHAT_PATH, {"messages": []})
+        with pytest.raises(urllib.error.HTTPError) as missing:
+            post(mock.endpoint, "/openai/batches", {"input_file_id": "file-unknown"})
+        stats = mock.stats()
+
+    assert error.value.code == 429
+    assert error.value.headers["retry-after-ms"] == "1500"
+    assert error.value.headers["retry-after"] == "2"
+    assert missing.value.code == 400
+    assert stats["throttled"] == 1
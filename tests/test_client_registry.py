@@ -0,0 +1,49 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("openai")
+pytest.importorskip("httpx")
+
+from agent_plugin import ClientRegistry  # noqa: E402
+from agent_plugin.ClientRegistry import close_clients, get_openai_client  # noqa: E402
+
+ENDPOINT = "https://example.openai.azure.com"
+
+
+@pytest.fixture(autouse=True)
+def registry(monkeypatch):
+    # No .env file is read, and every test starts without pooled clients
+    monkeypatch.setattr(ClientRegistry, "_environment_loaded", True)
+    asyncio.run(close_clients())
+    yield
+    asyncio.run(close_clients())
+
+
+def test_clients_are_shared_per_endpoint_key_and_version():
+    first = get_openai_client(ENDPOINT, "key", "2024-10-21")
+
+    assert get_openai_client(ENDPOINT, "key", "2024-10-21") is first
+    assert get_openai_client(ENDPOINT, "key", "2025-01-01") is not first
+    assert get_openai_client(ENDPOINT, "key", "2024-10-21", max_retries=0) is not first
+    # Every client of the endpoint goes through one connection pool
+    assert list(ClientRegistry._http_clients) == [ENDPOINT]
+
+
+def test_arguments_default_to_the_environment(monkeypatch):
+    monkeypatch.setenv("AZURE_OPENAI_ENDPOINT", ENDPOINT)
+    monkeypatch.setenv("AZURE_OPENAI_API_KEY", "key")
+    monkeypatch.setenv("AZURE_OPENAI_API_VERSION", "2024-10-21")
+
+    assert get_openai_client() is get_openai_client(ENDPOINT, "key", "2024-10-21")
+
+
+def test_close_clients_closes_the_pools():
+    client = get_openai_client(ENDPOINT, "key", "2024-10-21")
+    (http_client,) = ClientRegistry._http_clients.values()
+
+    asyncio.run(close_clients())
+
+    assert http_client.is_closed
+    assert ClientRegistry._http_clients == {}
+    assert get_openai_client(ENDPOINT, "key", "2024-10-21") is not client
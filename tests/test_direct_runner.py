@@ -0,0 +1,80 @@
+import argparse
+import asyncio
+import dataclasses
+
+import pytest
+
+import process_media
+from agent_plugin.StageResults import DetectionResult, OrganizeResult, ValidationResult
+
+
+class FakePlugins:
+    """Stands in for the stage plugins and records the folder each stage was given."""
+
+    def __init__(self, album_dir, failing=None):
+        self.album_dir = album_dir
+        self.failing = failing
+        self.calls = []
+
+    def load(self, stage):
+        if stage == self.failing:
+            raise RuntimeError(f"{stage} failed")
+        return self
+
+    def validate_folder(self, source_dir):
+        self.calls.append(("validate", source_dir))
+        return ValidationResult(source_dir, "defective", processed=3)
+
+    def organize_folder(self, source_dir):
+        self.calls.append(("metadata", source_dir))
+        return OrganizeResult(source_dir, self.album_dir, organized=2, unprocessed=("c.jpg",))
+
+    def detect_folder(self, album_dir):
+        self.calls.append(("content", album_dir))
+        return DetectionResult(album_dir, images=2, with_objects=1)
+
+
+def test_stages_run_in_order_and_chain_their_results(monkeypatch, capsys):
+    plugins = FakePlugins("/photos/organized")
+    monkeypatch.setattr(process_media, "load_plugin", plugins.load)
+
+    results = asyncio.run(process_media.run_direct("/photos/sample/source", ["validate", "metadata", "dispatcher",
+                                                                             "content"]))
+
+    assert list(results) == ["validate", "metadata", "content"]
+    # Object detection runs on the album reported by the metadata stage, not on the default one
+    assert plugins.calls == [("validate", "/photos/sample/source"), ("metadata", "/photos/sample/source"),
+                             ("content", "/photos/organized")]
+    assert results["content"] == DetectionResult("/photos/organized", images=2, with_objects=1)
+    assert "Direct mode has no dispatcher" in capsys.readouterr().out
+
+
+def test_without_the_metadata_stage_the_default_album_is_used(monkeypatch):
+    plugins = FakePlugins("/photos/organized")
+    monkeypatch.setattr(process_media, "load_plugin", plugins.load)
+
+    asyncio.run(process_media.run_direct("/photos/sample/source", ["content"]))
+
+    assert plugins.calls == [("content", "/photos/sample/album")]
+
+
+def test_a_failing_stage_stops_the_run(monkeypatch):
+    plugins = FakePlugins("/photos/organized", failing="metadata")
+    monkeypatch.setattr(process_media, "load_plugin", plugins.load)
+
+    with pytest.raises(RuntimeError, match="metadata failed"):
+        asyncio.run(process_media.run_direct("/photos/sample/source", ["validate", "metadata", "content"]))
+    assert [stage for stage, _ in plugins.calls] == ["validate"]
+
+
+def test_parse_stages_keeps_the_pipeline_order():
+    assert process_media.parse_stages("content, validate") == ["validate", "content"]
+    with pytest.raises(argparse.ArgumentTypeError, match="Unknown stage"):
+        process_media.parse_stages("validate,upload")
+
+
+def test_stage_results_are_immutable():
+    result = OrganizeResult("source", "album", organized=1)
+    with pytest.raises(dataclasses.FrozenInstanceError):
+        result.organized = 2
+    assert result.unprocessed == ()
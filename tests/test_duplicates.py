@@ -0,0 +1,111 @@
+import os
+
+import pytest
+
+from agent_plugin.DuplicateAnalystPlugin import DuplicateAnalystPlugin
+from agent_plugin.MediaCatalog import reset_catalogs
+from agent_plugin.MediaManifest import MediaManifest, get_manifest
+from agent_plugin.PerceptualHash import BKTree, hamming
+
+STAGE = DuplicateAnalystPlugin.STAGE
+VERSION = DuplicateAnalystPlugin.STAGE_VERSION
+
+
+def test_hamming_counts_the_differing_bits():
+    assert hamming(0, 0) == 0
+    assert hamming(0b1011, 0b0001) == 2
+    assert hamming(0, 2**64 - 1) == 64
+
+
+def test_bk_tree_finds_every_hash_within_the_distance_closest_first():
+    tree = BKTree()
+    hashes = {"zero": 0, "one": 0b1, "three": 0b111, "far": 2**64 - 1, "near_far": 2**64 - 2}
+    for name, hash_value in hashes.items():
+        tree.add(hash_value, name)
+
+    assert tree.size == 5
+    assert tree.search(0, 2) == [(0, "zero"), (1, "one")]
+    assert sorted(tree.search(0b11, 1)) == [(1, "one"), (1, "three")]
+    assert tree.search(2**64 - 1, 1) == [(0, "far"), (1, "near_far")]
+    assert BKTree().search(0, 64) == []
+
+
+def test_phash_of_a_copy_is_identical_and_of_another_picture_far(tmp_path):
+    pytest.importorskip("numpy")
+    image_module = pytest.importorskip("PIL.Image")
+    from agent_plugin.PerceptualHash import phash
+
+    def picture(path, flip):
+        image = image_module.new("L", (64, 64))
+        image.putdata([(x * 4 if (x < 32) != flip else 255 - y * 4) for y in range(64) for x in range(64)])
+        image.save(path)
+        return phash(path)
+
+    assert picture(tmp_path / "a.png", False) == picture(tmp_path / "b.png", False)
+    assert hamming(picture(tmp_path / "a.png", False), picture(tmp_path / "c.png", True)) > 8
+
+
+@pytest.fixture
+def sample(tmp_path, monkeypatch):
+    monkeypatch.setenv("MEDIA_STATE_DIR", str(tmp_path / "state"))
+    monkeypatch.delenv("MEDIA_MANIFEST_PATH", raising=False)
+    sample_dir = tmp_path / "sample_media"
+    (sample_dir / "source").mkdir(parents=True)
+    (sample_dir / "album" / "2021" / "july").mkdir(parents=True)
+    reset_catalogs()
+    yield sample_dir
+    reset_catalogs()
+
+
+def add_image(path, content, hash_value, manifest):
+    """Writes an image whose perceptual hash is already in the {manifest}, so it is never decoded."""
+    path.write_bytes(content)
+    manifest.record(str(path), STAGE, VERSION, {"phash": f"{hash_value:016x}"})
+
+
+def test_album_matches_are_kept_and_restored_without_matching_again(sample, monkeypatch):
+    manifest = get_manifest(sample)
+    album = sample / "album" / "2021" / "july"
+    add_image(album / "a.jpg", b"a" * 300, 0b0, manifest)
+    add_image(album / "b.jpg", b"b" * 200, 0b11, manifest)
+    add_image(sample / "source" / "c.jpg", b"c" * 100, 0b111, manifest)
+    add_image(sample / "source" / "d.jpg", b"d" * 100, 2**64 - 1, manifest)
+    plugin = DuplicateAnalystPlugin()
+
+    result = plugin.find_duplicates(str(sample / "source"))
+
+    assert (result.images, result.duplicates, result.groups) == (4, 2, 2)
+    b_record = manifest.get_result(str(album / "b.jpg"), STAGE, VERSION)
+    assert b_record["duplicate_of"] == manifest.fingerprint(str(album / "a.jpg"))
+    assert manifest.get_result(str(album / "a.jpg"), STAGE, VERSION)["duplicate_of"] is None
+
+    # The next run reads the album outcome in one query and only looks up the new images
+    reset_catalogs()
+    looked_up = []
+    get_result = MediaManifest.get_result
+
+    def spy(self, file_path, stage, version):
+        looked_up.append(os.path.basename(getattr(file_path, "path", file_path)))
+        return get_result(self, file_path, stage, version)
+
+    monkeypatch.setattr(MediaManifest, "get_result", spy)
+    result = plugin.find_duplicates(str(sample / "source"))
+
+    assert (result.images, result.duplicates, result.groups) == (4, 2, 2)
+    assert sorted(looked_up) == ["c.jpg", "d.jpg"]
+
+
+def test_duplicates_of_a_removed_representative_are_matched_again(sample):
+    manifest = get_manifest(sample)
+    album = sample / "album" / "2021" / "july"
+    add_image(album / "a.jpg", b"a" * 300, 0b0, manifest)
+    add_image(album / "b.jpg", b"b" * 200, 0b11, manifest)
+    plugin = DuplicateAnalystPlugin()
+    plugin.find_duplicates(str(sample / "source"))
+
+    os.remove(album / "a.jpg")
+    reset_catalogs()
+    result = plugin.find_duplicates(str(sample / "source"))
+
+    assert (result.images, result.duplicates, result.groups) == (1, 0, 1)
+    assert manifest.get_result(str(album / "b.jpg"), STAGE, VERSION)["duplicate_of"] is None
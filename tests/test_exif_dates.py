@@ -0,0 +1,114 @@
+import struct
+import threading
+
+from agent_plugin.ExifDateReader import read_original_date
+from agent_plugin.WorkerPool import map_unordered
+
+DATE = "2021:06:01 12:30:45"
+
+
+def tiff(endian="<", date=DATE):
+    """Returns a TIFF structure whose Exif IFD holds DateTimeOriginal = {date}."""
+    value = date.encode("ascii") + b"\x00"
+    header = (b"II" if endian == "<" else b"MM") + struct.pack(endian + "HI", 42, 8)
+    # IFD0 at 8 points to the Exif IFD at 26, whose date is stored at 44
+    ifd0 = struct.pack(endian + "HHHII", 1, 0x8769, 4, 1, 26) + struct.pack(endian + "I", 0)
+    exif_ifd = struct.pack(endian + "HHHII", 1, 0x9003, 2, len(value), 44) + struct.pack(endian + "I", 0)
+    return header + ifd0 + exif_ifd + value
+
+
+def jpeg(exif=None):
+    data = b"\xff\xd8" + b"\xff\xe0" + struct.pack(">H", 16) + b"JFIF\x00" + b"\x00" * 9
+    if exif is not None:
+        data += b"\xff\xe1" + struct.pack(">H", 2 + 6 + len(exif)) + b"Exif\x00\x00" + exif
+    return data + b"\xff\xda" + struct.pack(">H", 8) + b"\x00" * 6 + b"\xff\xd9"
+
+
+def png_chunk(chunk_type, data):
+    return struct.pack(">I", len(data)) + chunk_type + data + b"\x00" * 4
+
+
+def png(exif):
+    return (b"\x89PNG\r\n\x1a\n" + png_chunk(b"IHDR", b"\x00" * 13) + png_chunk(b"eXIf", exif)
+            + png_chunk(b"IDAT", b"\x00" * 10) + png_chunk(b"IEND", b""))
+
+
+def write(tmp_path, name, data):
+    path = tmp_path / name
+    path.write_bytes(data)
+    return str(path)
+
+
+def test_dates_from_jpeg_png_and_tiff_headers(tmp_path):
+    assert read_original_date(write(tmp_path, "a.jpg", jpeg(tiff()))) == (True, DATE)
+    assert read_original_date(write(tmp_path, "b.jpg", jpeg(tiff(">")))) == (True, DATE)
+    assert read_original_date(write(tmp_path, "c.png", png(tiff()))) == (True, DATE)
+    assert read_original_date(write(tmp_path, "d.tif", tiff(">"))) == (True, DATE)
+
+
+def test_headers_without_a_date(tmp_path):
+    assert read_original_date(write(tmp_path, "a.jpg", jpeg())) == (False, None)
+    # An Exif segment without the Exif IFD has EXIF but no capture date
+    no_exif_ifd = b"II" + struct.pack("<HI", 42, 8) + struct.pack("<HI", 0, 0)
+    assert read_original_date(write(tmp_path, "b.jpg", jpeg(no_exif_ifd))) == (True, None)
+
+
+def test_only_the_header_is_read(tmp_path, monkeypatch):
+    # Megabytes of image data after the start of scan are never read
+    path = write(tmp_path, "a.jpg", jpeg(tiff()) + b"\x00" * (4 * 2 ** 20))
+    reads = []
+    original_open = open
+
+    class CountingFile:
+        def __init__(self, file):
+            self.file = file
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            self.file.close()
+
+        def seek(self, offset):
+            self.file.seek(offset)
+
+        def read(self, size):
+            data = self.file.read(size)
+            reads.append(len(data))
+            return data
+
+    monkeypatch.setattr("builtins.open", lambda file, mode="r": CountingFile(original_open(file, mode)))
+    assert read_original_date(path) == (True, DATE)
+    monkeypatch.undo()
+    assert sum(reads) < 1024
+
+
+def test_map_unordered_yields_results_and_errors():
+    def square(value):
+        if value == 3:
+            raise ValueError("three")
+        return value * value
+
+    results = {item: (result, error) for item, result, error in map_unordered(square, range(6), max_workers=2)}
+
+    assert {item: result for item, (result, _) in results.items() if item != 3} == {0: 0, 1: 1, 2: 4, 4: 16, 5: 25}
+    assert isinstance(results[3][1], ValueError)
+
+
+def test_map_unordered_bounds_the_queued_calls():
+    submitted = []
+    lock = threading.Lock()
+
+    def items():
+        for index in range(100):
+            with lock:
+                submitted.append(index)
+            yield index
+
+    consumed = 0
+    for _ in map_unordered(lambda value: value, items(), max_workers=2, window=3):
+        consumed += 1
+        with lock:
+            # At most window x max_workers calls are ahead of the consumer
+            assert len(submitted) - consumed <= 6
+    assert consumed == 100
@@ -0,0 +1,114 @@
+import asyncio
+import os
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from agent_plugin.FolderWatcher import FolderWatcher
+
+
+def touched(watcher, path):
+    watcher._touch(str(path))
+    return str(path)
+
+
+def test_a_file_is_reported_once_it_stops_changing(tmp_path):
+    watcher = FolderWatcher(tmp_path, debounce=0)
+    upload = tmp_path / "upload.jpg"
+    upload.write_bytes(b"first half")
+    path = touched(watcher, upload)
+
+    assert watcher.settled() == []  # first check only records the size
+    with upload.open("ab") as file:
+        file.write(b" and the second half")
+    assert watcher.settled() == []  # still growing
+    assert watcher.settled() == [path]
+    assert watcher.idle and watcher.settled() == []
+
+
+def test_events_within_the_debounce_delay_postpone_the_check(tmp_path):
+    watcher = FolderWatcher(tmp_path, debounce=0.2)
+    (tmp_path / "a.jpg").write_bytes(b"data")
+    path = touched(watcher, tmp_path / "a.jpg")
+
+    assert watcher.settled() == [] and watcher._pending[path][1] is None
+    time.sleep(0.25)
+    watcher._touch(path)  # written again: the delay starts over
+    assert watcher.settled() == [] and watcher._pending[path][1] is None
+    time.sleep(0.25)
+    assert watcher.settled() == []
+    assert watcher.settled() == [path]
+
+
+def test_hidden_partial_and_nested_files_are_ignored(tmp_path):
+    watcher = FolderWatcher(tmp_path, debounce=0)
+    for name in (".DS_Store", "movie.mp4.part", "photo.jpg.crdownload", "notes~"):
+        touched(watcher, tmp_path / name)
+    touched(watcher, tmp_path / "album" / "a.jpg")
+
+    assert watcher.idle
+
+
+def test_files_are_reported_again_only_when_changed(tmp_path):
+    watcher = FolderWatcher(tmp_path, debounce=0)
+    photo = tmp_path / "photo.jpg"
+    photo.write_bytes(b"v1")
+    listed = tmp_path / "listed.jpg"
+    listed.write_bytes(b"listed")
+    stat = listed.stat()
+    watcher.mark_reported([SimpleNamespace(path=str(listed), size=stat.st_size, mtime_ns=stat.st_mtime_ns)])
+
+    def settle(*paths):
+        for path in paths:
+            touched(watcher, path)
+        return watcher.settled() + watcher.settled()
+
+    assert settle(photo, listed) == [str(photo)]
+    assert settle(photo) == []  # touched without changes
+    photo.write_bytes(b"version 2")
+    assert settle(photo) == [str(photo)]
+
+
+def test_moved_and_deleted_files_are_forgotten(tmp_path):
+    watcher = FolderWatcher(tmp_path, debounce=0)
+    moved = touched(watcher, tmp_path / "moved.jpg")
+    touched(watcher, tmp_path / "deleted.jpg")
+
+    watcher._forget(moved)
+    assert list(watcher._pending) == [str(tmp_path / "deleted.jpg")]
+    assert watcher.settled() == [] and watcher.idle  # the file is gone
+
+
+def test_arrivals_until_stopped(tmp_path):
+    watcher = FolderWatcher(tmp_path, debounce=0, tick=0.01)
+    (tmp_path / "a.jpg").write_bytes(b"data")
+    touched(watcher, tmp_path / "a.jpg")
+
+    async def collect():
+        stop_event = asyncio.Event()
+        arrivals = []
+        async for paths in watcher.arrivals(stop_event):
+            arrivals.extend(paths)
+            if arrivals:
+                stop_event.set()
+        return arrivals
+
+    assert asyncio.run(asyncio.wait_for(collect(), 5)) == [str(tmp_path / "a.jpg")]
+
+
+def test_polling_observer_reports_new_files(tmp_path):
+    pytest.importorskip("watchdog")
+    watcher = FolderWatcher(tmp_path, debounce=0.1, polling=True).start()
+    try:
+        (tmp_path / "new.jpg").write_bytes(b"data")
+        (tmp_path / "new.mov.part").write_bytes(b"data")
+        reported = []
+        deadline = time.monotonic() + 10
+        while not reported and time.monotonic() < deadline:
+            time.sleep(0.1)
+            reported = watcher.settled()
+    finally:
+        watcher.stop()
+
+    assert reported == [os.path.join(watcher.folder, "new.jpg")]
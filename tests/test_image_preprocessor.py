@@ -0,0 +1,57 @@
+import os
+
+from agent_plugin.ImagePreprocessor import ImagePreprocessor, target_size
+
+
+def fake_render(self, image_path, detail_level):
+    return b"j" * 400
+
+
+def test_target_size_by_detail_level():
+    assert target_size(4000, 3000, "low") == (512, 384)
+    assert target_size(4000, 3000, "high") == (1024, 768)
+    assert target_size(300, 200, "high") == (300, 200)
+
+
+def test_least_recently_used_derivatives_are_evicted(tmp_path, monkeypatch):
+    monkeypatch.setattr(ImagePreprocessor, "_ImagePreprocessor__render", fake_render)
+    cache_dir = tmp_path / "vision_cache"
+    cache_dir.mkdir()
+    (cache_dir / "responses.db").write_bytes(b"r" * 5000)
+    images = []
+    for name in ("a", "b", "c"):
+        image = tmp_path / f"{name}.jpg"
+        image.write_bytes(name.encode() * 10)
+        images.append(image)
+    preprocessor = ImagePreprocessor(cache_dir, max_bytes=1000)
+
+    preprocessor.prepare(images[0])
+    (a_derivative,) = cache_dir.glob("*.jpg")
+    preprocessor.prepare(images[1])
+    (b_derivative,) = set(cache_dir.glob("*.jpg")) - {a_derivative}
+    os.utime(a_derivative, (1000, 1000))
+    os.utime(b_derivative, (1001, 1001))
+
+    # a is a cache hit, so b becomes the least recently used derivative
+    assert preprocessor.prepare(images[0]) == b"j" * 400
+    preprocessor.prepare(images[2])
+
+    assert a_derivative.exists()
+    assert not b_derivative.exists()
+    assert len(list(cache_dir.glob("*.jpg"))) == 2
+    assert preprocessor.evictions == 1
+    assert (cache_dir / "responses.db").exists()
+
+
+def test_a_lower_bound_evicts_when_the_cache_opens(tmp_path):
+    cache_dir = tmp_path / "vision_cache"
+    cache_dir.mkdir()
+    for index in range(4):
+        path = cache_dir / f"{index}.jpg"
+        path.write_bytes(b"j" * 100)
+        os.utime(path, (1000 + index, 1000 + index))
+
+    preprocessor = ImagePreprocessor(cache_dir, max_bytes=250)
+
+    assert sorted(path.name for path in cache_dir.glob("*.jpg")) == ["2.jpg", "3.jpg"]
+    assert preprocessor.evictions == 2
@@ -0,0 +1,43 @@
+import asyncio
+import os
+
+import process_media
+from agent_plugin.MediaCatalog import reset_catalogs
+from agent_plugin.Metrics import get_metrics
+
+# Enough of a JPEG for the header signature check, so no libmagic is needed
+JPEG_HEADER = b"\xff\xd8\xff\xe0\x00\x10JFIF\x00"
+
+
+def prepare_and_run(stages):
+    """One process_media.py run: reset the sample folder from the backup, then run the stages directly."""
+    reset_catalogs()
+    getattr(process_media, "__prepare_test_media_files")()
+    return asyncio.run(process_media.run_direct(os.environ["MEDIA_SOURCE_PATH"], stages))
+
+
+def test_second_run_skips_files_already_processed(tmp_path, monkeypatch):
+    backup_dir = tmp_path / "backup"
+    backup_dir.mkdir()
+    for index in range(5):
+        (backup_dir / f"photo{index}.jpg").write_bytes(JPEG_HEADER + os.urandom(256))
+    (tmp_path / "sample_media").mkdir()
+    monkeypatch.setenv("MEDIA_SOURCE_PATH", str(tmp_path / "sample_media" / "source"))
+    monkeypatch.setenv("MEDIA_BACKUP_PATH", str(backup_dir))
+    monkeypatch.setenv("MEDIA_STATE_DIR", str(tmp_path / "state"))
+    for name in ("MEDIA_MANIFEST_PATH", "RESULTS_STORE_PATH", "ALBUM_INDEX_PATH"):
+        monkeypatch.delenv(name, raising=False)
+    metrics = get_metrics()
+
+    first = prepare_and_run(["validate"])
+    assert first["validate"].processed == 5
+    hits = metrics.counter("cache_hits_total", cache="manifest", stage="media_type")
+    misses = metrics.counter("cache_misses_total", cache="manifest", stage="media_type")
+
+    # The sample folder is wiped and copied again, but the manifest lives in the state folder
+    second = prepare_and_run(["validate"])
+    assert second["validate"].processed == 5
+    assert metrics.counter("cache_hits_total", cache="manifest", stage="media_type") - hits == 5
+    assert metrics.counter("cache_misses_total", cache="manifest", stage="media_type") - misses == 0
+    assert (tmp_path / "state" / "manifest.db").exists()
+    assert not (tmp_path / "sample_media" / "manifest.db").exists()
@@ -0,0 +1,78 @@
+import os
+
+import pytest
+
+from agent_plugin.MediaCatalog import MediaCatalog, get_catalog, reset_catalogs
+from agent_plugin.MediaFile import MediaFile
+
+
+@pytest.fixture
+def sample(tmp_path):
+    (tmp_path / "source" / "trip").mkdir(parents=True)
+    (tmp_path / "source" / "a.jpg").write_bytes(b"a" * 10)
+    (tmp_path / "source" / "b.MOV").write_bytes(b"b" * 20)
+    (tmp_path / "source" / "notes.txt").write_bytes(b"n")
+    (tmp_path / "source" / "trip" / "c.png").write_bytes(b"c" * 30)
+    return tmp_path
+
+
+def names(records):
+    return sorted(media_file.name for media_file in records)
+
+
+def test_records_are_slotted():
+    media_file = MediaFile("/photos/a.jpg", 10, 5)
+    assert not hasattr(media_file, "__dict__")
+    with pytest.raises(AttributeError):
+        media_file.tags = ["dog"]
+    assert (media_file.kind, MediaFile.kind_of("b.MOV"), MediaFile.kind_of("c.txt")) == ("image", "video", "other")
+
+
+def test_one_scan_serves_every_listing(sample, monkeypatch):
+    catalog = MediaCatalog()
+    scans = []
+    real_scandir = os.scandir
+    monkeypatch.setattr(os, "scandir", lambda path: scans.append(path) or real_scandir(path))
+    source = sample / "source"
+
+    assert names(catalog.files(source)) == ["a.jpg", "b.MOV", "c.png", "notes.txt"]
+    assert names(catalog.files(source, recursive=False)) == ["a.jpg", "b.MOV", "notes.txt"]
+    assert names(catalog.files(source, kind="image")) == ["a.jpg", "c.png"]
+    assert names(catalog.files(source / "trip")) == ["c.png"]
+    # The root and its subfolder were scanned once, by the first listing
+    assert len(scans) == 2
+    assert catalog.get(source / "a.jpg").size == 10
+
+
+def test_stages_share_and_enrich_the_same_records(sample):
+    reset_catalogs()
+    source = sample / "source"
+    (first,) = get_catalog(sample).files(source, kind="video")
+    first.capture_date = "2021:06:01 12:00:00"
+
+    (again,) = get_catalog(str(sample) + os.sep).files(source, kind="video")
+    assert again is first
+    reset_catalogs()
+    assert get_catalog(sample).files(source, kind="video")[0].capture_date is None
+
+
+def test_moves_and_removals_keep_what_was_learned(sample):
+    catalog = MediaCatalog()
+    source, album = sample / "source", sample / "album"
+    album.mkdir()
+    catalog.files(album)
+    catalog.files(source)
+    media_file = catalog.get(source / "a.jpg")
+    media_file.results["object_detection"] = ["dog"]
+
+    os.rename(source / "a.jpg", album / "a.jpg")
+    catalog.relocate(source / "a.jpg", album / "a.jpg")
+    catalog.discard(source / "notes.txt")
+    (source / "d.jpg").write_bytes(b"d")
+    catalog.add(source / "d.jpg")
+
+    (moved,) = catalog.files(album)
+    assert moved is media_file
+    assert moved.path == str(album / "a.jpg")
+    assert moved.results == {"object_detection": ["dog"]}
+    assert names(catalog.files(source)) == ["b.MOV", "c.png", "d.jpg"]
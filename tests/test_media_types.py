@@ -0,0 +1,68 @@
+import pytest
+
+from agent_plugin import MediaTypeClassifier
+from agent_plugin.MediaTypeClassifier import classify, classify_all, is_media_mime
+
+HEADERS = {
+    "a.jpg": (b"\xff\xd8\xff\xe0" + b"\x00" * 20, "image/jpeg"),
+    "b.JPEG": (b"\xff\xd8\xff\xe1" + b"\x00" * 20, "image/jpeg"),
+    "c.png": (b"\x89PNG\r\n\x1a\n" + b"\x00" * 20, "image/png"),
+    "d.heic": (b"\x00\x00\x00\x18ftypheic" + b"\x00" * 20, "image/heic"),
+    "e.mp4": (b"\x00\x00\x00\x18ftypisom" + b"\x00" * 20, "video/mp4"),
+    "f.mov": (b"\x00\x00\x00\x14ftypqt  " + b"\x00" * 20, "video/quicktime"),
+    "g.mov": (b"\x00\x00\x00\x08wide" + b"\x00" * 20, "video/quicktime"),
+}
+
+
+class FakeMagic:
+    def __init__(self):
+        self.buffers = []
+
+    def from_buffer(self, header):
+        self.buffers.append(header)
+        return "application/octet-stream"
+
+
+@pytest.fixture
+def fake_magic(monkeypatch):
+    magic = FakeMagic()
+    monkeypatch.setattr(MediaTypeClassifier, "_magic_handle", lambda: magic)
+    return magic
+
+
+def test_camera_formats_are_classified_from_their_signature(tmp_path, fake_magic):
+    for name, (header, mime_type) in HEADERS.items():
+        (tmp_path / name).write_bytes(header)
+        assert classify(str(tmp_path / name)) == mime_type, name
+    assert fake_magic.buffers == []
+
+
+def test_mismatched_or_unknown_files_are_sniffed_from_the_header(tmp_path, fake_magic):
+    # A PNG named .jpg, and a HEIF brand named .mp4, do not match the signature of their extension
+    (tmp_path / "a.jpg").write_bytes(b"\x89PNG\r\n\x1a\n" + b"\x00" * 8000)
+    (tmp_path / "b.mp4").write_bytes(b"\x00\x00\x00\x18ftypheic")
+    (tmp_path / "c.txt").write_bytes(b"hello")
+    (tmp_path / "d.jpg").write_bytes(b"")
+
+    for name in ("a.jpg", "b.mp4", "c.txt"):
+        assert classify(str(tmp_path / name)) == "application/octet-stream"
+    assert classify(str(tmp_path / "d.jpg")) == "application/x-empty"
+    # Only the header is handed to libmagic
+    assert [len(buffer) for buffer in fake_magic.buffers] == [MediaTypeClassifier.HEADER_SIZE, 12, 5]
+
+
+def test_classify_all_reports_errors_per_file(tmp_path, fake_magic):
+    (tmp_path / "a.jpg").write_bytes(HEADERS["a.jpg"][0])
+    paths = [str(tmp_path / "a.jpg"), str(tmp_path / "missing.jpg")]
+
+    results = {path: (mime_type, error) for path, mime_type, error in classify_all(paths, max_workers=2)}
+
+    assert results[paths[0]] == ("image/jpeg", None)
+    assert isinstance(results[paths[1]][1], FileNotFoundError)
+
+
+def test_is_media_mime():
+    assert is_media_mime("image/heic")
+    assert is_media_mime("video/quicktime")
+    assert is_media_mime("audio/mpeg")
+    assert not is_media_mime("application/pdf")
@@ -0,0 +1,71 @@
+import os
+
+from agent_plugin import Metrics
+from agent_plugin.Metrics import MetricsRegistry, get_metrics, stage_run
+
+
+def test_counters_and_histograms_in_the_prometheus_text():
+    metrics = MetricsRegistry()
+    metrics.inc("files_total", 2, stage="exif")
+    metrics.inc("files_total", stage="exif")
+    metrics.record_file("yolo", 0.003, size=100)
+    metrics.inc("cache_hits_total", cache='resp"onse')
+
+    assert metrics.counter("files_total", stage="exif") == 3
+    assert metrics.counter("bytes_read_total", stage="yolo") == 100
+    text = metrics.prometheus_text()
+    assert "# TYPE photo_manager_files_total counter" in text
+    assert 'photo_manager_files_total{stage="exif"} 3' in text
+    assert 'photo_manager_cache_hits_total{cache="resp\\"onse"} 1' in text
+    assert "# TYPE photo_manager_file_seconds histogram" in text
+    # The buckets are cumulative: the 3 ms file is below 5 ms but not 2.5 ms
+    assert 'photo_manager_file_seconds_bucket{stage="yolo",le="0.0025"} 0' in text
+    assert 'photo_manager_file_seconds_bucket{stage="yolo",le="0.005"} 1' in text
+    assert 'photo_manager_file_seconds_bucket{stage="yolo",le="+Inf"} 1' in text
+    assert 'photo_manager_file_seconds_count{stage="yolo"} 1' in text
+
+
+def test_stage_summary_quantiles():
+    metrics = MetricsRegistry()
+    for _ in range(99):
+        metrics.record_file("exif", 0.002)
+    metrics.record_file("exif", 2.0)
+    metrics.observe("stage_seconds", 4.0, stage="exif")
+
+    row = metrics.stage_summary()["exif"]
+    assert row["files"] == 100
+    assert row["files_per_second"] == 25.0
+    assert row["p50"] == 0.0025
+    assert row["p99"] == 0.0025
+    assert metrics.quantile("file_seconds", 1.0, stage="exif") == 2.5
+
+
+def test_export_writes_the_textfile_atomically(tmp_path):
+    path = tmp_path / "nested" / "metrics.prom"
+    metrics = MetricsRegistry("prometheus", str(path))
+    metrics.inc("files_total", stage="exif")
+    metrics.export()
+
+    assert path.read_text() == metrics.prometheus_text()
+    assert os.listdir(path.parent) == ["metrics.prom"]
+
+
+def test_textfile_and_profiles_default_to_the_state_folder(tmp_path, monkeypatch, capsys):
+    monkeypatch.setenv("MEDIA_SOURCE_PATH", str(tmp_path / "sample_media"))
+    monkeypatch.setenv("MEDIA_STATE_DIR", str(tmp_path / "state"))
+    monkeypatch.setenv("METRICS_EXPORTER", "prometheus")
+    monkeypatch.setenv("PIPELINE_PROFILE", "1")
+    monkeypatch.delenv("METRICS_TEXTFILE_PATH", raising=False)
+    monkeypatch.delenv("PIPELINE_PROFILE_DIR", raising=False)
+    monkeypatch.setattr(Metrics, "_registry", None)
+
+    with stage_run("exif", tmp_path / "sample_media"):
+        get_metrics().inc("files_total", stage="exif")
+
+    state = tmp_path / "state"
+    assert get_metrics().textfile_path == str(state / "metrics.prom")
+    assert 'photo_manager_files_total{stage="exif"} 1' in (state / "metrics.prom").read_text()
+    profiles = sorted(path.suffix for path in (state / "profiles").iterdir())
+    assert profiles == [".prof", ".tracemalloc"]
+    assert not (tmp_path / "profiles").exists()
+    assert "Profile of stage exif" in capsys.readouterr().out
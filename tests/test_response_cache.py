@@ -0,0 +1,57 @@
+import time
+
+import pytest
+
+from agent_plugin.ResponseCache import ResponseCache
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = ResponseCache(tmp_path / "responses.db", max_bytes=100)
+    yield cache
+    cache.close()
+
+
+def test_keys_depend_on_every_part():
+    key = ResponseCache.make_key("detect", "image-hash", "prompt-hash", "gpt-4o", "low")
+    assert key == ResponseCache.make_key("detect", "image-hash", "prompt-hash", "gpt-4o", "low")
+    assert key != ResponseCache.make_key("detect", "image-hash", "prompt-hash", "gpt-4o", "high")
+    assert key != ResponseCache.make_key("detect", "image-hash", "other-prompt", "gpt-4o", "low")
+
+
+def test_hits_misses_and_stats(cache):
+    assert cache.get("a") is None
+    cache.put("a", "x" * 10)
+    assert cache.get("a") == "x" * 10
+    cache.put("a", "y" * 20)
+
+    assert cache.get("a") == "y" * 20
+    assert cache.stats() == {"hits": 2, "misses": 1, "hit_rate": 0.6667, "evictions": 0, "bytes": 20}
+
+
+def test_least_recently_used_entries_are_evicted(cache):
+    cache.put("a", "a" * 40)
+    time.sleep(0.01)
+    cache.put("b", "b" * 40)
+    time.sleep(0.01)
+    # a is read after b was written, so b is the least recently used
+    cache.get("a")
+    time.sleep(0.01)
+    cache.put("c", "c" * 40)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == "a" * 40
+    assert cache.get("c") == "c" * 40
+    assert cache.stats()["evictions"] == 1
+    assert cache.stats()["bytes"] == 80
+
+
+def test_entries_survive_a_reopen(tmp_path):
+    cache = ResponseCache(tmp_path / "responses.db")
+    cache.put("a", '{"tags": ["dog"]}')
+    cache.close()
+
+    reopened = ResponseCache(tmp_path / "responses.db")
+    assert reopened.get("a") == '{"tags": ["dog"]}'
+    assert reopened.stats()["bytes"] == len('{"tags": ["dog"]}')
+    reopened.close()
@@ -0,0 +1,65 @@
+import os
+import sqlite3
+
+import pytest
+
+from agent_plugin.ResultsStore import ResultsStore, get_results_store
+
+
+def stored_rows(store):
+    with sqlite3.connect(store.db_path) as conn:
+        return conn.execute("SELECT path, stage FROM results").fetchall()
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = ResultsStore(str(tmp_path / "results.db"), flush_every=3, flush_seconds=3600)
+    yield store
+    store.close()
+
+
+def test_records_are_buffered_until_a_batch_is_full(store, tmp_path):
+    store.add(tmp_path / "a.jpg", "object_detection", {"objects": ["dog"]})
+    store.add(tmp_path / "b.jpg", "object_detection", {"objects": []})
+
+    assert stored_rows(store) == []
+    # Buffered records are read without a flush
+    assert store.get(tmp_path / "a.jpg", "object_detection") == {"objects": ["dog"]}
+
+    store.add(tmp_path / "c.jpg", "object_detection", {"objects": ["cat"]})
+    assert len(stored_rows(store)) == 3
+
+
+def test_flush_writes_the_buffer_and_readding_replaces_the_record(store, tmp_path):
+    store.add(tmp_path / "a.jpg", "vision_analysis", {"summary": "old"})
+    store.flush()
+    store.add(tmp_path / "a.jpg", "vision_analysis", {"summary": "new"}, "a.jpg: new\n")
+    store.flush()
+
+    assert stored_rows(store) == [(os.path.abspath(tmp_path / "a.jpg"), "vision_analysis")]
+    assert store.get(tmp_path / "a.jpg", "vision_analysis") == {"summary": "new"}
+    assert store.get(tmp_path / "a.jpg", "object_detection") is None
+
+
+def test_query_filters_by_stage_folder_and_time(store, tmp_path):
+    store.add(tmp_path / "album" / "a.jpg", "object_detection", {"objects": ["dog"]}, "a.jpg: dog\n")
+    store.add(tmp_path / "album" / "a.jpg", "vision_analysis", {"summary": "a dog"})
+    store.add(tmp_path / "albums" / "b.jpg", "object_detection", {"objects": []})
+
+    detections = list(store.query(stage="object_detection", path_prefix=tmp_path / "album"))
+    assert [(record["path"], record["log"]) for record in detections] == \
+        [(os.path.abspath(tmp_path / "album" / "a.jpg"), "a.jpg: dog\n")]
+    assert len(list(store.query())) == 3
+
+    since = max(record["recorded_at"] for record in store.query()) + 1
+    assert list(store.query(since=since)) == []
+
+
+def test_default_store_lives_in_the_state_folder(tmp_path, monkeypatch):
+    monkeypatch.delenv("RESULTS_STORE_PATH", raising=False)
+    monkeypatch.setenv("MEDIA_STATE_DIR", str(tmp_path / "state"))
+
+    store = get_results_store(tmp_path / "sample_media")
+
+    assert store is get_results_store(tmp_path / "sample_media")
+    assert os.path.dirname(store.db_path) == str(tmp_path / "state")
@@ -0,0 +1,82 @@
+import asyncio
+import threading
+
+import pytest
+
+from agent_plugin.MediaCatalog import reset_catalogs
+from agent_plugin.StreamingPipeline import StreamingPipeline
+
+
+class FakeValidator:
+    """Passes every file but the {invalid} ones, counting the files it saw."""
+
+    def __init__(self, invalid=()):
+        self.invalid = set(invalid)
+        self.validated = []
+
+    def validate_file(self, media_file, defective_dir, manifest=None, catalog=None):
+        self.validated.append(media_file.name)
+        if media_file.name in self.invalid:
+            raise OSError("unreadable")
+        return True
+
+
+class BlockingRouter:
+    """Routes every image at low detail once {release} is set."""
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.routed = []
+
+    def route_file(self, media_file, policy, store=None):
+        self.release.wait(10)
+        self.routed.append(media_file.name)
+        return {"route": "low"}
+
+
+@pytest.fixture
+def sample(tmp_path, monkeypatch):
+    source = tmp_path / "sample_media" / "source"
+    source.mkdir(parents=True)
+    for index in range(20):
+        (source / f"photo{index:02}.jpg").write_bytes(b"\xff\xd8\xff" + bytes([index]))
+    monkeypatch.setenv("MEDIA_STATE_DIR", str(tmp_path / "state"))
+    monkeypatch.setenv("MEDIA_TYPE_WORKERS", "1")
+    for name in ("MEDIA_MANIFEST_PATH", "RESULTS_STORE_PATH", "ALBUM_INDEX_PATH", "METRICS_EXPORTER"):
+        monkeypatch.delenv(name, raising=False)
+    reset_catalogs()
+    return tmp_path / "sample_media"
+
+
+def test_a_slow_stage_holds_back_the_files_upstream(sample):
+    validator, router = FakeValidator(), BlockingRouter()
+    pipeline = StreamingPipeline(sample, {"validate": validator, "route": router}, queue_size=2)
+
+    async def run():
+        task = asyncio.create_task(pipeline.run(sample / "source"))
+        while len(validator.validated) < 4:
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.2)
+        # One file in the router, two queued for it, one waiting to be queued by the validator
+        stalled = len(validator.validated)
+        router.release.set()
+        return stalled, await task
+
+    stalled, stats = asyncio.run(run())
+
+    assert stalled == 4
+    assert len(router.routed) == 20
+    assert stats["validate"] == {"processed": 20, "passed": 20, "failed": 0}
+    assert stats["route"] == {"processed": 20, "passed": 20, "failed": 0}
+
+
+def test_a_failing_file_does_not_stop_the_others(sample, capsys):
+    validator, router = FakeValidator(invalid={"photo03.jpg"}), BlockingRouter()
+    router.release.set()
+    pipeline = StreamingPipeline(sample, {"validate": validator, "route": router}, queue_size=2)
+
+    stats = asyncio.run(pipeline.run(sample / "source"))
+
+    assert stats["validate"] == {"processed": 20, "passed": 19, "failed": 1}
+    assert "photo03.jpg" not in router.routed and len(router.routed) == 19
+    assert "ERROR: Unable to validate" in capsys.readouterr().out
@@ -0,0 +1,106 @@
+import json
+import os
+import stat
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import pytest
+
+from agent_plugin import VideoProbe
+from agent_plugin.VideoProbe import capture_date_from_tags, ffmpeg_tool, read_video_date
+
+
+@pytest.fixture
+def utc(monkeypatch):
+    monkeypatch.setenv("TZ", "UTC")
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+
+def probe(format_tags=None, *stream_tags):
+    return {"format": {"tags": format_tags or {}}, "streams": [{"tags": tags} for tags in stream_tags]}
+
+
+def test_the_apple_local_date_wins_over_creation_time(utc):
+    tags = {"creation_time": "2021-06-01T10:30:00.000000Z",
+            "com.apple.quicktime.creationdate": "2021-06-01T12:30:00+0200"}
+    assert capture_date_from_tags(probe(tags)) == (True, "2021:06:01 12:30:00")
+
+
+def test_creation_time_is_converted_from_utc(monkeypatch):
+    monkeypatch.setenv("TZ", "EST+05")
+    time.tzset()
+    try:
+        assert capture_date_from_tags(probe({}, {"CREATION_TIME": "2021-06-01T10:30:00Z"})) == \
+            (True, "2021:06:01 05:30:00")
+    finally:
+        monkeypatch.undo()
+        time.tzset()
+
+
+def test_placeholder_and_missing_dates(utc):
+    assert capture_date_from_tags(probe({"creation_time": "1904-01-01T00:00:00Z"})) == (True, None)
+    assert capture_date_from_tags(probe({"creation_time": "not a date"})) == (True, None)
+    assert capture_date_from_tags(probe({"encoder": "Lavf58"})) == (True, None)
+    assert capture_date_from_tags({}) == (False, None)
+
+
+def fake_ffprobe(folder, output, exit_code=0):
+    """Writes an ffprobe script that records its arguments and prints {output}."""
+    folder.mkdir(exist_ok=True)
+    script = folder / "ffprobe"
+    script.write_text(f"#!/bin/sh\necho \"$@\" > {folder / 'args'}\ncat <<'EOF'\n{output}\nEOF\nexit {exit_code}\n")
+    script.chmod(script.stat().st_mode | stat.S_IEXEC)
+    return script
+
+
+@pytest.mark.skipif(os.name == "nt", reason="the fake ffprobe is a shell script")
+def test_read_video_date_probes_the_header_only(tmp_path, monkeypatch, utc):
+    folder = tmp_path / "ffmpeg"
+    fake_ffprobe(folder, json.dumps(probe({"creation_time": "2021-06-01T10:30:00Z"})))
+    monkeypatch.setenv("FFMPEG_FOLDER", str(folder))
+
+    assert ffmpeg_tool("ffprobe") == str(folder / "ffprobe")
+    assert read_video_date(tmp_path / "clip.mov") == (True, "2021:06:01 10:30:00")
+    args = (folder / "args").read_text().split()
+    assert args[args.index("-probesize") + 1] == str(VideoProbe.PROBE_SIZE)
+    assert args[-1] == str(tmp_path / "clip.mov")
+
+
+@pytest.mark.skipif(os.name == "nt", reason="the fake ffprobe is a shell script")
+def test_read_video_date_reports_ffprobe_errors(tmp_path, monkeypatch):
+    folder = tmp_path / "ffmpeg"
+    fake_ffprobe(folder, "", exit_code=1)
+    monkeypatch.setenv("FFMPEG_FOLDER", str(folder))
+
+    with pytest.raises(RuntimeError, match="ffprobe exited with 1"):
+        read_video_date(tmp_path / "clip.mov")
+
+
+def test_concurrent_probes_are_bounded(monkeypatch):
+    monkeypatch.setenv("VIDEO_PROBE_WORKERS", "2")
+    monkeypatch.setattr(VideoProbe, "_probe_slots", None)
+    monkeypatch.setattr(VideoProbe, "ffmpeg_tool", lambda name: "/usr/bin/ffprobe")
+    running = []
+    peak = []
+    lock = threading.Lock()
+
+    def run(command, **kwargs):
+        with lock:
+            running.append(command[-1])
+            peak.append(len(running))
+        time.sleep(0.02)
+        with lock:
+            running.remove(command[-1])
+        return SimpleNamespace(returncode=0, stdout=b"{}", stderr=b"")
+
+    monkeypatch.setattr(VideoProbe.subprocess, "run", run)
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(read_video_date, [f"{index}.mov" for index in range(8)]))
+
+    assert results == [(False, None)] * 8
+    assert max(peak) == 2
@@ -0,0 +1,113 @@
+import io
+import json
+import queue
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("numpy")
+
+from agent_plugin import VideoFrameSampler  # noqa: E402
+from agent_plugin.VideoFrameSampler import aggregate_detections, sampling_settings  # noqa: E402
+
+
+def detection(name, confidence):
+    return {"name": name, "confidence": confidence}
+
+
+def test_aggregate_detections_summarizes_the_frames():
+    summary = aggregate_detections([
+        (0.0, [detection("dog", 0.6), detection("dog", 0.7)]),
+        (1.0, []),
+        (2.0, [detection("person", 0.9), detection("dog", 0.8)]),
+        (3.5, [detection("person", 0.5)]),
+    ])
+
+    assert summary["objects"] == ["dog", "person"]
+    assert summary["frames"] == 4
+    assert summary["detections"]["dog"] == {"first": 0.0, "last": 2.0, "frames": 2, "max_confidence": 0.8}
+    assert summary["detections"]["person"] == {"first": 2.0, "last": 3.5, "frames": 2, "max_confidence": 0.9}
+    assert summary["timeline"] == [{"time": 0.0, "objects": ["dog"]}, {"time": 2.0, "objects": ["person", "dog"]},
+                                   {"time": 3.5, "objects": ["person"]}]
+    assert aggregate_detections([]) == {"objects": [], "frames": 0, "detections": {}, "timeline": []}
+
+
+def test_sampling_settings_from_the_environment(monkeypatch):
+    for name in ("VIDEO_SAMPLE_MODE", "VIDEO_SAMPLE_INTERVAL", "VIDEO_SCENE_THRESHOLD", "VIDEO_MAX_FRAMES"):
+        monkeypatch.delenv(name, raising=False)
+    assert sampling_settings() == {"mode": "keyframes", "interval": 1.0, "scene_threshold": 0.3, "max_frames": 300}
+
+    monkeypatch.setenv("VIDEO_SAMPLE_MODE", "scene")
+    monkeypatch.setenv("VIDEO_MAX_FRAMES", "50")
+    assert sampling_settings()["mode"] == "scene" and sampling_settings()["max_frames"] == 50
+
+    monkeypatch.setenv("VIDEO_SAMPLE_MODE", "every")
+    with pytest.raises(ValueError, match="VIDEO_SAMPLE_MODE"):
+        sampling_settings()
+
+
+@pytest.mark.parametrize("stream, expected", [
+    ({"width": 1920, "height": 1080}, (640, 360)),
+    ({"width": 1920, "height": 1080, "tags": {"rotate": "90"}}, (360, 640)),
+    ({"width": 1920, "height": 1080, "side_data_list": [{"rotation": -90}]}, (360, 640)),
+    ({"width": 321, "height": 241}, (320, 240)),
+])
+def test_frames_fit_the_model_input_after_rotation(monkeypatch, stream, expected):
+    monkeypatch.setattr(VideoFrameSampler, "ffmpeg_tool", lambda name: "/usr/bin/ffprobe")
+    output = json.dumps({"streams": [stream]}).encode()
+    monkeypatch.setattr(VideoFrameSampler.subprocess, "run",
+                        lambda command, **kwargs: SimpleNamespace(returncode=0, stdout=output, stderr=b""))
+
+    assert VideoFrameSampler._frame_size("clip.mov", 640) == expected
+
+
+def test_frame_timestamps_are_read_from_showinfo():
+    stderr = io.BytesIO(b"[Parsed_showinfo_2] n:   0 pts:      0 pts_time:0       duration:512\n"
+                        b"frame=    1 fps=0.0 q=-0.0 size=N/A\n"
+                        b"[Parsed_showinfo_2] n:   1 pts:  15360 pts_time:1.5     duration:512\n")
+    timestamps = queue.Queue()
+
+    VideoFrameSampler._read_timestamps(stderr, timestamps)
+
+    assert [timestamps.get_nowait() for _ in range(3)] == [0.0, 1.5, None]
+
+
+def test_detect_video_stores_the_summary_once(tmp_path, monkeypatch):
+    from agent_plugin.ContentAnalystPlugin import ContentAnalystPlugin
+    from agent_plugin.MediaFile import MediaFile
+    from agent_plugin.MediaManifest import MediaManifest
+
+    for name in ("VIDEO_SAMPLE_MODE", "VIDEO_SAMPLE_INTERVAL", "VIDEO_SCENE_THRESHOLD", "VIDEO_MAX_FRAMES"):
+        monkeypatch.delenv(name, raising=False)
+    frames_read = []
+
+    def iter_frames(video_path, max_side, **settings):
+        for timestamp in (0.0, 1.0, 2.0):
+            frames_read.append(timestamp)
+            yield timestamp, None
+
+    class FakeEngine:
+        imgsz = 640
+
+        def detect_arrays(self, frames):
+            for timestamp, _ in frames:
+                yield timestamp, [detection("cat", 0.9)] if timestamp >= 1.0 else []
+
+    monkeypatch.setattr(VideoFrameSampler, "iter_frames", iter_frames)
+    (tmp_path / "clip.mov").write_bytes(b"\x00\x00\x00\x08wide")
+    manifest = MediaManifest(str(tmp_path / "manifest.db"))
+    plugin = ContentAnalystPlugin()
+    video = MediaFile(str(tmp_path / "clip.mov"))
+
+    assert plugin.cached_video(video, manifest) is None
+    summary = plugin.detect_video(FakeEngine(), video, manifest)
+
+    assert summary["objects"] == ["cat"] and summary["frames"] == 3
+    assert summary["detections"]["cat"]["first"] == 1.0
+    assert video.results[plugin.STAGE] == ["cat"]
+    assert plugin.cached_video(MediaFile(video.path), manifest) == summary
+    # Other sampling settings analyze the video again
+    monkeypatch.setenv("VIDEO_SAMPLE_MODE", "scene")
+    assert plugin.cached_video(MediaFile(video.path), manifest) is None
+    assert len(frames_read) == 3
+    manifest.close()
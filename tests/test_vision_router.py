@@ -0,0 +1,113 @@
+import json
+
+import pytest
+
+from agent_plugin.ExpertContentAnalystPlugin import ExpertContentAnalystPlugin
+from agent_plugin.MediaFile import MediaFile
+from agent_plugin.ResultsStore import ResultsStore
+from agent_plugin.VisionRouter import DEFAULT_POLICY, ROUTE_STAGE, load_policy, route_image, rule_matches
+from agent_plugin.VisionRouterPlugin import VisionRouterPlugin
+
+
+def detections(*pairs):
+    return [{"name": name, "confidence": confidence} for name, confidence in pairs]
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = ResultsStore(str(tmp_path / "results.db"))
+    yield store
+    store.close()
+
+
+def test_rule_conditions():
+    dogs = detections(("dog", 0.9), ("dog", 0.7))
+    assert rule_matches({}, [])
+    assert rule_matches({"classes": ["dog"]}, dogs)
+    assert not rule_matches({"classes": ["cat"]}, dogs)
+    assert not rule_matches({"classes": ["dog"], "only": True}, dogs + detections(("person", 0.9)))
+    assert rule_matches({"classes": ["dog"], "min_objects": 2, "max_objects": 2}, dogs)
+    assert not rule_matches({"classes": ["dog"], "max_objects": 1}, dogs)
+    assert not rule_matches({"classes": ["dog"], "min_score": 0.8}, dogs)
+    assert rule_matches({"min_objects": 3}, dogs + detections(("cat", 0.5)))
+
+
+def test_route_image_with_the_default_policy():
+    assert route_image(None, DEFAULT_POLICY) == ("low", "no object detection")
+    assert route_image(detections(("book", 0.6)), DEFAULT_POLICY) == ("high", "text")
+    assert route_image(detections(*[("person", 0.9)] * 4), DEFAULT_POLICY) == ("high", "group")
+    assert route_image(detections(("dog", 0.95)), DEFAULT_POLICY) == ("skip", "single subject")
+    # Detections under min_confidence are ignored by every rule
+    assert route_image(detections(("dog", 0.95), ("book", 0.1)), DEFAULT_POLICY) == ("skip", "single subject")
+    assert route_image(detections(("dog", 0.6)), DEFAULT_POLICY) == ("low", "default")
+
+
+def test_load_policy_rejects_unknown_routes(tmp_path):
+    policy_path = tmp_path / "policy.json"
+    policy_path.write_text(json.dumps({"default": "high"}))
+    assert load_policy(str(policy_path))["rules"] == DEFAULT_POLICY["rules"]
+
+    policy_path.write_text(json.dumps({"rules": [{"name": "bad", "route": "medium"}]}))
+    with pytest.raises(ValueError):
+        load_policy(str(policy_path))
+
+
+def test_near_duplicates_are_routed_by_their_representative(tmp_path, store):
+    representative = MediaFile(str(tmp_path / "a.jpg"))
+    duplicate = MediaFile(str(tmp_path / "b.jpg"))
+    store.add(representative.path, "object_detection", {"objects": ["book"], "detections": detections(("book", 0.9))})
+    store.add(duplicate.path, "object_detection", {"objects": ["book"], "duplicate_of": representative.path})
+
+    decision = VisionRouterPlugin().route_file(duplicate, DEFAULT_POLICY, store)
+
+    assert decision["route"] == "high"
+    assert store.get(duplicate.path, ROUTE_STAGE) == decision
+
+
+def test_expert_stage_reloads_the_decisions_of_an_earlier_run(tmp_path, store):
+    router = VisionRouterPlugin()
+    for name, found in (("skip.jpg", detections(("cat", 0.9))), ("high.jpg", detections(("laptop", 0.9)))):
+        path = str(tmp_path / name)
+        store.add(path, "object_detection", {"objects": [d["name"] for d in found], "detections": found})
+        router.route_file(MediaFile(path), DEFAULT_POLICY, store)
+    store.flush()
+    expert = ExpertContentAnalystPlugin()
+
+    # Records of a later run carry no decision in memory
+    skipped, escalated, unrouted = (MediaFile(str(tmp_path / name)) for name in ("skip.jpg", "high.jpg", "new.jpg"))
+
+    assert expert.detail_level_of(skipped, "low", store) is None
+    assert expert.detail_level_of(escalated, "low", store) == "high"
+    assert escalated.results[ROUTE_STAGE]["reason"] == "text"
+    assert expert.detail_level_of(unrouted, "low", store) == "low"
+    assert expert.detail_level_of(MediaFile(str(tmp_path / "high.jpg")), "low") == "low"
+
+
+def test_detections_survive_a_manifest_cache_hit_without_store_records(tmp_path, store):
+    from agent_plugin.ContentAnalystPlugin import ContentAnalystPlugin
+    from agent_plugin.MediaManifest import MediaManifest
+
+    manifest = MediaManifest(str(tmp_path / "manifest.db"))
+    content = ContentAnalystPlugin()
+    found = detections(("book", 0.9))
+    (tmp_path / "a.jpg").write_bytes(b"a" * 100)
+    (tmp_path / "b.jpg").write_bytes(b"b" * 100)
+    representative, duplicate = MediaFile(str(tmp_path / "a.jpg")), MediaFile(str(tmp_path / "b.jpg"))
+    duplicate.duplicate_of = representative
+    content.record_objects(representative, found, manifest, store)
+    assert content.reuse_representative(duplicate, manifest, store)
+
+    # Moved files and a new results store: only the manifest still knows the content
+    moved = tmp_path / "moved"
+    moved.mkdir()
+    new_store = ResultsStore(str(tmp_path / "new_results.db"))
+    router = VisionRouterPlugin()
+    for name in ("a.jpg", "b.jpg"):
+        (tmp_path / name).rename(moved / name)
+        media_file = MediaFile(str(moved / name))
+        assert router.detections_of(media_file, new_store) is None
+        assert content.cached_objects(media_file, manifest, new_store) == ["book"]
+        assert router.detections_of(media_file, new_store) == found
+        assert router.route_file(media_file, DEFAULT_POLICY, new_store)["route"] == "high"
+    new_store.close()
+    manifest.close()
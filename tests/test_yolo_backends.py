@@ -0,0 +1,119 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from agent_plugin import ModelRegistry, YoloBackends, YoloExport  # noqa: E402
+from agent_plugin.YoloBackends import nms, postprocess, preprocess  # noqa: E402
+
+
+def raw_output(*anchors):
+    """Returns the (1, 4 + classes, anchors) output of an exported model for (cx, cy, w, h, scores...) anchors."""
+    return np.array([np.array(anchors, dtype=np.float32).T])
+
+
+def test_postprocess_keeps_the_best_box_per_object_and_class():
+    output = raw_output([50, 50, 20, 20, 0.9, 0.0],
+                        [52, 50, 20, 20, 0.8, 0.0],   # same object, same class: suppressed
+                        [52, 50, 20, 20, 0.0, 0.85],  # same place, other class: kept
+                        [10, 10, 5, 5, 0.1, 0.05])    # under the confidence threshold
+
+    (detections,) = postprocess(output, conf=0.25)
+
+    np.testing.assert_allclose(detections, [[40, 40, 60, 60, 0.9, 0], [42, 40, 62, 60, 0.85, 1]], rtol=1e-5)
+    assert postprocess(raw_output([10, 10, 5, 5, 0.1, 0.05]), conf=0.25)[0].shape == (0, 6)
+
+
+def test_nms_orders_by_score():
+    boxes = np.array([[0, 0, 10, 10], [100, 100, 110, 110], [1, 1, 11, 11]], dtype=np.float32)
+    assert nms(boxes, np.array([0.5, 0.9, 0.8]), 0.7).tolist() == [1, 2]
+
+
+def test_preprocess_builds_an_rgb_nchw_batch():
+    blue = np.zeros((2, 3, 3), dtype=np.uint8)
+    blue[..., 0] = 255
+
+    batch = preprocess([blue, blue])
+
+    assert batch.shape == (2, 3, 2, 3) and batch.dtype == np.float32
+    assert batch[:, 2].min() == 1.0 and batch[:, :2].max() == 0.0
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    monkeypatch.setattr(ModelRegistry, "_backends", {})
+    for name in ("YOLO_INT8", "YOLO_REPLICAS", "YOLO_THREADS"):
+        monkeypatch.delenv(name, raising=False)
+    created = []
+
+    def create_backend(backend, model_path, names=None, imgsz=640, threads=1, render=False):
+        created.append((backend, model_path, names, imgsz))
+        return object()
+
+    monkeypatch.setattr(YoloBackends, "create_backend", create_backend)
+    monkeypatch.setattr(YoloExport, "export_model",
+                        lambda weights, backend, imgsz, int8: (f"{weights}-{imgsz}.{backend}", {0: "person"}))
+    return created
+
+
+def test_backends_are_created_once_per_setting(registry, monkeypatch):
+    monkeypatch.setenv("YOLO_BACKEND", "ONNX")
+
+    runner = ModelRegistry.get_yolo_backend("yolov8n.pt", 320)
+
+    assert ModelRegistry.get_yolo_backend("yolov8n.pt", 320) is runner
+    assert ModelRegistry.get_yolo_backend("yolov8n.pt", 640) is not runner
+    assert registry == [("onnx", "yolov8n.pt-320.onnx", {0: "person"}, 320),
+                        ("onnx", "yolov8n.pt-640.onnx", {0: "person"}, 640)]
+
+
+def test_invalid_backend_settings(registry, monkeypatch):
+    monkeypatch.setenv("YOLO_BACKEND", "tensorrt")
+    with pytest.raises(ValueError, match="Unknown YOLO_BACKEND"):
+        ModelRegistry.get_yolo_backend()
+
+    monkeypatch.setenv("YOLO_BACKEND", "torch")
+    monkeypatch.setenv("YOLO_INT8", "1")
+    with pytest.raises(ValueError, match="YOLO_INT8"):
+        ModelRegistry.get_yolo_backend()
+    assert registry == []
+
+
+class FakeBackend:
+    """Finds one person in the top-left square of every letterboxed image, recording the batch sizes."""
+
+    names = {0: "person"}
+
+    def __init__(self):
+        self.batches = []
+
+    def infer(self, images, conf):
+        self.batches.append(len(images))
+        return [np.array([[0, 16, 32, 48, 0.9, 0]], dtype=np.float32) for _ in images]
+
+
+def test_engine_batches_and_maps_boxes_back_to_the_original_image(monkeypatch):
+    pytest.importorskip("cv2")
+    pytest.importorskip("PIL")
+    from agent_plugin import YoloInferenceEngine as engine_module
+
+    def read_image(image_path):
+        if image_path == "broken.jpg":
+            raise ValueError("cannot decode")
+        return np.zeros((100, 200, 3), dtype=np.uint8)
+
+    monkeypatch.setattr(engine_module, "read_image", read_image)
+    backend = FakeBackend()
+    engine = engine_module.YoloInferenceEngine(backend, batch_size=2, imgsz=64)
+
+    frames = list(engine.detect_arrays((index, np.zeros((100, 200, 3), dtype=np.uint8)) for index in range(5)))
+    assert backend.batches == [2, 2, 1]
+    # 200x100 is scaled by 0.32 and padded by 16 pixels at the top and bottom
+    assert frames[0] == (0, [{"name": "person", "confidence": 0.9, "box": [0.0, 0.0, 100.0, 100.0]}])
+
+    backend.batches = []
+    results = {path: (detections, error) for path, detections, error in
+               engine.detect(["a.jpg", "broken.jpg", "b.jpg", "c.jpg"])}
+    assert sorted(results) == ["a.jpg", "b.jpg", "broken.jpg", "c.jpg"]
+    assert isinstance(results["broken.jpg"][1], ValueError) and results["broken.jpg"][0] == []
+    assert results["c.jpg"][1] is None and len(results["c.jpg"][0]) == 1
+    assert sum(backend.batches) == 3 and max(backend.batches) <= 2
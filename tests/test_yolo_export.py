@@ -0,0 +1,41 @@
+from agent_plugin import YoloExport
+
+
+class FakeModel:
+    """Stands in for the ultralytics model: export() writes a file and counts the exports."""
+
+    names = {0: "person", 1: "dog"}
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.exports = 0
+
+    def export(self, format, **options):
+        self.exports += 1
+        exported = self.folder / f"export-{self.exports}.{format}"
+        exported.write_bytes(b"model")
+        return str(exported)
+
+
+def test_second_run_reuses_the_exported_model(tmp_path, monkeypatch):
+    sample_dir = tmp_path / "sample_media"
+    sample_dir.mkdir()
+    monkeypatch.setenv("MEDIA_SOURCE_PATH", str(sample_dir / "source"))
+    monkeypatch.setenv("MEDIA_STATE_DIR", str(tmp_path / "state"))
+    monkeypatch.delenv("YOLO_MODEL_DIR", raising=False)
+    model = FakeModel(tmp_path)
+    monkeypatch.setattr(YoloExport, "get_yolo_model", lambda weights: model)
+
+    model_path, names = YoloExport.export_model("yolov8n.pt", "onnx", imgsz=320)
+    # The sample folder is reset before every run; the exported model is not in it
+    assert model_path.parent == tmp_path / "state" / "models"
+    assert not (sample_dir / "models").exists()
+
+    assert YoloExport.export_model("yolov8n.pt", "onnx", imgsz=320) == (model_path, names)
+    assert model.exports == 1
+    assert names == {0: "person", 1: "dog"}
+
+
+def test_model_dir_override(tmp_path, monkeypatch):
+    monkeypatch.setenv("YOLO_MODEL_DIR", str(tmp_path / "models"))
+    assert YoloExport.model_dir() == tmp_path / "models"